@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+import weakref
+from collections import defaultdict, deque
+from typing import Optional
+
+from django.conf import settings
+
+from apps.common import metrics
+
+
+# Admission control in front of upstream calls, per process. Each model alias
+# has a concurrency limit, of which CHAT_ADMISSION_INTERACTIVE_RESERVE slots are
+# kept for interactive requests, one bounded FIFO queue per priority class
+# (interactive is always served first) and, if configured, a tokens-per-minute
+# bucket debited with the usage each call reports. A user holds at most
+# CHAT_ADMISSION_USER_CONCURRENCY calls per class at once, so their own batch
+# work never holds back their chat; the rest of theirs wait.
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+
+class Rejected(Exception):
+    """The call cannot be admitted soon enough; retry after ``retry_after`` seconds."""
+
+    def __init__(self, reason: str, retry_after: float) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class _Bucket:
+    __slots__ = ("rate", "capacity", "level", "updated")
+
+    def __init__(self, per_minute: int) -> None:
+        self.rate = per_minute / 60
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def debit(self, tokens: int) -> None:
+        # May go negative: usage is only known afterwards, later calls wait it out
+        self._refill()
+        self.level -= tokens
+
+    def wait(self) -> float:
+        """Seconds until the bucket has tokens again."""
+        self._refill()
+        return 0.0 if self.level > 0 else (1 - self.level) / self.rate
+
+
+class _Waiter:
+    __slots__ = ("future", "user")
+
+    def __init__(self, future: asyncio.Future, user: Optional[str]) -> None:
+        self.future = future
+        self.user = user
+
+
+class _Model:
+    __slots__ = ("limit", "active", "queues", "bucket", "timer")
+
+    def __init__(self, model: str) -> None:
+        self.limit = settings.CHAT_ADMISSION_MODEL_LIMITS.get(model, settings.CHAT_ADMISSION_MODEL_CONCURRENCY)
+        self.active = 0
+        self.queues: dict[str, deque[_Waiter]] = {p: deque() for p in PRIORITIES}
+        tpm = settings.CHAT_ADMISSION_MODEL_TPM.get(model)
+        self.bucket = _Bucket(tpm) if tpm else None
+        # Re-dispatch once the bucket has refilled
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def has_room(self, priority: str) -> bool:
+        slots = self.limit if priority == INTERACTIVE else self.limit - settings.CHAT_ADMISSION_INTERACTIVE_RESERVE
+        return self.active < max(slots, 1) and (self.bucket is None or self.bucket.wait() == 0)
+
+    def retry_after(self) -> float:
+        return self.bucket.wait() if self.bucket is not None else 1.0
+
+
+class Ticket:
+    """An admitted upstream call; ``release`` it with the tokens it used when the call ends.
+
+    Releasing is idempotent, and ``with ticket:`` releases on exit. A ticket
+    handed to code that may never run (a response body the client never
+    reads) gets a ``lease``: it is released after that many seconds unless
+    the call ``claim``s it first.
+    """
+
+    __slots__ = ("model", "user", "_controller", "_released", "_lease")
+
+    def __init__(self, controller: _Controller, model: str, user: Optional[str]) -> None:
+        self.model = model
+        self.user = user
+        self._controller = controller
+        self._released = False
+        self._lease: Optional[asyncio.TimerHandle] = None
+
+    def lease(self, seconds: float) -> None:
+        self.claim()
+        self._lease = asyncio.get_running_loop().call_later(seconds, self._expire)
+
+    def claim(self) -> None:
+        if self._lease is not None:
+            self._lease.cancel()
+            self._lease = None
+
+    def _expire(self) -> None:
+        self._lease = None
+        if not self._released:
+            metrics.incr("chat_admission_unclaimed", model=self.model)
+            self.release()
+
+    def release(self, tokens: int = 0) -> None:
+        self.claim()
+        if not self._released:
+            self._released = True
+            self._controller.release(self, tokens)
+
+    def __enter__(self) -> Ticket:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class _Controller:
+    def __init__(self) -> None:
+        self.models: dict[str, _Model] = {}
+        # Admitted calls per user and class, across models
+        self.users: "defaultdict[str, int]" = defaultdict(int)
+
+    def _model(self, model: str) -> _Model:
+        m = self.models.get(model)
+        if m is None:
+            m = self.models[model] = _Model(model)
+        return m
+
+    def _user_has_room(self, user: Optional[str]) -> bool:
+        cap = settings.CHAT_ADMISSION_USER_CONCURRENCY
+        return user is None or cap <= 0 or self.users.get(user, 0) < cap
+
+    def _admit(self, m: _Model, model: str, user: Optional[str]) -> Ticket:
+        m.active += 1
+        if user is not None:
+            self.users[user] += 1
+        return Ticket(self, model, user)
+
+    def _admits_now(self, m: _Model, user: Optional[str], priority: str) -> bool:
+        ahead = any(m.queues[p] for p in PRIORITIES[:PRIORITIES.index(priority) + 1])
+        return not ahead and m.has_room(priority) and self._user_has_room(user)
+
+    def try_acquire(self, model: str, user: Optional[str], priority: str) -> Ticket:
+        m = self._model(model)
+        user = None if user is None else f"{priority}:{user}"
+        if not self._admits_now(m, user, priority):
+            raise _rejected(model, priority, "busy", m.retry_after())
+        return self._admit(m, model, user)
+
+    async def acquire(self, model: str, user: Optional[str], priority: str) -> Ticket:
+        m = self._model(model)
+        user = None if user is None else f"{priority}:{user}"
+        if self._admits_now(m, user, priority):
+            return self._admit(m, model, user)
+        queue = m.queues[priority]
+        if len(queue) >= settings.CHAT_ADMISSION_QUEUE_SIZE:
+            raise _rejected(model, priority, "queue_full", m.retry_after())
+        if m.bucket is not None and m.bucket.wait() > settings.CHAT_ADMISSION_QUEUE_TIMEOUT:
+            # Out of tokens for longer than anyone may wait
+            raise _rejected(model, priority, "rate_limited", m.bucket.wait())
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), user)
+        queue.append(waiter)
+        # Slots may be free and only held back by other users' caps
+        self._dispatch(m)
+        started = time.monotonic()
+        try:
+            await asyncio.wait((waiter.future,), timeout=settings.CHAT_ADMISSION_QUEUE_TIMEOUT)
+        except asyncio.CancelledError:
+            if waiter.future.done():
+                # Granted just as the caller went away: pass the slot on
+                Ticket(self, model, user).release()
+            else:
+                self._leave(queue, waiter)
+            raise
+        if not waiter.future.done():
+            self._leave(queue, waiter)
+            raise _rejected(model, priority, "queue_timeout", m.retry_after())
+        metrics.observe("chat_admission_wait_seconds", time.monotonic() - started, priority=priority)
+        # The slot was taken for us in _dispatch
+        return Ticket(self, model, user)
+
+    @staticmethod
+    def _leave(queue: deque[_Waiter], waiter: _Waiter) -> None:
+        waiter.future.cancel()
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, ticket: Ticket, tokens: int) -> None:
+        m = self._model(ticket.model)
+        m.active -= 1
+        if ticket.user is not None:
+            self.users[ticket.user] -= 1
+            if not self.users[ticket.user]:
+                del self.users[ticket.user]
+        if tokens > 0 and m.bucket is not None:
+            m.bucket.debit(tokens)
+        # A user's freed slot may unblock their waiters on any model
+        for other in self.models.values():
+            self._dispatch(other)
+
+    def _dispatch(self, m: _Model) -> None:
+        # Stops at the first waiter without room, so a lower class never
+        # overtakes a higher one; waiters of users at their cap are skipped
+        for priority in PRIORITIES:
+            queue = m.queues[priority]
+            for waiter in list(queue):
+                if not m.has_room(priority):
+                    self._schedule(m)
+                    return
+                if waiter.future.done():
+                    queue.remove(waiter)
+                    continue
+                if not self._user_has_room(waiter.user):
+                    continue
+                queue.remove(waiter)
+                m.active += 1
+                if waiter.user is not None:
+                    self.users[waiter.user] += 1
+                waiter.future.set_result(None)
+
+    def _schedule(self, m: _Model) -> None:
+        if m.bucket is None or m.timer is not None:
+            return
+        wait = m.bucket.wait()
+        if wait > 0:
+            m.timer = asyncio.get_running_loop().call_later(wait, self._refilled, m)
+
+    def _refilled(self, m: _Model) -> None:
+        m.timer = None
+        self._dispatch(m)
+
+
+def _rejected(model: str, priority: str, reason: str, retry_after: float) -> Rejected:
+    metrics.incr("chat_admission_rejected", model=model, priority=priority, reason=reason)
+    return Rejected(reason, retry_after)
+
+
+_controllers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _Controller]" = weakref.WeakKeyDictionary()
+
+
+def _controller() -> _Controller:
+    loop = asyncio.get_running_loop()
+    controller = _controllers.get(loop)
+    if controller is None:
+        controller = _controllers[loop] = _Controller()
+    return controller
+
+
+async def acquire(model: str, user: Optional[str], priority: Optional[str] = None) -> Optional[Ticket]:
+    """Wait for a slot for one upstream call to ``model``.
+
+    Returns ``None`` when admission control is disabled. Raises ``Rejected``
+    when the queue is full or the wait exceeds CHAT_ADMISSION_QUEUE_TIMEOUT.
+    """
+    if not settings.CHAT_ADMISSION_ENABLED:
+        return None
+    return await _controller().acquire(model, user, priority or INTERACTIVE)
+
+
+def try_acquire(model: str, user: Optional[str], priority: Optional[str] = None) -> Optional[Ticket]:
+    """A slot for ``model`` only if one is free right now, without queueing.
+
+    Returns ``None`` when admission control is disabled; raises ``Rejected``
+    otherwise when there is no room.
+    """
+    if not settings.CHAT_ADMISSION_ENABLED:
+        return None
+    return _controller().try_acquire(model, user, priority or INTERACTIVE)
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import weakref
+from typing import AsyncIterator, Optional
+
+from django.conf import settings
+
+from apps.common import metrics
+
+from . import admission, model_router, pipeline, upstream
+from .schemas import BatchJob, BatchRequest, ChatRequest, validate_messages
+
+
+# Many independent completions in one request (meeting wrap-up: summary, action
+# items, glossary, titles). Jobs run concurrently, at most
+# CHAT_BATCH_CONCURRENCY per model alias across the process, and each result is
+# reported as soon as it finishes.
+
+_limits_by_loop: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, asyncio.Semaphore]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _limit(model: str) -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    limits = _limits_by_loop.get(loop)
+    if limits is None:
+        limits = _limits_by_loop[loop] = {}
+    sem = limits.get(model)
+    if sem is None:
+        size = settings.CHAT_BATCH_MODEL_CONCURRENCY.get(model, settings.CHAT_BATCH_CONCURRENCY)
+        sem = limits[model] = asyncio.Semaphore(max(size, 1))
+    return sem
+
+
+def _chat_request(job: BatchJob) -> ChatRequest:
+    return ChatRequest(
+        conversation_id=job.conversation_id,
+        messages=job.messages,
+        model=job.model,
+        latency_budget_ms=job.latency_budget_ms,
+        priority=job.priority,
+    )
+
+
+def validate(body: BatchRequest) -> Optional[str]:
+    if not body.jobs:
+        return "jobs must be a non-empty list"
+    if len(body.jobs) > settings.CHAT_BATCH_MAX_JOBS:
+        return f"a batch holds at most {settings.CHAT_BATCH_MAX_JOBS} jobs"
+    for i, job in enumerate(body.jobs):
+        err = validate_messages(_chat_request(job))
+        if err:
+            return f"jobs[{i}].{err}"
+        if job.priority not in admission.PRIORITIES:
+            return f"jobs[{i}].priority must be one of: " + ",".join(admission.PRIORITIES)
+    return None
+
+
+def _route(job: BatchJob) -> model_router.Route:
+    last_user = next((m.content for m in reversed(job.messages) if m.role == "user"), "")
+    return model_router.choose(job.model, last_user, budget_ms=job.latency_budget_ms)
+
+
+async def _persisted(user, job: BatchJob) -> tuple[str, dict]:
+    # Same as /complete: messages and reply are saved, enrichment is scheduled
+    route = _route(job)
+    async with _limit(route.model):
+        turn = await pipeline.prepare(user, _chat_request(job), route=route)
+        try:
+            return turn.model, await pipeline.complete(turn)
+        finally:
+            turn.release()
+
+
+async def _ephemeral(user, job: BatchJob) -> tuple[str, dict]:
+    messages = [{"role": m.role, "content": m.content} for m in job.messages]
+    route = _route(job)
+    async with _limit(route.model):
+        ticket = await pipeline.admit(user, route.model, job.priority)
+        try:
+            data, cache_tier = await pipeline.generate(route.model, messages, ticket=ticket)
+        finally:
+            if ticket is not None:
+                ticket.release()
+    if cache_tier:
+        data = {**data, "cache": cache_tier}
+    return route.model, data
+
+
+async def _run_job(user, index: int, job: BatchJob, persist: bool) -> dict:
+    result: dict = {"id": job.id if job.id is not None else str(index), "index": index}
+    started = time.monotonic()
+    try:
+        model, data = await (_persisted(user, job) if persist else _ephemeral(user, job))
+    except pipeline.TurnError as err:
+        metrics.incr("chat_batch_jobs", outcome="error")
+        result["error"] = {"status": err.status, "message": err.message}
+        if err.retry_after is not None:
+            result["error"]["retry_after"] = err.retry_after
+        return result
+    except Exception:  # noqa: BLE001
+        metrics.incr("chat_batch_jobs", outcome="error")
+        result["error"] = {"status": 500, "message": "Batch job failed"}
+        return result
+    metrics.incr("chat_batch_jobs", outcome="ok", model=model)
+    data = data if isinstance(data, dict) else {}
+    result.update(
+        model=model,
+        content=upstream.completion_text(data),
+        usage=data.get("usage"),
+        duration_ms=int((time.monotonic() - started) * 1000),
+    )
+    for key in ("conversation_id", "cache"):
+        if data.get(key) is not None:
+            result[key] = data[key]
+    return result
+
+
+async def run(user, body: BatchRequest) -> AsyncIterator[dict]:
+    """Run every job concurrently and yield one result per job, in completion order.
+
+    A result carries the job's ``id`` and ``index`` and either the reply
+    (``content``, ``usage``, ...) or an ``error``. Closing the iteration early
+    cancels the jobs still running.
+    """
+    loop = asyncio.get_running_loop()
+    pending = {loop.create_task(_run_job(user, i, job, body.persist)) for i, job in enumerate(body.jobs)}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
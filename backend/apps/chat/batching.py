@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from contextlib import aclosing
+from typing import AsyncIterator, Optional
+
+from django.conf import settings
+
+from apps.common import fastjson, metrics
+
+from . import sse
+
+
+def delta_event(text: str) -> sse.DeltaEvent:
+    # Minimal OpenAI-shaped chunk; clients only read choices[0].delta.content
+    body = fastjson.dumps({"choices": [{"index": 0, "delta": {"content": text}}]})
+    return sse.DeltaEvent(text, sse.encode_frame(body))
+
+
+class _Pending:
+    """Events waiting to be written, with adjacent deltas merged into one."""
+
+    __slots__ = ("events", "text", "bytes", "merged", "urgent")
+
+    def __init__(self) -> None:
+        self.events: list[sse.SSEEvent] = []
+        # Text parts of a trailing run of deltas, not yet in ``events``
+        self.text: list[str] = []
+        self.bytes = 0
+        self.merged = 0
+        # A non-delta event (usage, error, done) is waiting; flush without delay
+        self.urgent = False
+
+    def add(self, events: list[sse.SSEEvent]) -> None:
+        for event in events:
+            if isinstance(event, sse.DeltaEvent):
+                self.text.append(event.content)
+                self.bytes += len(event.content)
+                continue
+            self._close_text()
+            self.events.append(event)
+            self.bytes += len(event.raw)
+            self.urgent = True
+
+    def _close_text(self) -> None:
+        if self.text:
+            self.merged += len(self.text) - 1
+            self.events.append(delta_event("".join(self.text)))
+            self.text = []
+
+    def __bool__(self) -> bool:
+        return bool(self.events or self.text)
+
+    def drain(self) -> list[sse.SSEEvent]:
+        self._close_text()
+        events = self.events
+        if self.merged:
+            metrics.incr("chat_stream_deltas_merged", self.merged)
+        self.events, self.bytes, self.merged, self.urgent = [], 0, 0, False
+        return events
+
+
+async def coalesce(
+    batches: AsyncIterator[list[sse.SSEEvent]],
+    *,
+    interval: Optional[float] = None,
+    max_bytes: Optional[int] = None,
+) -> AsyncIterator[list[sse.SSEEvent]]:
+    """Re-batch a generation's events into at most one write per ``interval``.
+
+    Deltas are merged into compact frames and flushed once ``interval``
+    seconds have passed since the previous write, once ``max_bytes`` are
+    pending, or as soon as a non-delta event arrives. A delta after an idle
+    period goes out at once, so the first token is never held back. Upstream
+    is read by its own task: while the consumer is slow to take a batch, text
+    keeps merging into the pending one and is never dropped.
+    """
+    interval = settings.CHAT_STREAM_FLUSH_INTERVAL if interval is None else interval
+    max_bytes = settings.CHAT_STREAM_FLUSH_BYTES if max_bytes is None else max_bytes
+    pending = _Pending()
+    wake = asyncio.Event()
+    state: dict = {"done": False, "error": None}
+
+    async def pump() -> None:
+        try:
+            async with aclosing(batches) as source:
+                async for events in source:
+                    pending.add(events)
+                    wake.set()
+        except Exception as exc:  # noqa: BLE001
+            state["error"] = exc
+        finally:
+            state["done"] = True
+            wake.set()
+
+    reader = asyncio.get_running_loop().create_task(pump())
+    last_flush = float("-inf")
+    try:
+        while True:
+            if not pending:
+                if state["done"]:
+                    break
+                wake.clear()
+                await wake.wait()
+                continue
+            wait = last_flush + interval - time.monotonic()
+            if wait > 0 and not state["done"] and not pending.urgent and pending.bytes < max_bytes:
+                wake.clear()
+                try:
+                    await asyncio.wait_for(wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            last_flush = time.monotonic()
+            yield pending.drain()
+        if state["error"] is not None:
+            raise state["error"]
+    finally:
+        reader.cancel()
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import math
+from dataclasses import asdict, dataclass
+from typing import Iterable, Iterator, Optional
+
+from django.conf import settings
+
+from . import upstream
+from .models import Conversation, Message
+
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+# Per-message framing overhead (role, separators) in the chat template
+_MESSAGE_OVERHEAD_TOKENS = 4
+# Upper bound on transcript characters folded into the summary per LLM call
+_SUMMARY_SLICE_CHARS = 12000
+
+_SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Merge the previous summary with the new transcript excerpt into one updated summary. "
+    "Keep facts, decisions, names, numbers and open questions; drop pleasantries. "
+    "Return ONLY the summary text."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text; cheap and close enough for budgeting
+    return _MESSAGE_OVERHEAD_TOKENS + math.ceil(len(text) / 4)
+
+
+def context_budget(model: str) -> int:
+    return settings.CHAT_CONTEXT_BUDGETS.get(model, settings.CHAT_CONTEXT_DEFAULT_BUDGET)
+
+
+@dataclass(slots=True)
+class ContextUsage:
+    model: str
+    budget: int
+    used: int = 0
+    messages: int = 0
+    summary_tokens: int = 0
+    truncated: bool = False
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def select_window(rows: Iterable[dict], budget: int) -> tuple[list[dict], int, bool]:
+    """Take rows (newest first) while their estimated tokens fit ``budget``.
+
+    The newest row is always kept so the current turn is never dropped. Returns
+    the window (still newest first), the tokens it uses and whether older rows
+    were left out.
+    """
+    window: list[dict] = []
+    used = 0
+    for row in rows:
+        cost = estimate_tokens(row["content"])
+        if window and used + cost > budget:
+            return window, used, True
+        window.append(row)
+        used += cost
+    return window, used, False
+
+
+def _unsummarized_newest_first(conversation_id: int, summary_until_id: Optional[int]) -> Iterator[dict]:
+    qs = Message.objects.filter(conversation_id=conversation_id)
+    if summary_until_id is not None:
+        qs = qs.filter(id__gt=summary_until_id)
+    return qs.order_by("-created_at", "-id").values("id", "role", "content").iterator(chunk_size=100)
+
+
+def build_payload(
+    model: str, summary: str, rows_newest_first: Iterable[dict]
+) -> tuple[list[dict], ContextUsage]:
+    usage = ContextUsage(model=model, budget=context_budget(model))
+    payload: list[dict] = []
+    if summary:
+        summary_content = SUMMARY_PREFIX + summary
+        payload.append({"role": "system", "content": summary_content})
+        usage.summary_tokens = estimate_tokens(summary_content)
+    window, used, truncated = select_window(
+        rows_newest_first, max(usage.budget - usage.summary_tokens, 0))
+    payload.extend({"role": r["role"], "content": r["content"]} for r in reversed(window))
+    usage.used = used + usage.summary_tokens
+    usage.messages = len(window)
+    usage.truncated = truncated
+    return payload, usage
+
+
+def assemble_context(conversation_id: int, model: str) -> tuple[list[dict], ContextUsage]:
+    """Build the upstream message list for a turn within the model's token budget.
+
+    Messages already folded into the conversation's rolling summary are never
+    read; the summary stands in for them as a leading system message.
+    """
+    conv = Conversation.objects.values("summary", "summary_until_id").get(pk=conversation_id)
+    rows = _unsummarized_newest_first(conversation_id, conv["summary_until_id"])
+    return build_payload(model, conv["summary"], rows)
+
+
+def _summarize(previous: str, transcript: str) -> str:
+    user_content = f"Previous summary:\n{previous or '(none)'}\n\nNew transcript excerpt:\n{transcript}"
+    data = upstream.complete_chat_sync(
+        settings.CHAT_SUMMARY_MODEL,
+        [
+            {"role": "system", "content": _SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": user_content},
+        ],
+        timeout=60,
+        max_tokens=settings.CHAT_SUMMARY_MAX_TOKENS,
+    )
+    return upstream.completion_text(data)
+
+
+def refresh_summary(conversation_id: int, model: str) -> bool:
+    """Fold turns that no longer fit ``model``'s budget into the rolling summary.
+
+    Folds down to ``CHAT_SUMMARY_KEEP_RATIO`` of the budget so the next several
+    turns fit without another refresh. Safe to run repeatedly or concurrently:
+    each slice is saved only if nobody else advanced the summary meanwhile.
+    Returns whether the stored summary changed.
+    """
+    conv = Conversation.objects.filter(pk=conversation_id).values("summary", "summary_until_id").first()
+    if conv is None:
+        return False
+    keep_budget = int(
+        (context_budget(model) - settings.CHAT_SUMMARY_MAX_TOKENS) * settings.CHAT_SUMMARY_KEEP_RATIO)
+    window, _, truncated = select_window(
+        _unsummarized_newest_first(conversation_id, conv["summary_until_id"]), max(keep_budget, 0))
+    if not truncated:
+        return False
+
+    to_fold = Message.objects.filter(conversation_id=conversation_id, id__lt=window[-1]["id"])
+    if conv["summary_until_id"] is not None:
+        to_fold = to_fold.filter(id__gt=conv["summary_until_id"])
+    rows = to_fold.order_by("created_at", "id").values("id", "role", "content").iterator(chunk_size=100)
+
+    initial_until_id = conv["summary_until_id"]
+    summary, until_id = conv["summary"], initial_until_id
+    lines: list[str] = []
+    size = 0
+    last_id: Optional[int] = None
+    for row in rows:
+        line = f"{row['role']}: {row['content']}"
+        lines.append(line)
+        size += len(line)
+        last_id = row["id"]
+        if size >= _SUMMARY_SLICE_CHARS:
+            summary, until_id = _save_slice(conversation_id, summary, until_id, lines, last_id)
+            if until_id != last_id:
+                return until_id != initial_until_id
+            lines, size = [], 0
+    if lines and last_id is not None:
+        _, until_id = _save_slice(conversation_id, summary, until_id, lines, last_id)
+    return until_id != initial_until_id
+
+
+def _save_slice(
+    conversation_id: int, summary: str, until_id: Optional[int], lines: list[str], last_id: int
+) -> tuple[str, Optional[int]]:
+    new_summary = _summarize(summary, "\n".join(lines))
+    if not new_summary:
+        return summary, until_id
+    updated = Conversation.objects.filter(pk=conversation_id, summary_until_id=until_id).update(
+        summary=new_summary, summary_until_id=last_id)
+    if not updated:
+        return summary, until_id
+    return new_summary, last_id
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import threading
+import weakref
+import zlib
+from typing import AsyncIterator, Iterator, Optional
+
+from django.conf import settings
+
+from apps.common import fastjson
+from apps.common.db import database_sync_to_async
+
+from . import persistence
+from .models import Conversation, Message
+
+
+# NDJSON export streamed from server-side cursors. A DB executor job walks the
+# rows with QuerySet.iterator() in CHAT_EXPORT_FETCH_SIZE batches and hands
+# chunks of about CHAT_EXPORT_CHUNK_BYTES to the response through a two-slot
+# queue, so memory per export stays flat however long the transcripts are.
+# Each conversation is one {"type": "conversation", ...} line followed by one
+# {"type": "message", ...} line per message, oldest first.
+
+_CONVERSATION_FIELDS = ("id", "title", "created_at", "updated_at", "message_count")
+_MESSAGE_FIELDS = ("id", "role", "content", "created_at")
+# Seconds between checks for a reader that went away while the queue is full
+_PUT_POLL = 0.5
+
+_slots_by_loop: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _slots() -> asyncio.Semaphore:
+    # Exports hold a DB executor thread for their whole duration
+    loop = asyncio.get_running_loop()
+    sem = _slots_by_loop.get(loop)
+    if sem is None:
+        sem = _slots_by_loop[loop] = asyncio.Semaphore(settings.CHAT_EXPORT_MAX_CONCURRENT)
+    return sem
+
+
+def _conversations(user, conversation_id: Optional[int]):
+    qs = persistence.owned_by(Conversation.objects.all(), user)
+    return qs.filter(pk=conversation_id) if conversation_id is not None else qs
+
+
+@database_sync_to_async
+def exists(user, conversation_id: int) -> bool:
+    return _conversations(user, conversation_id).exists()
+
+
+def _lines(user, conversation_id: Optional[int]) -> Iterator[bytes]:
+    fetch = settings.CHAT_EXPORT_FETCH_SIZE
+    conversations = _conversations(user, conversation_id).order_by("id").values(*_CONVERSATION_FIELDS)
+    for conv in conversations.iterator(chunk_size=fetch):
+        yield fastjson.dumps({"type": "conversation", **conv}) + b"\n"
+        messages = (
+            Message.objects.filter(conversation_id=conv["id"])
+            .order_by("created_at", "id")
+            .values(*_MESSAGE_FIELDS)
+        )
+        for msg in messages.iterator(chunk_size=fetch):
+            yield fastjson.dumps({"type": "message", "conversation_id": conv["id"], **msg}) + b"\n"
+
+
+def _produce(
+    user, conversation_id: Optional[int], loop: asyncio.AbstractEventLoop,
+    queue: asyncio.Queue, stop: threading.Event,
+) -> None:
+    def put(item: Optional[bytes]) -> bool:
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                future.result(_PUT_POLL)
+                return True
+            except concurrent.futures.TimeoutError:
+                if stop.is_set():
+                    future.cancel()
+                    return False
+
+    chunk = bytearray()
+    try:
+        for line in _lines(user, conversation_id):
+            chunk += line
+            if len(chunk) >= settings.CHAT_EXPORT_CHUNK_BYTES:
+                if not put(bytes(chunk)):
+                    return
+                chunk.clear()
+        if chunk:
+            put(bytes(chunk))
+    finally:
+        # End of export, also after a failure; the reader re-raises it
+        put(None)
+
+
+async def stream(user, conversation_id: Optional[int] = None, *, compress: bool = False) -> AsyncIterator[bytes]:
+    """NDJSON of one conversation, or of all of ``user``'s, optionally gzipped on the fly.
+
+    Closing the iteration early stops the cursor walk within a moment.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+    stop = threading.Event()
+    # 31: zlib stream in a gzip container
+    gzip = zlib.compressobj(wbits=31) if compress else None
+    async with _slots():
+        producer = loop.create_task(database_sync_to_async(_produce)(user, conversation_id, loop, queue, stop))
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                if gzip is not None:
+                    chunk = gzip.compress(chunk)
+                    if not chunk:
+                        continue
+                yield chunk
+            await producer
+            if gzip is not None:
+                yield gzip.flush()
+        finally:
+            stop.set()
+            # A failure after the reader left has nobody to report to
+            producer.add_done_callback(lambda t: t.cancelled() or t.exception())
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import asyncio
+import uuid
+from collections import deque
+from typing import AsyncIterator, Optional
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from apps.common import metrics
+from apps.common.db import database_sync_to_async
+
+from . import persistence
+from .notifications import EVENT_TYPE, conversation_group
+
+
+# Each generation is published once to its conversation's channel group as
+# "generation.start", "delta" and "generation.end" events; WebSocket and SSE
+# subscribers mirror it from there without another provider call.
+
+START = "generation.start"
+DELTA = "delta"
+END = "generation.end"
+LAGGED = "lagged"
+
+
+class UnknownConversation(Exception):
+    """The conversation does not exist or belongs to someone else."""
+
+
+def new_generation_id() -> str:
+    return uuid.uuid4().hex
+
+
+async def can_follow(user, conversation_id: int) -> bool:
+    """Whether ``user`` may mirror the conversation's generations."""
+    return await database_sync_to_async(persistence.owns)(user, conversation_id)
+
+
+class SubscriberBuffer:
+    """Bounded queue of fan-out events for one slow or fast consumer.
+
+    Pending deltas of the same generation are merged, so a consumer that
+    falls behind gets fewer, larger frames rather than losing text. Past
+    ``max_bytes`` of pending text the consumer is too far behind to catch up:
+    the backlog is dropped for a single ``lagged`` event, the rest of that
+    generation's deltas are skipped, and it should refetch the conversation.
+    """
+
+    __slots__ = ("max_bytes", "_pending", "_bytes", "_lagging", "_wake")
+
+    def __init__(self, max_bytes: Optional[int] = None) -> None:
+        self.max_bytes = max_bytes if max_bytes is not None else settings.CHAT_FANOUT_BUFFER_BYTES
+        self._pending: deque[dict] = deque()
+        self._bytes = 0
+        # Generation whose deltas are being skipped after an overflow
+        self._lagging: Optional[str] = None
+        self._wake = asyncio.Event()
+
+    def put(self, payload: dict) -> None:
+        kind = payload.get("type")
+        if kind == DELTA:
+            if payload.get("generation") == self._lagging:
+                return
+            text = payload.get("c") or ""
+            last = self._pending[-1] if self._pending else None
+            if last is not None and last.get("type") == DELTA and last.get("generation") == payload.get("generation"):
+                last["c"] += text
+                last["seq"] = payload.get("seq")
+            else:
+                self._pending.append(dict(payload))
+            self._bytes += len(text)
+            if self._bytes > self.max_bytes:
+                self._overflow(payload)
+        else:
+            if kind in (START, END) and payload.get("generation") == self._lagging:
+                self._lagging = None
+            self._pending.append(payload)
+        self._wake.set()
+
+    def _overflow(self, payload: dict) -> None:
+        metrics.incr("chat_fanout_lagged")
+        self._pending = deque(p for p in self._pending if p.get("type") != DELTA)
+        self._bytes = 0
+        self._lagging = payload.get("generation")
+        self._pending.append({
+            "type": LAGGED,
+            "conversation_id": payload.get("conversation_id"),
+            "generation": self._lagging,
+        })
+
+    async def get(self) -> list[dict]:
+        """Wait for and return everything pending."""
+        while not self._pending:
+            self._wake.clear()
+            await self._wake.wait()
+        items = list(self._pending)
+        self._pending.clear()
+        self._bytes = 0
+        return items
+
+
+class Publisher:
+    """Publishes one generation to its conversation group without slowing the origin stream.
+
+    Sends happen on a background task; while the channel layer is slow,
+    deltas queue up and are merged like a subscriber's.
+    """
+
+    def __init__(self, conversation_id: int, generation: str) -> None:
+        self.conversation_id = conversation_id
+        self.generation = generation
+        self._seq = 0
+        self._buffer = SubscriberBuffer(max_bytes=settings.CHAT_FANOUT_PUBLISH_BUFFER_BYTES)
+        self._layer = get_channel_layer() if settings.CHAT_FANOUT_ENABLED else None
+        self._task: Optional[asyncio.Task] = None
+
+    def _put(self, payload: dict) -> None:
+        if self._layer is None:
+            return
+        self._buffer.put({"conversation_id": self.conversation_id, "generation": self.generation, **payload})
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def start(self, meta: dict) -> None:
+        self._put({"type": START, "meta": meta})
+
+    def delta(self, text: str) -> None:
+        if text:
+            self._seq += 1
+            self._put({"type": DELTA, "seq": self._seq, "c": text})
+
+    def end(self, **extra) -> None:
+        self._put({"type": END, **extra})
+
+    async def _run(self) -> None:
+        group = conversation_group(self.conversation_id)
+        while True:
+            for payload in await self._buffer.get():
+                try:
+                    await self._layer.group_send(group, {"type": EVENT_TYPE, "payload": payload})
+                except Exception:
+                    # Mirrors are best-effort; the origin stream is unaffected
+                    pass
+                if payload.get("type") == END:
+                    return
+
+
+async def subscribe(user, conversation_id: int) -> AsyncIterator[list[dict]]:
+    """Yield batches of fan-out events for a conversation, for non-consumer readers such as SSE.
+
+    Yields an empty batch every ``CHAT_FANOUT_KEEPALIVE`` seconds without
+    events so callers can keep the connection alive. Raises
+    ``UnknownConversation`` unless ``user`` owns the conversation.
+    """
+    if not await can_follow(user, conversation_id):
+        raise UnknownConversation(conversation_id)
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    group = conversation_group(conversation_id)
+    channel = await layer.new_channel()
+    await layer.group_add(group, channel)
+    buffer = SubscriberBuffer()
+
+    async def pump() -> None:
+        while True:
+            message = await layer.receive(channel)
+            if message.get("type") == EVENT_TYPE:
+                buffer.put(message["payload"])
+
+    reader = asyncio.get_running_loop().create_task(pump())
+    try:
+        while True:
+            try:
+                yield await asyncio.wait_for(buffer.get(), settings.CHAT_FANOUT_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield []
+    finally:
+        reader.cancel()
+        try:
+            await layer.group_discard(group, channel)
+        except Exception:
+            pass
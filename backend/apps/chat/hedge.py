@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from contextlib import aclosing
+from typing import AsyncIterator, Optional
+
+import httpx
+from django.conf import settings
+
+from apps.common import metrics
+
+from . import admission, context, model_router, sse, upstream
+
+
+class StreamTimeout(Exception):
+    """No first token, or no further chunk, arrived within its deadline."""
+
+
+class _Candidate:
+    __slots__ = ("model", "task", "buffer", "parser", "done", "started_at", "first_token_at", "parts", "usage", "errored")
+
+    def __init__(self, model: str, task: asyncio.Task) -> None:
+        self.model = model
+        self.task = task
+        # Chunks held back until this candidate produces its first token
+        self.buffer: list[bytes] = []
+        self.parser = sse.SSEParser()
+        self.done = False
+        self.started_at = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        self.parts: list[str] = []
+        self.usage: Optional[dict] = None
+        # An in-band error frame, e.g. LiteLLM's connection errors
+        self.errored = False
+
+    def feed(self, chunk: bytes) -> bool:
+        """Parse ``chunk`` for the router stats; returns whether it carried text."""
+        text = False
+        for event in self.parser.feed(chunk):
+            if isinstance(event, sse.DeltaEvent):
+                text = True
+                self.parts.append(event.content)
+            elif isinstance(event, sse.UsageEvent):
+                self.usage = event.usage
+            elif isinstance(event, sse.ErrorEvent):
+                self.errored = True
+        if text and self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        return text
+
+    def record_end(self, exc: Optional[BaseException]) -> None:
+        # Once per upstream call, against the alias that served it
+        if exc is not None or self.errored:
+            if exc is None or counts_against_alias(exc):
+                model_router.record_failure(self.model)
+            return
+        if self.first_token_at is None:
+            return
+        try:
+            tokens = int((self.usage or {}).get("completion_tokens") or 0)
+        except (TypeError, ValueError):
+            tokens = 0
+        model_router.record_success(
+            self.model,
+            ttft=self.first_token_at - self.started_at,
+            tokens=tokens or context.estimate_tokens("".join(self.parts)),
+            duration=time.monotonic() - self.first_token_at,
+        )
+
+
+async def _pump(index: int, model: str, messages: list[dict], queue: asyncio.Queue) -> None:
+    try:
+        async with aclosing(upstream.stream_chat(model, messages)) as chunks:
+            async for chunk in chunks:
+                queue.put_nowait((index, chunk, None))
+    except asyncio.CancelledError:
+        raise
+    except Exception as exc:  # noqa: BLE001
+        queue.put_nowait((index, None, exc))
+        return
+    queue.put_nowait((index, None, None))
+
+
+def counts_against_alias(exc: Optional[BaseException]) -> bool:
+    """Whether a failed upstream call says the alias is unhealthy.
+
+    Client errors other than rate limiting would fail the same way on any alias.
+    """
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500 or exc.response.status_code == 429
+    return True
+
+
+async def stream_chat(model: str, messages: list[dict]) -> AsyncIterator[bytes]:
+    """``upstream.stream_chat`` with first-token and inter-token deadlines.
+
+    If ``model`` has no token after ``CHAT_HEDGE_AFTER`` seconds, or fails
+    before its first token, the same request is sent to its secondary alias
+    (``CHAT_HEDGE_ALIASES``), if admission control has a slot free for it right
+    away. Whichever produces a token first is streamed and the other is
+    cancelled. Each upstream call feeds the model router once, under the
+    alias that made it. Raises ``StreamTimeout`` when no candidate starts
+    within ``CHAT_STREAM_TTFT_TIMEOUT`` or the winner stalls for longer than
+    ``CHAT_STREAM_IDLE_TIMEOUT``. Iterate under ``contextlib.aclosing``.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    secondary = settings.CHAT_HEDGE_ALIASES.get(model)
+    started = time.monotonic()
+    hedge_at = started + settings.CHAT_HEDGE_AFTER if secondary and settings.CHAT_HEDGE_AFTER else None
+    ttft_deadline = started + settings.CHAT_STREAM_TTFT_TIMEOUT
+    candidates: list[_Candidate] = []
+
+    def launch(alias: str, ticket: Optional[admission.Ticket] = None) -> None:
+        task = asyncio.get_running_loop().create_task(_pump(len(candidates), alias, messages, queue))
+        if ticket is not None:
+            # However the candidate ends, even if cancelled before it ran
+            task.add_done_callback(lambda _t: ticket.release())
+        candidates.append(_Candidate(alias, task))
+
+    def hedge(reason: str) -> bool:
+        # Speculative, so it only takes a free background-class slot and never queues
+        try:
+            ticket = admission.try_acquire(secondary, None, admission.BACKGROUND)
+        except admission.Rejected:
+            metrics.incr("chat_hedges_skipped", model=model, reason=reason)
+            return False
+        metrics.incr("chat_hedges", model=model, reason=reason)
+        launch(secondary, ticket)
+        return True
+
+    launch(model)
+    winner: Optional[_Candidate] = None
+    try:
+        while winner is None:
+            deadline = ttft_deadline if hedge_at is None else min(hedge_at, ttft_deadline)
+            try:
+                index, chunk, exc = await asyncio.wait_for(queue.get(), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                if hedge_at is not None and time.monotonic() < ttft_deadline:
+                    hedge_at = None
+                    hedge("slow")
+                    continue
+                metrics.incr("chat_stream_timeouts", model=model, phase="first_token")
+                for cand in candidates:
+                    if not cand.done:
+                        model_router.record_failure(cand.model)
+                raise StreamTimeout(f"no first token within {settings.CHAT_STREAM_TTFT_TIMEOUT:g}s")
+
+            cand = candidates[index]
+            if chunk is not None:
+                cand.buffer.append(chunk)
+                if cand.feed(chunk):
+                    winner = cand
+                continue
+
+            cand.done = True
+            if exc is not None:
+                cand.record_end(exc)
+            if hedge_at is not None and exc is not None and counts_against_alias(exc):
+                # Fail over right away instead of waiting out the hedge delay
+                hedge_at = None
+                if hedge("failed"):
+                    continue
+            if all(c.done for c in candidates):
+                if exc is not None:
+                    raise exc
+                # Ended without a token (e.g. an in-band error frame); pass it on as-is
+                winner = cand
+
+        for cand in candidates:
+            if cand is not winner and not cand.done:
+                cand.task.cancel()
+                if cand is candidates[0]:
+                    # Beaten by the hedge: its first token took at least this long
+                    model_router.record_timeout(cand.model, time.monotonic() - cand.started_at)
+        if len(candidates) > 1:
+            metrics.incr("chat_hedge_wins", model=winner.model)
+        for chunk in winner.buffer:
+            yield chunk
+        winner.buffer.clear()
+        if winner.done:
+            # Ended without a token; a failure was recorded when it ended with one
+            if winner.errored:
+                winner.record_end(None)
+            return
+
+        win_index = candidates.index(winner)
+        while True:
+            try:
+                index, chunk, exc = await asyncio.wait_for(queue.get(), settings.CHAT_STREAM_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                metrics.incr("chat_stream_timeouts", model=winner.model, phase="inter_token")
+                model_router.record_failure(winner.model)
+                raise StreamTimeout(f"no chunk within {settings.CHAT_STREAM_IDLE_TIMEOUT:g}s") from None
+            if index != win_index:
+                continue
+            if chunk is None:
+                winner.record_end(exc)
+                if exc is not None:
+                    raise exc
+                return
+            winner.feed(chunk)
+            yield chunk
+    finally:
+        for cand in candidates:
+            cand.task.cancel()
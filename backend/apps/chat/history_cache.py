@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from django.conf import settings
+
+from apps.common import fastjson
+from apps.common.db import database_sync_to_async
+from apps.common.redis_client import get_redis, get_sync_redis
+
+from .models import Conversation, Message
+
+
+# Every write bumps a per-conversation generation counter (the ``:gen`` key). Entries in
+# Redis and in the local LRU carry the generation they were built at, so a stale
+# copy is detected with a single GET and a fill that raced a write is refused.
+_FILL_SCRIPT = """
+local cur = redis.call('GET', KEYS[1]) or '0'
+if cur ~= ARGV[1] then return 0 end
+redis.call('DEL', KEYS[3])
+if #ARGV > 5 then redis.call('RPUSH', KEYS[3], unpack(ARGV, 6)) end
+redis.call('HSET', KEYS[2], 'gen', ARGV[1], 'summary', ARGV[3], 'summary_until_id', ARGV[4], 'complete', ARGV[5])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+redis.call('EXPIRE', KEYS[3], ARGV[2])
+return 1
+"""
+
+_APPEND_SCRIPT = """
+local gen = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+if redis.call('EXISTS', KEYS[2]) == 0 then return {gen, 0} end
+redis.call('RPUSH', KEYS[3], unpack(ARGV, 3))
+local max = tonumber(ARGV[2])
+if redis.call('LLEN', KEYS[3]) > max then
+  redis.call('LTRIM', KEYS[3], -max, -1)
+  redis.call('HSET', KEYS[2], 'complete', '0')
+end
+redis.call('HSET', KEYS[2], 'gen', gen)
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[3], ARGV[1])
+return {gen, 1}
+"""
+
+
+@dataclass(slots=True)
+class HistoryEntry:
+    summary: str
+    summary_until_id: Optional[int]
+    # Unsummarized tail of the conversation, oldest first
+    messages: list[dict]
+    # False when older unsummarized messages were trimmed off to bound memory
+    complete: bool
+    gen: int
+    stored_at: float = 0.0
+
+
+_local: "OrderedDict[int, HistoryEntry]" = OrderedDict()
+
+
+def _keys(conversation_id: int) -> list[str]:
+    base = f"chat:history:{{{conversation_id}}}"
+    return [f"{base}:gen", f"{base}:meta", f"{base}:msgs"]
+
+
+def _row(m: dict) -> dict:
+    return {"id": m["id"], "role": m["role"], "content": m["content"]}
+
+
+def _local_get(conversation_id: int, gen: int) -> Optional[HistoryEntry]:
+    entry = _local.get(conversation_id)
+    if entry is None:
+        return None
+    if entry.gen != gen or time.monotonic() - entry.stored_at > settings.CHAT_HISTORY_CACHE_LOCAL_TTL:
+        _local.pop(conversation_id, None)
+        return None
+    _local.move_to_end(conversation_id)
+    return entry
+
+
+def _local_put(conversation_id: int, entry: HistoryEntry) -> None:
+    entry.stored_at = time.monotonic()
+    _local[conversation_id] = entry
+    _local.move_to_end(conversation_id)
+    while len(_local) > settings.CHAT_HISTORY_CACHE_SIZE:
+        _local.popitem(last=False)
+
+
+def _load_from_db(conversation_id: int) -> Optional[HistoryEntry]:
+    conv = Conversation.objects.filter(pk=conversation_id).values("summary", "summary_until_id").first()
+    if conv is None:
+        return None
+    limit = settings.CHAT_HISTORY_CACHE_MAX_MESSAGES
+    qs = Message.objects.filter(conversation_id=conversation_id)
+    if conv["summary_until_id"] is not None:
+        qs = qs.filter(id__gt=conv["summary_until_id"])
+    rows = list(qs.order_by("-created_at", "-id").values("id", "role", "content")[: limit + 1])
+    complete = len(rows) <= limit
+    rows = rows[:limit]
+    rows.reverse()
+    return HistoryEntry(
+        summary=conv["summary"],
+        summary_until_id=conv["summary_until_id"],
+        messages=rows,
+        complete=complete,
+        gen=0,
+    )
+
+
+async def _store(conversation_id: int, entry: HistoryEntry) -> bool:
+    r = get_redis()
+    stored = await r.eval(
+        _FILL_SCRIPT,
+        3,
+        *_keys(conversation_id),
+        str(entry.gen),
+        settings.CHAT_HISTORY_CACHE_TTL,
+        entry.summary,
+        "" if entry.summary_until_id is None else str(entry.summary_until_id),
+        "1" if entry.complete else "0",
+        *(fastjson.dumps(m) for m in entry.messages),
+    )
+    return bool(stored)
+
+
+async def load(conversation_id: int) -> Optional[HistoryEntry]:
+    """Return the cached history for a conversation, reading Postgres on a miss.
+
+    ``None`` means the conversation does not exist. When Redis is unreachable
+    the entry is built from Postgres and not cached.
+    """
+    try:
+        r = get_redis()
+        raw_gen = await r.get(_keys(conversation_id)[0])
+        gen = int(raw_gen or 0)
+        entry = _local_get(conversation_id, gen)
+        if entry is not None:
+            return entry
+        if raw_gen is not None:
+            async with r.pipeline(transaction=True) as pipe:
+                meta, msgs = await pipe.hgetall(_keys(conversation_id)[1]).lrange(
+                    _keys(conversation_id)[2], 0, -1).execute()
+            if meta and int(meta.get(b"gen", b"-1")) == gen:
+                until = meta.get(b"summary_until_id") or b""
+                entry = HistoryEntry(
+                    summary=(meta.get(b"summary") or b"").decode("utf-8"),
+                    summary_until_id=int(until) if until else None,
+                    messages=[fastjson.loads(m) for m in msgs],
+                    complete=meta.get(b"complete") == b"1",
+                    gen=gen,
+                )
+                _local_put(conversation_id, entry)
+                return entry
+    except Exception:
+        return await database_sync_to_async(_load_from_db)(conversation_id)
+
+    entry = await database_sync_to_async(_load_from_db)(conversation_id)
+    if entry is None:
+        return None
+    entry.gen = gen
+    try:
+        if await _store(conversation_id, entry):
+            _local_put(conversation_id, entry)
+    except Exception:
+        pass
+    return entry
+
+
+async def seed(conversation_id: int, rows: list[dict]) -> Optional[HistoryEntry]:
+    """Cache a conversation created by this request without reading it back."""
+    entry = HistoryEntry(summary="", summary_until_id=None, messages=[_row(m) for m in rows],
+                         complete=True, gen=0)
+    try:
+        if await _store(conversation_id, entry):
+            _local_put(conversation_id, entry)
+            return entry
+    except Exception:
+        pass
+    return None
+
+
+async def append(
+    conversation_id: int, rows: list[dict], entry: Optional[HistoryEntry] = None
+) -> Optional[HistoryEntry]:
+    """Write-through newly persisted messages; call after the DB commit.
+
+    Returns the updated entry when ``entry`` was current, otherwise ``None`` and
+    the next ``load`` rebuilds it.
+    """
+    if not rows:
+        return entry
+    new_rows = [_row(m) for m in rows]
+    try:
+        gen, existed = await get_redis().eval(
+            _APPEND_SCRIPT,
+            3,
+            *_keys(conversation_id),
+            settings.CHAT_HISTORY_CACHE_TTL,
+            settings.CHAT_HISTORY_CACHE_MAX_MESSAGES,
+            *(fastjson.dumps(m) for m in new_rows),
+        )
+    except Exception:
+        _local.pop(conversation_id, None)
+        return None
+    if not existed or entry is None or entry.gen != int(gen) - 1:
+        _local.pop(conversation_id, None)
+        return None
+    messages = entry.messages + new_rows
+    limit = settings.CHAT_HISTORY_CACHE_MAX_MESSAGES
+    updated = HistoryEntry(
+        summary=entry.summary,
+        summary_until_id=entry.summary_until_id,
+        messages=messages[-limit:],
+        complete=entry.complete and len(messages) <= limit,
+        gen=int(gen),
+    )
+    _local_put(conversation_id, updated)
+    return updated
+
+
+async def invalidate(conversation_id: int) -> None:
+    _local.pop(conversation_id, None)
+    try:
+        gen_key, meta_key, msgs_key = _keys(conversation_id)
+        async with get_redis().pipeline(transaction=True) as pipe:
+            await pipe.incr(gen_key).expire(gen_key, settings.CHAT_HISTORY_CACHE_TTL).delete(
+                meta_key, msgs_key).execute()
+    except Exception:
+        pass
+
+
+def invalidate_sync(conversation_id: int) -> None:
+    # For Celery tasks; local LRUs in web workers see the bumped generation
+    try:
+        gen_key, meta_key, msgs_key = _keys(conversation_id)
+        with get_sync_redis().pipeline(transaction=True) as pipe:
+            pipe.incr(gen_key).expire(gen_key, settings.CHAT_HISTORY_CACHE_TTL).delete(
+                meta_key, msgs_key).execute()
+    except Exception:
+        pass
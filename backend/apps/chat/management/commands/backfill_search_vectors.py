@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+from django.contrib.postgres.search import SearchVector
+from django.core.management.base import BaseCommand
+
+from apps.chat.models import Message
+from apps.chat.search import SEARCH_CONFIG
+
+
+class Command(BaseCommand):
+    help = "Fill Message.search_vector for rows written before the search trigger existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Messages updated per statement")
+
+    def handle(self, *args, batch_size: int, **options):
+        total = 0
+        last_id = 0
+        while True:
+            # Keyset over the primary key so every batch is a short index range scan
+            ids = list(
+                Message.objects.filter(pk__gt=last_id, search_vector__isnull=True)
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            total += Message.objects.filter(pk__in=ids).update(
+                search_vector=SearchVector("content", config=SEARCH_CONFIG))
+            last_id = ids[-1]
+            self.stdout.write(f"Backfilled {total} messages (up to id {last_id})")
+        self.stdout.write(self.style.SUCCESS(f"Backfilled search vectors for {total} messages"))
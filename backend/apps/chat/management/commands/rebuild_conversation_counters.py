@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Left
+
+from apps.chat.models import PREVIEW_LENGTH, Conversation, Message
+
+
+class Command(BaseCommand):
+    help = "Recompute Conversation.message_count, last_message_at and last_message_preview from messages."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Conversations updated per statement")
+        parser.add_argument("--conversation", type=int, action="append", dest="conversation_ids",
+                            help="Only rebuild these conversation ids (repeatable)")
+
+    def handle(self, *args, batch_size: int, conversation_ids=None, **options):
+        counts = (
+            Message.objects.filter(conversation=OuterRef("pk"))
+            .order_by()
+            .values("conversation")
+            .annotate(n=Count("id"))
+            .values("n")
+        )
+        latest = Message.objects.filter(conversation=OuterRef("pk")).order_by("-created_at", "-id")
+        updates = {
+            "message_count": Coalesce(Subquery(counts), 0),
+            "last_message_at": Subquery(latest.values("created_at")[:1]),
+            "last_message_preview": Coalesce(Left(Subquery(latest.values("content")[:1]), PREVIEW_LENGTH), Value("")),
+        }
+
+        qs = Conversation.objects.order_by("id")
+        if conversation_ids:
+            qs = qs.filter(pk__in=conversation_ids)
+        total = 0
+        last_id = 0
+        while True:
+            ids = list(qs.filter(pk__gt=last_id).values_list("id", flat=True)[:batch_size])
+            if not ids:
+                break
+            total += Conversation.objects.filter(pk__in=ids).update(**updates)
+            last_id = ids[-1]
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt counters for {total} conversations"))
@@ -0,0 +1,73 @@
+from django.db import migrations, models
+
+
+# Keep counters right when messages are deleted (including conversation cascades):
+# one statement-level recompute per DELETE for the conversations it touched.
+_RECOMPUTE = """
+UPDATE chat_conversation c SET
+    message_count = s.n,
+    last_message_at = s.last_at,
+    last_message_preview = COALESCE(s.preview, '')
+FROM (
+    SELECT d.conversation_id,
+           (SELECT count(*) FROM chat_message m WHERE m.conversation_id = d.conversation_id) AS n,
+           lm.created_at AS last_at,
+           left(lm.content, 160) AS preview
+    FROM ({ids}) d
+    LEFT JOIN LATERAL (
+        SELECT created_at, content FROM chat_message m
+        WHERE m.conversation_id = d.conversation_id
+        ORDER BY created_at DESC, id DESC
+        LIMIT 1
+    ) lm ON true
+) s
+WHERE c.id = s.conversation_id
+"""
+
+CREATE_TRIGGER = """
+CREATE OR REPLACE FUNCTION chat_message_counters_after_delete() RETURNS trigger AS $$
+BEGIN
+{recompute};
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER chat_message_counters_on_delete
+AFTER DELETE ON chat_message
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION chat_message_counters_after_delete();
+""".format(recompute=_RECOMPUTE.format(ids="SELECT DISTINCT conversation_id FROM old_rows"))
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS chat_message_counters_on_delete ON chat_message;
+DROP FUNCTION IF EXISTS chat_message_counters_after_delete();
+"""
+
+BACKFILL = _RECOMPUTE.format(ids="SELECT id AS conversation_id FROM chat_conversation")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_conversation_owner_updated_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=160),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+    ]
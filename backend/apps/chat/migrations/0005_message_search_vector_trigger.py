@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+# Keep Message.search_vector in sync on write; existing rows are filled by the
+# backfill_search_vectors management command. The config must match
+# apps.chat.search.SEARCH_CONFIG.
+CREATE_TRIGGER = """
+CREATE TRIGGER chat_message_search_vector_update
+BEFORE INSERT OR UPDATE OF content ON chat_message
+FOR EACH ROW EXECUTE FUNCTION
+tsvector_update_trigger(search_vector, 'pg_catalog.english', content);
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS chat_message_search_vector_update ON chat_message;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_conversation_counters'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+    ]
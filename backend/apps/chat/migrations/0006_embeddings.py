@@ -0,0 +1,36 @@
+import django.db.models.deletion
+import pgvector.django
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_search_vector_trigger'),
+    ]
+
+    operations = [
+        pgvector.django.VectorExtension(),
+        migrations.CreateModel(
+            name='Embedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('model', models.CharField(max_length=64)),
+                ('embedding', pgvector.django.VectorField(dimensions=1536)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [pgvector.django.HnswIndex(ef_construction=64, fields=['embedding'], m=16, name='embedding_hnsw_idx', opclasses=['vector_cosine_ops'])],
+            },
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='embedding',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.embedding'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('embedding__isnull', True), ('role__in', ['user', 'assistant'])), fields=['id'], name='msg_embedding_pending_idx'),
+        ),
+    ]
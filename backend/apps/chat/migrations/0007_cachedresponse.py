@@ -0,0 +1,27 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_embeddings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedResponse',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=64)),
+                ('prompt_hash', models.CharField(max_length=64, unique=True)),
+                ('response', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+                ('embedding', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chat.embedding')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['model', 'expires_at'], name='cached_resp_model_exp_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import re
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+from django.conf import settings
+
+from apps.common import metrics
+
+
+# Picks a model alias per request from live latency stats. Stats are kept per
+# process and only for the aliases in CHAT_ROUTER_MODELS, ordered from the
+# fastest/cheapest to the most capable.
+
+AUTO = "auto"
+
+_REASONING_HINTS = re.compile(
+    r"\b(why|how come|explain|compare|contrast|analy[sz]e|derive|prove|evaluate|"
+    r"step[- ]by[- ]step|trade-?offs?|design|architect\w*|debug|optimi[sz]e)\b",
+    re.IGNORECASE,
+)
+_CODE_HINTS = re.compile(r"```|^\s*(def|class|function|import|SELECT)\b|[{};]\s*$", re.MULTILINE)
+_MAX_SAMPLES = 256
+
+
+@dataclass(slots=True)
+class AliasStats:
+    ttft_ewma: Optional[float] = None
+    tps_ewma: Optional[float] = None
+    # (monotonic time, seconds) of recent first tokens, for windowed percentiles
+    ttft_samples: deque = field(default_factory=lambda: deque(maxlen=_MAX_SAMPLES))
+    consecutive_failures: int = 0
+    degraded_until: float = 0.0
+
+    def ttft_percentile(self, q: float, now: float) -> Optional[float]:
+        horizon = now - settings.CHAT_ROUTER_WINDOW
+        values = sorted(v for t, v in self.ttft_samples if t >= horizon)
+        if not values:
+            return None
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+
+@dataclass(slots=True)
+class Route:
+    model: str
+    reason: str
+    complexity: float
+    # Expected seconds to a typical full answer; None until the alias has stats
+    predicted_latency: Optional[float] = None
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+_stats: dict[str, AliasStats] = {}
+
+
+def _get(model: str) -> AliasStats:
+    stats = _stats.get(model)
+    if stats is None:
+        stats = _stats[model] = AliasStats()
+    return stats
+
+
+def _ewma(current: Optional[float], value: float) -> float:
+    alpha = settings.CHAT_ROUTER_EWMA_ALPHA
+    return value if current is None else alpha * value + (1 - alpha) * current
+
+
+def estimate_complexity(text: str) -> float:
+    """Cheap 0..1 score of how much reasoning a prompt likely needs."""
+    if not text:
+        return 0.0
+    score = min(len(text.split()) / 150, 1.0) * 0.4
+    if _CODE_HINTS.search(text):
+        score += 0.3
+    score += min(len(_REASONING_HINTS.findall(text)), 2) * 0.15
+    if text.count("?") > 1:
+        score += 0.1
+    return round(min(score, 1.0), 3)
+
+
+def is_degraded(model: str, now: Optional[float] = None) -> bool:
+    now = time.monotonic() if now is None else now
+    stats = _get(model)
+    if stats.degraded_until > now:
+        return True
+    p95 = stats.ttft_percentile(0.95, now)
+    return p95 is not None and p95 > settings.CHAT_ROUTER_DEGRADED_TTFT
+
+
+def predicted_latency(model: str, now: Optional[float] = None) -> Optional[float]:
+    now = time.monotonic() if now is None else now
+    stats = _get(model)
+    ttft = stats.ttft_percentile(0.95, now)
+    if ttft is None:
+        ttft = stats.ttft_ewma
+    if ttft is None or not stats.tps_ewma:
+        return None
+    return round(ttft + settings.CHAT_ROUTER_EXPECTED_TOKENS / stats.tps_ewma, 3)
+
+
+def choose(requested: Optional[str], text: str, *, budget_ms: Optional[int] = None) -> Route:
+    """Route a request to a model alias.
+
+    An explicit ``requested`` alias is honoured unless it is a routed alias that
+    is currently degraded. Otherwise the prompt's complexity picks the
+    preferred alias, and the first healthy alias that fits the latency budget,
+    starting from the preferred one, wins.
+    """
+    candidates = list(settings.CHAT_ROUTER_MODELS)
+    complexity = estimate_complexity(text)
+    now = time.monotonic()
+
+    if requested and requested != AUTO:
+        if requested in candidates and is_degraded(requested, now):
+            for alt in candidates:
+                if alt != requested and not is_degraded(alt, now):
+                    return _route(alt, "fallback", complexity, now)
+        return _route(requested, "requested", complexity, now)
+    if not candidates:
+        return _route(settings.CHAT_DEFAULT_MODEL, "default", complexity, now)
+
+    complex_prompt = complexity >= settings.CHAT_ROUTER_COMPLEXITY_THRESHOLD
+    preferred = candidates[-1] if complex_prompt else candidates[0]
+    order = [preferred] + [m for m in (reversed(candidates) if complex_prompt else candidates) if m != preferred]
+    budget = (budget_ms / 1000) if budget_ms else settings.CHAT_ROUTER_LATENCY_BUDGET
+
+    healthy = [m for m in order if not is_degraded(m, now)]
+    if not healthy:
+        return _route(preferred, "all_degraded", complexity, now)
+    for model in healthy:
+        predicted = predicted_latency(model, now)
+        if predicted is None or predicted <= budget:
+            if model == preferred:
+                reason = "complex" if complex_prompt else "simple"
+            elif is_degraded(preferred, now):
+                reason = "degraded"
+            else:
+                reason = "latency_budget"
+            return _route(model, reason, complexity, now)
+    fastest = min(healthy, key=lambda m: predicted_latency(m, now) or 0.0)
+    return _route(fastest, "fastest", complexity, now)
+
+
+def _route(model: str, reason: str, complexity: float, now: float) -> Route:
+    metrics.incr("chat_router_routes", model=model, reason=reason)
+    return Route(model=model, reason=reason, complexity=complexity, predicted_latency=predicted_latency(model, now))
+
+
+def record_success(model: str, *, ttft: Optional[float] = None, tokens: int = 0, duration: float = 0.0) -> None:
+    """Feed one finished upstream call, once per call and under the alias that served it.
+
+    Streams pass ``ttft`` and the ``tokens`` generated in the ``duration``
+    seconds after the first token. A non-streaming call passes neither: its
+    wall time mixes queueing and generation, so it only reports health.
+    """
+    stats = _get(model)
+    stats.consecutive_failures = 0
+    if ttft is None:
+        return
+    stats.ttft_ewma = _ewma(stats.ttft_ewma, ttft)
+    stats.ttft_samples.append((time.monotonic(), ttft))
+    metrics.observe("chat_ttft_seconds", ttft, model=model)
+    if tokens > 0 and duration > 0:
+        stats.tps_ewma = _ewma(stats.tps_ewma, tokens / duration)
+
+
+def record_failure(model: str) -> None:
+    stats = _get(model)
+    stats.consecutive_failures += 1
+    metrics.incr("chat_upstream_failures", model=model)
+    if stats.consecutive_failures >= settings.CHAT_ROUTER_FAILURE_THRESHOLD:
+        stats.degraded_until = time.monotonic() + settings.CHAT_ROUTER_COOLDOWN
+
+
+def record_timeout(model: str, waited: float) -> None:
+    # A hedged request only tells us the first token took at least ``waited``
+    stats = _get(model)
+    stats.ttft_ewma = _ewma(stats.ttft_ewma, waited)
+    stats.ttft_samples.append((time.monotonic(), waited))
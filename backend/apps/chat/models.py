@@ -4,10 +4,16 @@ from django.contrib.auth import get_user_model
 from django.contrib.postgres.indexes import GinIndex
 from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from pgvector.django import HnswIndex, VectorField
 
 
 User = get_user_model()
 
+# Characters of the latest message kept on Conversation for list views
+PREVIEW_LENGTH = 160
+# Output size of the embedding model (text-embedding-3-small)
+EMBEDDING_DIMENSIONS = 1536
+
 
 class Conversation(models.Model):
     title = models.CharField(max_length=255, blank=True, default="")
@@ -15,16 +21,67 @@ class Conversation(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     owner = models.ForeignKey(
         User, null=True, blank=True, on_delete=models.SET_NULL)
+    # Rolling summary of turns that no longer fit the context budget;
+    # covers every message with id <= summary_until_id
+    summary = models.TextField(blank=True, default="")
+    summary_until_id = models.BigIntegerField(null=True, blank=True)
+    # Denormalized from Message: maintained on insert by apps.chat.persistence and
+    # on delete by a database trigger; rebuild with rebuild_conversation_counters
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message_preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True, default="")
 
     class Meta:
         indexes = [
             models.Index(fields=["updated_at"]),
+            # Keyset pagination of a user's conversations by recent activity
+            models.Index(fields=["owner", "-updated_at", "-id"], name="conv_owner_updated_idx"),
         ]
 
     def __str__(self) -> str:  # pragma: no cover
         return f"Conversation({self.pk})"
 
 
+class Embedding(models.Model):
+    # One vector per distinct (model, text); identical text is never embedded twice
+    content_hash = models.CharField(max_length=64, unique=True)
+    model = models.CharField(max_length=64)
+    embedding = VectorField(dimensions=EMBEDDING_DIMENSIONS)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            HnswIndex(
+                name="embedding_hnsw_idx",
+                fields=["embedding"],
+                m=16,
+                ef_construction=64,
+                opclasses=["vector_cosine_ops"],
+            ),
+        ]
+
+    def __str__(self) -> str:  # pragma: no cover
+        return f"Embedding({self.content_hash[:12]})"
+
+
+class CachedResponse(models.Model):
+    # Semantic tier of the response cache; looked up by prompt embedding distance
+    model = models.CharField(max_length=64)
+    prompt_hash = models.CharField(max_length=64, unique=True)
+    embedding = models.ForeignKey(Embedding, on_delete=models.CASCADE, related_name="+")
+    response = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["model", "expires_at"], name="cached_resp_model_exp_idx"),
+        ]
+
+    def __str__(self) -> str:  # pragma: no cover
+        return f"CachedResponse({self.model}, {self.prompt_hash[:12]})"
+
+
 class Message(models.Model):
     ROLE_CHOICES = (
         ("system", "system"),
@@ -40,12 +97,21 @@ class Message(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     # Optional vectorized search/index field for future retrieval
     search_vector = SearchVectorField(null=True, blank=True)
+    # Filled asynchronously by the embed_pending_messages task
+    embedding = models.ForeignKey(
+        Embedding, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
 
     class Meta:
         ordering = ["created_at"]
         indexes = [
             GinIndex(fields=["search_vector"], name="msg_search_gin_idx"),
             models.Index(fields=["conversation", "created_at"]),
+            # Work queue for the embedding pipeline
+            models.Index(
+                fields=["id"],
+                name="msg_embedding_pending_idx",
+                condition=models.Q(embedding__isnull=True, role__in=["user", "assistant"]),
+            ),
         ]
 
     def __str__(self) -> str:  # pragma: no cover
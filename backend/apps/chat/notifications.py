@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+
+# Channel layer message type handled by the websocket consumers
+EVENT_TYPE = "conversation.event"
+
+
+def conversation_group(conversation_id: int) -> str:
+    return f"conversation_{conversation_id}"
+
+
+async def publish(conversation_id: int, payload: dict) -> None:
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    await layer.group_send(conversation_group(conversation_id), {"type": EVENT_TYPE, "payload": payload})
+
+
+def publish_sync(conversation_id: int, payload: dict) -> None:
+    async_to_sync(publish)(conversation_id, payload)
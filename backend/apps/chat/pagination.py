@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+
+from django.conf import settings
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(ts: datetime, pk: int) -> str:
+    raw = json.dumps([ts.isoformat(), pk], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        ts, pk = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(ts), int(pk)
+    except Exception as exc:
+        raise InvalidCursor("invalid cursor") from exc
+
+
+def page_size(limit: Optional[int], default: int) -> int:
+    if not limit or limit < 1:
+        return default
+    return min(limit, settings.CHAT_MAX_PAGE_SIZE)
+
+
+def before(field: str, cursor: Optional[str]) -> Q:
+    """Keyset predicate for rows strictly after ``cursor`` in ``(-field, -id)`` order."""
+    if not cursor:
+        return Q()
+    ts, pk = decode_cursor(cursor)
+    return Q(**{f"{field}__lt": ts}) | Q(**{field: ts, "id__lt": pk})
+
+
+def paginate(rows: list[dict], size: int, field: str) -> tuple[list[dict], Optional[str]]:
+    """Trim a ``size + 1`` fetch to one page and build the cursor for the next one."""
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    last = rows[-1]
+    return rows, encode_cursor(last[field], last["id"])
+
+
+def encode_offset(offset: int) -> str:
+    return base64.urlsafe_b64encode(f"o:{offset}".encode("ascii")).decode("ascii").rstrip("=")
+
+
+def decode_offset(cursor: Optional[str]) -> int:
+    """Offset cursors are for ranked results, where no stable keyset exists."""
+    if not cursor:
+        return 0
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        prefix, _, value = base64.urlsafe_b64decode(padded.encode("ascii")).decode("ascii").partition(":")
+        offset = int(value)
+    except Exception as exc:
+        raise InvalidCursor("invalid cursor") from exc
+    if prefix != "o" or offset < 0:
+        raise InvalidCursor("invalid cursor")
+    return offset
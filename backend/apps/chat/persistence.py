@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+from typing import Iterable, Optional
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import PREVIEW_LENGTH, Conversation, Message
+
+
+def owned_by(qs, user):
+    # Anonymous callers only see conversations created without an owner
+    if user is not None and user.is_authenticated:
+        return qs.filter(owner=user)
+    return qs.filter(owner__isnull=True)
+
+
+def owns(user, conversation_id: int) -> bool:
+    return owned_by(Conversation.objects.filter(pk=conversation_id), user).exists()
+
+
+def _saved(msg: Message) -> dict:
+    # Primary keys come back from INSERT ... RETURNING; created_at is set client-side
+    return {"id": msg.id, "role": msg.role, "content": msg.content, "created_at": msg.created_at}
+
+
+@transaction.atomic
+def save_messages(
+    conversation_id: Optional[int], user, messages: Iterable[tuple[str, str]]
+) -> Optional[tuple[int, list[dict]]]:
+    """Persist a turn's incoming messages in one transaction.
+
+    For an existing conversation a single UPDATE checks that it exists, takes
+    the row lock and bumps its denormalized counters; otherwise a new one is
+    created for ``user`` (a possibly lazy ``request.user``, resolved here off
+    the event loop). All messages go in with one multi-row INSERT. Returns the
+    conversation id and the rows written, or ``None`` if ``conversation_id``
+    does not exist.
+    """
+    incoming = [Message(role=role, content=content) for role, content in messages]
+    if not incoming:
+        return None
+    counters = {
+        # Within microseconds of the rows' own created_at, which is set at INSERT
+        "last_message_at": timezone.now(),
+        "last_message_preview": incoming[-1].content[:PREVIEW_LENGTH],
+    }
+    if conversation_id:
+        # update() skips auto_now; the list is ordered by updated_at
+        updated = Conversation.objects.filter(pk=conversation_id).update(
+            message_count=F("message_count") + len(incoming),
+            updated_at=counters["last_message_at"], **counters)
+        if not updated:
+            return None
+    else:
+        owner = user if user is not None and user.is_authenticated else None
+        conversation_id = Conversation.objects.create(
+            owner=owner, message_count=len(incoming), **counters).id
+    for msg in incoming:
+        msg.conversation_id = conversation_id
+    created = Message.objects.bulk_create(incoming)
+    return conversation_id, [_saved(m) for m in created]
+
+
+@transaction.atomic
+def save_assistant_message(conversation_id: int, content: str) -> dict:
+    msg = Message.objects.create(conversation_id=conversation_id, role="assistant", content=content)
+    Conversation.objects.filter(pk=conversation_id).update(
+        message_count=F("message_count") + 1,
+        updated_at=msg.created_at,
+        last_message_at=msg.created_at,
+        last_message_preview=content[:PREVIEW_LENGTH],
+    )
+    return _saved(msg)
@@ -0,0 +1,422 @@
+from __future__ import annotations
+
+import asyncio
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+
+import httpx
+from django.conf import settings
+
+from apps.common import fastjson, metrics
+from apps.common.db import database_sync_to_async
+
+from . import (
+    admission, context, fanout, hedge, history_cache, model_router, persistence, response_cache, retrieval, singleflight,
+    sse, tasks, upstream,
+)
+from .models import Conversation
+from .schemas import ChatRequest, validate_messages
+
+
+# One chat turn, independent of transport: the SSE and /complete endpoints and
+# the multiplexed WebSocket consumer all run prepare() and then stream() or
+# complete().
+
+
+# Strong references to detached stream finalizers
+_finalizers: set[asyncio.Task] = set()
+
+
+class TurnError(Exception):
+    def __init__(self, status: int, message: str, retry_after: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        # Seconds, for 429s from admission control
+        self.retry_after = retry_after
+
+
+@dataclass(slots=True)
+class Turn:
+    conversation_id: int
+    route: model_router.Route
+    history: Optional[history_cache.HistoryEntry]
+    messages: list[dict]
+    context_usage: context.ContextUsage
+    last_user: str
+    # Identifies this generation to fan-out subscribers
+    generation: str = field(default_factory=fanout.new_generation_id)
+    # Upstream slot held from prepare() until the generation ends
+    ticket: Optional[admission.Ticket] = None
+
+    @property
+    def model(self) -> str:
+        return self.route.model
+
+    def release(self) -> None:
+        """Give back the upstream slot; transports call it on every exit, a no-op once generation ran."""
+        if self.ticket is not None:
+            self.ticket.release()
+
+    def meta(self) -> dict:
+        return {
+            "conversation_id": self.conversation_id,
+            "generation": self.generation,
+            "model": self.model,
+            "route": self.route.as_dict(),
+            "context": self.context_usage.as_dict(),
+        }
+
+
+def _route(body: ChatRequest) -> model_router.Route:
+    last_user = next((m.content for m in reversed(body.messages) if m.role == "user"), "")
+    return model_router.choose(body.model, last_user, budget_ms=body.latency_budget_ms)
+
+
+def _spent_tokens(usage: Optional[dict], messages: list[dict], text: str) -> int:
+    # Provider usage when reported, else the same estimate the context budget uses
+    try:
+        total = int((usage or {}).get("total_tokens") or 0)
+    except (TypeError, ValueError):
+        total = 0
+    if total:
+        return total
+    return sum(context.estimate_tokens(m.get("content") or "") for m in messages) + _completion_tokens(usage, text)
+
+
+def _completion_tokens(usage: Optional[dict], text: str) -> int:
+    try:
+        return int((usage or {}).get("completion_tokens") or 0) or context.estimate_tokens(text)
+    except (TypeError, ValueError):
+        return context.estimate_tokens(text)
+
+
+@database_sync_to_async
+def _load_history_payload(conversation_id: int, model: str) -> tuple[list[dict], context.ContextUsage]:
+    return context.assemble_context(conversation_id, model)
+
+
+async def _history_for_turn(
+    conversation_id: int, model: str, history: Optional[history_cache.HistoryEntry]
+) -> tuple[list[dict], context.ContextUsage]:
+    if history is not None:
+        payload, usage = context.build_payload(model, history.summary, reversed(history.messages))
+        # A trimmed cache tail is only enough if it already filled the budget
+        if history.complete or usage.truncated:
+            return payload, usage
+    return await _load_history_payload(conversation_id, model)
+
+
+async def _with_retrieval(
+    user, body: ChatRequest, conversation_id: int,
+    history: Optional[history_cache.HistoryEntry], messages_payload: list[dict], last_user: str,
+) -> list[dict]:
+    if not body.retrieve:
+        return messages_payload
+    k = min(body.retrieve_k or settings.CHAT_RETRIEVAL_TOP_K, settings.CHAT_RETRIEVAL_MAX_K)
+
+    @database_sync_to_async
+    def _conversations():
+        # Evaluate the owner filter off the loop; used as a subquery
+        return persistence.owned_by(Conversation.objects.all(), user).values("id")
+
+    try:
+        hits = await retrieval.retrieve(
+            await _conversations(), last_user, k=k, conversation_id=conversation_id,
+            in_context_after_id=history.summary_until_id if history is not None else None,
+        )
+    except Exception:
+        # Retrieval is best-effort; answer without snippets
+        return messages_payload
+    if not hits:
+        return messages_payload
+    # After the rolling summary (if any), ahead of the conversation turns
+    at = 1 if messages_payload and messages_payload[0]["content"].startswith(context.SUMMARY_PREFIX) else 0
+    return messages_payload[:at] + [retrieval.snippets_message(hits)] + messages_payload[at:]
+
+
+async def _schedule_enrichment(
+    conversation_id: int, usage: context.ContextUsage, last_user: str, assistant_text: str
+) -> None:
+    # Post-turn work runs in Celery so [DONE] and /complete return as soon as generation ends
+    await tasks.schedule_title(conversation_id, last_user, assistant_text)
+    # Only conversations that overflowed the budget need older turns folded
+    if usage.truncated:
+        await tasks.schedule_summary_refresh(conversation_id, usage.model)
+    # New messages are embedded in batches across conversations
+    await tasks.schedule_embeddings()
+
+
+def _finish_detached(turn: Turn, assistant_text: str) -> asyncio.Task:
+    # Outlives the stream's own task, so a disconnect cannot drop the save
+    task = asyncio.get_running_loop().create_task(_finish(turn, assistant_text))
+    _finalizers.add(task)
+    task.add_done_callback(_finalizers.discard)
+    return task
+
+
+async def _finish(turn: Turn, assistant_text: str) -> None:
+    if assistant_text:
+        saved_assistant = await database_sync_to_async(persistence.save_assistant_message)(
+            turn.conversation_id, assistant_text)
+        await history_cache.append(turn.conversation_id, [saved_assistant], turn.history)
+    # Without assistant content (provider error) the title falls back to the last user text
+    await _schedule_enrichment(turn.conversation_id, turn.context_usage, turn.last_user, assistant_text)
+
+
+@database_sync_to_async
+def _user_key(user) -> Optional[str]:
+    return str(user.pk) if user is not None and user.is_authenticated else None
+
+
+async def admit(user, model: str, priority: Optional[str] = None) -> Optional[admission.Ticket]:
+    """Wait for an upstream slot for ``user``; raises ``TurnError(429)`` when admission rejects."""
+    if not settings.CHAT_ADMISSION_ENABLED:
+        return None
+    user_key = await _user_key(user) if settings.CHAT_ADMISSION_USER_CONCURRENCY > 0 else None
+    try:
+        return await admission.acquire(model, user_key, priority)
+    except admission.Rejected as rej:
+        raise TurnError(429, "Too many requests for this model, retry later", retry_after=rej.retry_after) from rej
+
+
+async def prepare(user, body: ChatRequest, *, route: Optional[model_router.Route] = None) -> Turn:
+    """Validate, route and admit the turn, persist the incoming messages, then assemble the prompt.
+
+    ``user`` may be a lazy ``request.user`` or ``scope["user"]``; it is only
+    resolved off the event loop. Raises ``TurnError`` with an HTTP status.
+    The returned turn holds an upstream slot until ``stream`` or ``complete``
+    ends, or ``Turn.release``; one that neither starts within
+    CHAT_ADMISSION_CLAIM_TIMEOUT seconds is given back. ``route`` skips
+    routing when the caller already chose the model.
+    """
+    msg_err = validate_messages(body)
+    if msg_err:
+        raise TurnError(400, msg_err)
+    if body.priority is not None and body.priority not in admission.PRIORITIES:
+        raise TurnError(400, "priority must be one of: " + ",".join(admission.PRIORITIES))
+    route = route or _route(body)
+    # Rejected turns are refused before anything is written
+    ticket = await admit(user, route.model, body.priority)
+    try:
+        turn = await _assemble(user, body, route)
+    except BaseException:
+        if ticket is not None:
+            ticket.release()
+        raise
+    if ticket is not None:
+        ticket.lease(settings.CHAT_ADMISSION_CLAIM_TIMEOUT)
+    turn.ticket = ticket
+    return turn
+
+
+async def _assemble(user, body: ChatRequest, route: model_router.Route) -> Turn:
+    model = route.model
+
+    # If existing conversation specified, ensure it exists; a cached history proves it does
+    history: Optional[history_cache.HistoryEntry] = None
+    if body.conversation_id:
+        history = await history_cache.load(body.conversation_id)
+        if history is None:
+            raise TurnError(404, "Conversation not found")
+
+    # Lock/create the conversation and bulk insert incoming messages in one transaction
+    persisted = await database_sync_to_async(persistence.save_messages)(
+        body.conversation_id,
+        user,
+        [(m.role, m.content) for m in body.messages],
+    )
+    if persisted is None:
+        raise TurnError(404, "Conversation not found")
+    conversation_id, saved = persisted
+    if body.conversation_id:
+        history = await history_cache.append(conversation_id, saved, history)
+    else:
+        history = await history_cache.seed(conversation_id, saved)
+
+    # Assemble the newest history that fits the model's budget after persisting user messages
+    messages_payload, context_usage = await _history_for_turn(conversation_id, model, history)
+
+    # Find last user text for potential title generation
+    last_user_text = ""
+    for m in reversed(messages_payload):
+        if m.get("role") == "user":
+            last_user_text = m.get("content", "")
+            break
+    messages_payload = await _with_retrieval(
+        user, body, conversation_id, history, messages_payload, last_user_text)
+    return Turn(
+        conversation_id=conversation_id,
+        route=route,
+        history=history,
+        messages=messages_payload,
+        context_usage=context_usage,
+        last_user=last_user_text,
+    )
+
+
+async def _parse(chunks: AsyncIterator[bytes], parser: sse.SSEParser) -> AsyncIterator[list[sse.SSEEvent]]:
+    async with aclosing(chunks) as source:
+        async for chunk in source:
+            yield parser.feed(chunk)
+    # At EOF; a last event may lack its terminating blank line
+    yield parser.close()
+
+
+def _error_event(error: dict) -> sse.ErrorEvent:
+    return sse.ErrorEvent(error, sse.encode_frame(fastjson.dumps(error)))
+
+
+async def stream(turn: Turn) -> AsyncIterator[list[sse.SSEEvent]]:
+    """Generate the assistant reply, yielding the parsed events of each upstream chunk.
+
+    Always ends with a ``DoneEvent``. Upstream failures become an ``ErrorEvent``
+    whose ``error`` is the frame body sent to SSE clients. After the last batch
+    the reply is persisted and post-turn tasks are scheduled. Closing or
+    cancelling the iteration early cancels the upstream request and persists
+    the partial reply.
+    """
+    if turn.ticket is not None:
+        turn.ticket.claim()
+    model = turn.model
+    assistant_parts: list[str] = []
+    emitted_any = False
+    parser = sse.SSEParser()
+    usage: Optional[dict] = None
+    failed = False
+    # A DoneEvent went out; upstream may also just hit EOF without [DONE]
+    done = False
+
+    aborted = False
+    # Mirror the generation to the conversation's other subscribers
+    publisher = fanout.Publisher(turn.conversation_id, turn.generation)
+    publisher.start(turn.meta())
+    try:
+        try:
+            # Identical concurrent requests share one upstream stream; each replays it in full
+            async with aclosing(_parse(singleflight.stream_chat(model, turn.messages), parser)) as parsed:
+                async for chunk_events in parsed:
+                    events: list[sse.SSEEvent] = []
+                    finished = False
+                    for event in chunk_events:
+                        if isinstance(event, sse.DeltaEvent):
+                            assistant_parts.append(event.content)
+                        elif isinstance(event, sse.UsageEvent):
+                            usage = event.usage
+                        elif isinstance(event, sse.ErrorEvent) and event.is_connection_error:
+                            # Don't forward the LiteLLM connection error; close the stream cleanly.
+                            failed = finished = True
+                            break
+                        elif isinstance(event, sse.DoneEvent):
+                            done = finished = True
+                        if event.raw:
+                            events.append(event)
+                    if events:
+                        emitted_any = True
+                        publisher.delta("".join(e.content for e in events if isinstance(e, sse.DeltaEvent)))
+                        yield events
+                    if finished:
+                        break
+            if not done:
+                yield [sse.DoneEvent()]
+        except httpx.HTTPStatusError as http_err:  # Upstream returned non-2xx before any chunks
+            resp = http_err.response
+            failed = hedge.counts_against_alias(http_err)
+            try:
+                err_json = resp.json() or {}
+            except Exception:
+                err_json = {}
+            # Normalize into a consistent error shape
+            if isinstance(err_json, dict) and err_json.get("error"):
+                err_obj = {"error": err_json.get("error")}
+            else:
+                err_obj = {"error": {"message": (resp.text or "Upstream provider error")[
+                    :500], "status": resp.status_code}}
+            yield [_error_event(err_obj), sse.DoneEvent()]
+        except Exception:  # noqa: BLE001
+            failed = True
+            # If content was already sent, swallow and end; if not, emit a clean error then close.
+            if not emitted_any:
+                yield [_error_event({"message": "Failed to start stream with the provider."}), sse.DoneEvent()]
+            else:
+                yield [sse.DoneEvent()]
+    except (asyncio.CancelledError, GeneratorExit):
+        # The reader went away (client disconnect, cancel frame); upstream is
+        # cancelled as this unwinds
+        aborted = True
+        raise
+    finally:
+        if turn.ticket is not None:
+            turn.ticket.release(_spent_tokens(usage, turn.messages, "".join(assistant_parts)))
+        publisher.end(failed=failed, aborted=aborted)
+        if aborted:
+            metrics.incr("chat_stream_aborts", model=model)
+            # Keep what was generated; runs detached since this task is being cancelled
+            _finish_detached(turn, "".join(assistant_parts))
+
+    # Router stats are fed by the upstream call itself (hedge), once per call
+    try:
+        await asyncio.shield(_finish_detached(turn, "".join(assistant_parts)))
+    except asyncio.CancelledError:
+        # Left after [DONE] but before the reply was saved; the save still completes
+        metrics.incr("chat_stream_aborts", model=model)
+        raise
+
+
+async def generate(
+    model: str, messages: list[dict], *, ticket: Optional[admission.Ticket] = None
+) -> tuple[dict, Optional[str]]:
+    """One non-streaming completion of ``messages``, without any persistence.
+
+    Returns the provider response and the response-cache tier that answered
+    it, if any. Raises ``TurnError(502)`` on failure. ``ticket`` is released
+    with the tokens spent once the call ends.
+    """
+    if ticket is not None:
+        ticket.claim()
+    spent = 0
+    try:
+        # Repeated prompts for opted-in models are answered from the response cache
+        probe = await response_cache.lookup(model, messages)
+        if probe is not None and probe.data is not None:
+            return probe.data, probe.tier
+        try:
+            data = await singleflight.complete_chat(model, messages)
+        except (httpx.HTTPError, ValueError, singleflight.FlightError) as exc:
+            raise TurnError(502, "Upstream provider error") from exc
+        spent = _spent_tokens((data or {}).get("usage"), messages, upstream.completion_text(data))
+        if probe is not None and await response_cache.store(probe, data):
+            await tasks.schedule_response_cache_prune()
+        return data, None
+    finally:
+        if ticket is not None:
+            ticket.release(spent)
+
+
+async def complete(turn: Turn) -> dict:
+    """Generate the whole reply in one upstream call; raises ``TurnError(502)`` on failure."""
+    data, cache_tier = await generate(turn.model, turn.messages, ticket=turn.ticket)
+
+    # Extract assistant content and persist
+    content = None
+    try:
+        choice0 = (data or {}).get("choices", [{}])[0]
+        msg = choice0.get("message") or {}
+        content = msg.get("content") or choice0.get("text")
+    except Exception:
+        content = None
+    # Even without content, a fallback title is derived from the user's text
+    await _finish(turn, content or "")
+
+    # Include conversation id in the returned JSON for clients of non-streaming endpoint
+    try:
+        if isinstance(data, dict):
+            data.setdefault("conversation_id", turn.conversation_id)
+            data.setdefault("context", turn.context_usage.as_dict())
+            data.setdefault("route", turn.route.as_dict())
+            if cache_tier:
+                data["cache"] = cache_tier
+    except Exception:
+        pass
+    return data
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import asyncio
+from typing import AsyncIterator, Optional
+
+
+class ReplayBuffer:
+    """Append-only chunk log that any number of readers can replay and then follow live."""
+
+    __slots__ = ("chunks", "done", "error", "_wake")
+
+    def __init__(self) -> None:
+        self.chunks: list[bytes] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._wake = asyncio.Event()
+
+    def push(self, chunk: bytes) -> None:
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if not self.done:
+            self.done, self.error = True, error
+            self._notify()
+
+    def _notify(self) -> None:
+        self._wake.set()
+        self._wake = asyncio.Event()
+
+    async def follow(self, start: int = 0) -> AsyncIterator[bytes]:
+        """Yield chunks from index ``start``, then new ones until ``finish``; re-raises its error."""
+        i = start
+        while True:
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._wake.wait()
@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from apps.common import fastjson, metrics
+from apps.common.db import database_sync_to_async
+from apps.common.redis_client import get_redis, get_sync_redis
+
+from . import retrieval, upstream
+from .models import CachedResponse
+
+
+EXACT = "exact"
+SEMANTIC = "semantic"
+
+# Serialized responses by cache key: (monotonic expiry, JSON bytes). Hits are
+# decoded fresh so callers may mutate what they get back.
+_local: "OrderedDict[str, tuple[float, bytes]]" = OrderedDict()
+_local_bytes = 0
+
+
+@dataclass(slots=True)
+class Probe:
+    """Result of a cache lookup; pass it back to ``store`` after a miss."""
+
+    model: str
+    key: str
+    data: Optional[dict] = None
+    tier: Optional[str] = None
+    # Prompt embedding computed during a semantic lookup, reused when storing
+    embedding_id: Optional[int] = None
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def cache_key(model: str, messages: list[dict], params: Optional[dict] = None) -> str:
+    # Whitespace-insensitive, and independent of extra keys on the message dicts
+    blob = json.dumps(
+        {
+            "model": model,
+            "messages": [[m.get("role", ""), _normalize(m.get("content") or "")] for m in messages],
+            "params": params or {},
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _redis_key(key: str) -> str:
+    return f"chat:response:{key}"
+
+
+def _exact_enabled(model: str) -> bool:
+    return model in settings.CHAT_RESPONSE_CACHE_MODELS
+
+
+def _semantic_enabled(model: str) -> bool:
+    return model in settings.CHAT_RESPONSE_CACHE_SEMANTIC_MODELS
+
+
+def _cacheable(data: dict) -> Optional[bytes]:
+    if not upstream.completion_text(data):
+        return None
+    raw = fastjson.dumps(data)
+    return raw if len(raw) <= settings.CHAT_RESPONSE_CACHE_MAX_ENTRY_BYTES else None
+
+
+def _local_pop(key: str) -> None:
+    global _local_bytes
+    item = _local.pop(key, None)
+    if item is not None:
+        _local_bytes -= len(item[1])
+
+
+def _local_get(key: str) -> Optional[bytes]:
+    item = _local.get(key)
+    if item is None:
+        return None
+    if item[0] < time.monotonic():
+        _local_pop(key)
+        return None
+    _local.move_to_end(key)
+    return item[1]
+
+
+def _local_put(key: str, raw: bytes, ttl: float) -> None:
+    global _local_bytes
+    _local_pop(key)
+    _local[key] = (time.monotonic() + ttl, raw)
+    _local_bytes += len(raw)
+    while _local and (
+        len(_local) > settings.CHAT_RESPONSE_CACHE_LOCAL_SIZE
+        or _local_bytes > settings.CHAT_RESPONSE_CACHE_LOCAL_MAX_BYTES
+    ):
+        _, (_, old) = _local.popitem(last=False)
+        _local_bytes -= len(old)
+
+
+def _semantic_text(messages: list[dict]) -> Optional[str]:
+    # Only short prompts are matched by meaning; long contexts rarely recur
+    text = "\n".join(f"{m.get('role', '')}: {_normalize(m.get('content') or '')}" for m in messages)
+    return text if len(text) <= settings.CHAT_RESPONSE_CACHE_SEMANTIC_MAX_CHARS else None
+
+
+def _nearest(model: str, vector: list[float]) -> Optional[dict]:
+    # Embeddings are shared with messages, so take a few index candidates and
+    # keep the closest one that is a live cached prompt for this model
+    distances = retrieval.nearest_embeddings(
+        vector, settings.CHAT_RESPONSE_CACHE_SEMANTIC_CANDIDATES, 1 - settings.CHAT_RESPONSE_CACHE_SIMILARITY)
+    if not distances:
+        return None
+    rows = CachedResponse.objects.filter(
+        embedding_id__in=list(distances), model=model, expires_at__gt=timezone.now()
+    ).values_list("embedding_id", "response")
+    best = min(rows, key=lambda row: distances[row[0]], default=None)
+    return best[1] if best is not None else None
+
+
+def _save_semantic(probe: Probe, data: dict) -> None:
+    CachedResponse.objects.update_or_create(
+        prompt_hash=probe.key,
+        defaults={
+            "model": probe.model,
+            "embedding_id": probe.embedding_id,
+            "response": data,
+            "expires_at": timezone.now() + timedelta(seconds=settings.CHAT_RESPONSE_CACHE_TTL),
+        },
+    )
+
+
+async def _put_exact(key: str, raw: bytes) -> None:
+    ttl = settings.CHAT_RESPONSE_CACHE_TTL
+    _local_put(key, raw, ttl)
+    try:
+        await get_redis().set(_redis_key(key), raw, ex=ttl)
+    except Exception:
+        pass
+
+
+async def lookup(model: str, messages: list[dict], **params) -> Optional[Probe]:
+    """Look up a cached upstream response for this exact request.
+
+    Returns ``None`` when ``model`` has not opted into caching. Otherwise the
+    probe carries the cached response and the tier that served it, or no data
+    on a miss. Cache failures count as misses.
+    """
+    exact, semantic = _exact_enabled(model), _semantic_enabled(model)
+    if not exact and not semantic:
+        return None
+    probe = Probe(model=model, key=cache_key(model, messages, params))
+
+    if exact:
+        raw = _local_get(probe.key)
+        if raw is None:
+            try:
+                raw = await get_redis().get(_redis_key(probe.key))
+            except Exception:
+                raw = None
+            if raw is not None:
+                _local_put(probe.key, raw, settings.CHAT_RESPONSE_CACHE_TTL)
+        if raw is not None:
+            probe.data, probe.tier = fastjson.loads(raw), EXACT
+            metrics.incr("chat_response_cache_hits", model=model, tier=EXACT)
+            return probe
+
+    text = _semantic_text(messages) if semantic and not params else None
+    if text is not None:
+        try:
+            probe.embedding_id, vector = await retrieval.embed_text(text)
+            data = await database_sync_to_async(_nearest)(model, vector)
+        except Exception:
+            data = None
+        if data is not None:
+            probe.data, probe.tier = data, SEMANTIC
+            metrics.incr("chat_response_cache_hits", model=model, tier=SEMANTIC)
+            # Promote so the next identical prompt skips the embedding lookup
+            if exact:
+                raw = _cacheable(data)
+                if raw is not None:
+                    await _put_exact(probe.key, raw)
+            return probe
+
+    metrics.incr("chat_response_cache_misses", model=model)
+    return probe
+
+
+async def store(probe: Probe, data: dict) -> bool:
+    """Cache a fresh upstream response. Returns whether a semantic row was written."""
+    raw = _cacheable(data)
+    if raw is None:
+        return False
+    if _exact_enabled(probe.model):
+        await _put_exact(probe.key, raw)
+    if probe.embedding_id is None or not _semantic_enabled(probe.model):
+        return False
+    try:
+        await database_sync_to_async(_save_semantic)(probe, data)
+    except Exception:
+        return False
+    return True
+
+
+def lookup_sync(model: str, messages: list[dict], **params) -> Optional[dict]:
+    """Exact-tier lookup for Celery tasks; Redis only."""
+    if not _exact_enabled(model):
+        return None
+    try:
+        raw = get_sync_redis().get(_redis_key(cache_key(model, messages, params)))
+    except Exception:
+        raw = None
+    if raw is None:
+        metrics.incr("chat_response_cache_misses", model=model)
+        return None
+    metrics.incr("chat_response_cache_hits", model=model, tier=EXACT)
+    return fastjson.loads(raw)
+
+
+def store_sync(model: str, messages: list[dict], data: dict, **params) -> None:
+    if not _exact_enabled(model):
+        return
+    raw = _cacheable(data)
+    if raw is None:
+        return
+    try:
+        get_sync_redis().set(
+            _redis_key(cache_key(model, messages, params)), raw, ex=settings.CHAT_RESPONSE_CACHE_TTL)
+    except Exception:
+        pass
+
+
+def prune(max_entries: int) -> int:
+    """Drop expired semantic entries and the oldest beyond ``max_entries``."""
+    deleted, _ = CachedResponse.objects.filter(expires_at__lte=timezone.now()).delete()
+    cutoff = list(CachedResponse.objects.order_by("-id").values_list("id", flat=True)[max_entries:max_entries + 1])
+    if cutoff:
+        n, _ = CachedResponse.objects.filter(id__lte=cutoff[0]).delete()
+        deleted += n
+    return deleted
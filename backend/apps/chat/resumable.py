@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import weakref
+from contextlib import aclosing
+from typing import AsyncIterator, Optional
+
+from django.conf import settings
+
+from apps.common import fastjson, metrics
+from apps.common.redis_client import get_redis
+
+from . import batching, pipeline, sse
+from .replay import ReplayBuffer
+
+
+# Resumable generations run in a task of their own rather than inside the HTTP
+# response. Every batch of SSE frames is followed by an ``id: <generation>.<seq>``
+# line and appended to a capped Redis stream (entry id ``<seq>-0``), so a client
+# that reconnects with Last-Event-ID replays what it missed and then follows
+# the live tail, on any worker. The generation's conversation is stored next
+# to its log, so only the conversation's owner may resume it.
+
+# XREAD blocks in short slices so each call stays under the Redis socket timeout
+_BLOCK_MS = 250
+
+# Strong references to running producers and reapers; the loop only keeps weak ones
+_tasks: set[asyncio.Task] = set()
+_local_by_loop: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, _Generation]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+class UnknownGeneration(Exception):
+    """The generation never existed here or its log has expired."""
+
+
+class _Generation(ReplayBuffer):
+    """Local replay buffer of a running generation and the readers attached to it."""
+
+    __slots__ = ("conversation_id", "task", "readers", "reaper")
+
+    def __init__(self, conversation_id: int) -> None:
+        super().__init__()
+        self.conversation_id = conversation_id
+        self.task: Optional[asyncio.Task] = None
+        self.readers = 0
+        self.reaper: Optional[asyncio.Task] = None
+
+
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.get_running_loop().create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+def _local() -> dict[str, _Generation]:
+    loop = asyncio.get_running_loop()
+    buffers = _local_by_loop.get(loop)
+    if buffers is None:
+        buffers = _local_by_loop[loop] = {}
+    return buffers
+
+
+def _log_key(generation: str) -> str:
+    return f"chat:gen:{generation}:log"
+
+
+def _conversation_key(generation: str) -> str:
+    return f"chat:gen:{generation}:conversation"
+
+
+def _readers_key(generation: str) -> str:
+    # Readers following the log from other workers
+    return f"chat:gen:{generation}:readers"
+
+
+def event_id(generation: str, seq: int) -> str:
+    return f"{generation}.{seq}"
+
+
+def parse_event_id(value: Optional[str]) -> Optional[tuple[str, int]]:
+    generation, _, seq = (value or "").strip().rpartition(".")
+    if not generation or not seq.isdigit():
+        return None
+    return generation, int(seq)
+
+
+def _frame(body: bytes, generation: str, seq: int) -> bytes:
+    # An id-only event carries no data; it just moves the client's Last-Event-ID
+    return body + f"id: {event_id(generation, seq)}\n\n".encode("ascii")
+
+
+async def _append(generation: str, seq: int, fields: dict, ttl: int, conversation_id: Optional[int] = None) -> None:
+    log, conversation = _log_key(generation), _conversation_key(generation)
+    try:
+        async with get_redis().pipeline(transaction=False) as pipe:
+            if conversation_id is not None:
+                pipe.set(conversation, conversation_id)
+            await pipe.xadd(
+                log, fields, id=f"{seq}-0", maxlen=settings.CHAT_RESUME_MAX_EVENTS, approximate=True,
+            ).expire(log, ttl).expire(conversation, ttl).execute()
+    except Exception:
+        # Same-worker reconnects still work from the local buffer
+        pass
+
+
+async def _produce(turn: pipeline.Turn, buffer: _Generation) -> None:
+    generation = turn.generation
+    live_ttl = settings.CHAT_RESUME_TTL + int(settings.CHAT_STREAM_TTFT_TIMEOUT)
+    seq = 1
+    data = _frame(sse.encode_frame(fastjson.dumps({"meta": turn.meta()})), generation, seq)
+    buffer.push(data)
+    await _append(generation, seq, {"d": data}, live_ttl, turn.conversation_id)
+    try:
+        async with aclosing(batching.coalesce(pipeline.stream(turn))) as batches:
+            async for events in batches:
+                seq += 1
+                data = _frame(b"".join(e.raw for e in events), generation, seq)
+                buffer.push(data)
+                await _append(generation, seq, {"d": data}, live_ttl)
+    finally:
+        turn.release()
+        await _append(generation, seq + 1, {"end": "1"}, settings.CHAT_RESUME_TTL)
+        buffer.finish()
+        # Late reconnects read the Redis log until it expires
+        local = _local()
+        if local.get(generation) is buffer:
+            del local[generation]
+
+
+def start(turn: pipeline.Turn) -> None:
+    """Run ``turn``'s generation in the background; read it with ``follow``.
+
+    Once its last reader disconnects the generation keeps running for
+    ``CHAT_RESUME_GRACE`` seconds, then is cancelled unless someone resumed.
+    """
+    buffer = _Generation(turn.conversation_id)
+    _local()[turn.generation] = buffer
+    buffer.task = _spawn(_produce(turn, buffer))
+    # A task cancelled before its first step never runs _produce's finally
+    buffer.task.add_done_callback(lambda _t: turn.release())
+
+
+async def _remote_readers(generation: str) -> int:
+    try:
+        return int(await get_redis().get(_readers_key(generation)) or 0)
+    except Exception:
+        # Unknown; let the generation run to completion
+        return 1
+
+
+async def _reap(generation: str, buffer: _Generation) -> None:
+    await asyncio.sleep(settings.CHAT_RESUME_GRACE)
+    if buffer.done or buffer.readers or await _remote_readers(generation):
+        return
+    if buffer.task is not None:
+        # pipeline.stream persists the partial reply and counts the abort
+        buffer.task.cancel()
+
+
+def _attach(buffer: _Generation) -> None:
+    buffer.readers += 1
+    if buffer.reaper is not None:
+        buffer.reaper.cancel()
+        buffer.reaper = None
+
+
+def _detach(generation: str, buffer: _Generation) -> None:
+    buffer.readers -= 1
+    if not buffer.readers and not buffer.done:
+        buffer.reaper = _spawn(_reap(generation, buffer))
+
+
+async def conversation_of(generation: str) -> Optional[int]:
+    """The conversation a generation belongs to, or ``None`` if there is nothing to resume."""
+    buffer = _local().get(generation)
+    if buffer is not None:
+        return buffer.conversation_id
+    try:
+        value = await get_redis().get(_conversation_key(generation))
+    except Exception:
+        return None
+    return int(value) if value is not None else None
+
+
+async def _follow_log(generation: str, after_seq: int) -> AsyncIterator[bytes]:
+    r = get_redis()
+    log = _log_key(generation)
+    if not await r.exists(log):
+        raise UnknownGeneration(generation)
+    readers = _readers_key(generation)
+    try:
+        async with r.pipeline(transaction=False) as pipe:
+            await pipe.incr(readers).expire(readers, settings.CHAT_RESUME_TTL).execute()
+    except Exception:
+        pass
+    try:
+        async with aclosing(_read_log(r, log, after_seq)) as chunks:
+            async for chunk in chunks:
+                yield chunk
+    finally:
+        try:
+            await r.decr(readers)
+        except Exception:
+            pass
+
+
+async def _read_log(r, log: str, after_seq: int) -> AsyncIterator[bytes]:
+    last = f"{after_seq}-0"
+    idle_since = time.monotonic()
+    while True:
+        resp = await r.xread({log: last}, count=256, block=_BLOCK_MS)
+        if not resp:
+            # The producer enforces its own deadlines; silence beyond them means it died
+            if time.monotonic() - idle_since > settings.CHAT_STREAM_TTFT_TIMEOUT + settings.CHAT_STREAM_IDLE_TIMEOUT:
+                return
+            continue
+        idle_since = time.monotonic()
+        for _, entries in resp:
+            for entry_id, fields in entries:
+                last = entry_id
+                data = fields.get(b"d")
+                if data is None:
+                    return
+                yield data
+
+
+async def follow(generation: str, after_seq: int = 0) -> AsyncIterator[bytes]:
+    """Frames of a generation after ``after_seq``, then the live tail until it ends.
+
+    Raises ``UnknownGeneration`` if there is nothing to resume.
+    """
+    buffer = _local().get(generation)
+    if after_seq:
+        metrics.incr("chat_stream_resumes")
+    if buffer is not None:
+        _attach(buffer)
+        try:
+            # Local chunk i carries seq i + 1
+            async with aclosing(buffer.follow(after_seq)) as chunks:
+                async for chunk in chunks:
+                    yield chunk
+        finally:
+            _detach(generation, buffer)
+        return
+    async with aclosing(_follow_log(generation, after_seq)) as chunks:
+        async for chunk in chunks:
+            yield chunk
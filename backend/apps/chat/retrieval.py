@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import hashlib
+from typing import Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from pgvector.django import CosineDistance
+
+from apps.common.db import database_sync_to_async
+
+from . import upstream
+from .models import Embedding, Message
+
+
+SNIPPETS_PREFIX = "Relevant snippets from past conversations:\n"
+
+# Roles worth embedding; must match the msg_embedding_pending_idx condition
+_EMBEDDED_ROLES = ("user", "assistant")
+# Snippet text injected per hit
+_SNIPPET_CHARS = 500
+# pgvector's upper bound for hnsw.ef_search
+_MAX_EF_SEARCH = 1000
+
+
+def content_hash(text: str) -> str:
+    # Keyed by model too, so switching models never reuses foreign vectors
+    return hashlib.sha256(f"{settings.CHAT_EMBEDDING_MODEL}\0{text.strip()}".encode("utf-8")).hexdigest()
+
+
+def _store(texts_by_hash: dict[str, str], vectors: list[list[float]]) -> dict[str, int]:
+    Embedding.objects.bulk_create(
+        [
+            Embedding(content_hash=h, model=settings.CHAT_EMBEDDING_MODEL, embedding=v)
+            for h, v in zip(texts_by_hash, vectors)
+        ],
+        ignore_conflicts=True,
+    )
+    return dict(Embedding.objects.filter(content_hash__in=list(texts_by_hash)).values_list("content_hash", "id"))
+
+
+def embed_pending(batch_size: int, max_batches: int) -> tuple[int, bool]:
+    """Attach embeddings to messages that have none, ``batch_size`` texts per request.
+
+    Texts already embedded (same content hash) are linked without calling the
+    provider. Returns the number of messages linked and whether more are pending.
+    """
+    linked = 0
+    last_id = 0
+    for _ in range(max_batches):
+        rows = list(
+            Message.objects.filter(pk__gt=last_id, embedding__isnull=True, role__in=_EMBEDDED_ROLES)
+            .order_by("id")
+            .values_list("id", "content")[:batch_size]
+        )
+        if not rows:
+            return linked, False
+        last_id = rows[-1][0]
+
+        hashes = {mid: content_hash(content) for mid, content in rows}
+        known = dict(
+            Embedding.objects.filter(content_hash__in=set(hashes.values())).values_list("content_hash", "id"))
+        missing: dict[str, str] = {}
+        for mid, text in rows:
+            h = hashes[mid]
+            if h not in known and h not in missing:
+                missing[h] = text.strip()
+        if missing:
+            vectors = upstream.embed_sync(settings.CHAT_EMBEDDING_MODEL, list(missing.values()), timeout=60)
+            known.update(_store(missing, vectors))
+
+        updates = [Message(pk=mid, embedding_id=known[h]) for mid, h in hashes.items() if h in known]
+        Message.objects.bulk_update(updates, ["embedding"])
+        linked += len(updates)
+    return linked, True
+
+
+def _cached_embedding(text: str) -> tuple[str, Optional[int], Optional[list[float]]]:
+    h = content_hash(text)
+    row = Embedding.objects.filter(content_hash=h).values_list("id", "embedding").first()
+    if row is None:
+        return h, None, None
+    return h, row[0], list(row[1])
+
+
+async def embed_text(text: str) -> tuple[int, list[float]]:
+    """Embedding id and vector for ``text``; the provider is called only for new text."""
+    h, embedding_id, vector = await database_sync_to_async(_cached_embedding)(text)
+    if embedding_id is None:
+        vector = (await upstream.embed(settings.CHAT_EMBEDDING_MODEL, [text.strip()], timeout=10))[0]
+        ids = await database_sync_to_async(_store)({h: text.strip()}, [vector])
+        embedding_id = ids[h]
+    return embedding_id, vector
+
+
+def nearest_embeddings(vector: list[float], limit: int, max_distance: float) -> dict[int, float]:
+    """Cosine distance by embedding id for up to ``limit`` embeddings nearest ``vector``.
+
+    Only the Embedding table is ordered, so the HNSW index serves the scan;
+    callers join and filter this candidate set afterwards. Anything farther
+    than ``max_distance`` is dropped.
+    """
+    ef_search = min(max(limit, settings.CHAT_VECTOR_EF_SEARCH), _MAX_EF_SEARCH)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # set_config rather than SET, which takes no bound parameters
+            cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)", [str(ef_search)])
+        rows = (
+            Embedding.objects.annotate(distance=CosineDistance("embedding", vector))
+            .order_by("distance")
+            .values_list("id", "distance")[:limit]
+        )
+        return {pk: distance for pk, distance in rows if distance <= max_distance}
+
+
+def _nearest(conversations, vector: list[float], k: int, exclude: Q) -> list[dict]:
+    # Approximate: hits outside the top k * OVERFETCH embeddings are missed
+    distances = nearest_embeddings(
+        vector, k * settings.CHAT_RETRIEVAL_OVERFETCH, settings.CHAT_RETRIEVAL_MAX_DISTANCE)
+    if not distances:
+        return []
+    hits = list(
+        Message.objects.filter(embedding_id__in=list(distances), conversation__in=conversations)
+        .exclude(exclude)
+        .values("id", "conversation_id", "role", "content", "created_at", "embedding_id")
+    )
+    for hit in hits:
+        hit["distance"] = distances[hit.pop("embedding_id")]
+    hits.sort(key=lambda h: (h["distance"], h["id"]))
+    return hits[:k]
+
+
+async def retrieve(
+    conversations,
+    text: str,
+    *,
+    k: int,
+    conversation_id: int,
+    in_context_after_id: Optional[int],
+) -> list[dict]:
+    """Top-``k`` past messages similar to ``text`` from ``conversations``.
+
+    Messages of the current conversation that are already in the prompt (id
+    above ``in_context_after_id``, or all of them without a summary) are skipped.
+    """
+    if not text.strip():
+        return []
+    _, vector = await embed_text(text)
+    exclude = Q(conversation_id=conversation_id)
+    if in_context_after_id is not None:
+        exclude &= Q(id__gt=in_context_after_id)
+    return await database_sync_to_async(_nearest)(conversations, vector, k, exclude)
+
+
+def snippets_message(hits: list[dict]) -> dict:
+    lines = [
+        f"- [{h['created_at']:%Y-%m-%d}] {h['role']}: {h['content'][:_SNIPPET_CHARS]}"
+        for h in hits
+    ]
+    return {"role": "system", "content": SNIPPETS_PREFIX + "\n".join(lines)}
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+from typing import List, Optional
+
+from ninja import Schema
+
+
+class MessageIn(Schema):
+    role: str
+    content: str
+
+
+class ChatRequest(Schema):
+    conversation_id: Optional[int] = None
+    messages: List[MessageIn]
+    model: Optional[str] = None  # proxy model alias; omitted or "auto" lets the router pick
+    # Overrides CHAT_ROUTER_LATENCY_BUDGET for routed requests
+    latency_budget_ms: Optional[int] = None
+    # Opt-in: inject the most similar past messages (pgvector) as a system snippet
+    retrieve: bool = False
+    retrieve_k: Optional[int] = None
+    # Keep generating after a disconnect and allow resuming with Last-Event-ID
+    resumable: Optional[bool] = None
+    # Admission class: "interactive" (default) or "background"
+    priority: Optional[str] = None
+
+
+class BatchJob(Schema):
+    # Echoed on the job's result line; defaults to its index in ``jobs``
+    id: Optional[str] = None
+    messages: List[MessageIn]
+    model: Optional[str] = None
+    latency_budget_ms: Optional[int] = None
+    # Only used with ``persist``; a new conversation is created otherwise
+    conversation_id: Optional[int] = None
+    # Batch jobs queue behind interactive chat unless marked otherwise
+    priority: str = "background"
+
+
+class BatchRequest(Schema):
+    jobs: List[BatchJob]
+    # Off: jobs are plain completions and nothing is written to the database
+    persist: bool = True
+
+
+_VALID_ROLES = {"system", "user", "assistant", "tool"}
+
+
+def validate_messages(payload: ChatRequest) -> Optional[str]:
+    if not payload.messages:
+        return "messages must be a non-empty list"
+    for i, m in enumerate(payload.messages):
+        if not m.role or m.role not in _VALID_ROLES:
+            return f"messages[{i}].role must be one of: system,user,assistant,tool"
+        if not isinstance(m.content, str) or not m.content.strip():
+            return f"messages[{i}].content must be a non-empty string"
+    return None
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Optional
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db.models import F
+
+from . import pagination
+from .models import Message
+
+
+# Text search configuration; must match the chat_message search_vector trigger
+SEARCH_CONFIG = "english"
+
+
+def search_messages(
+    conversations,
+    q: str,
+    *,
+    cursor: Optional[str],
+    size: int,
+    since: Optional[datetime] = None,
+) -> dict:
+    """Ranked full-text search over messages of the given conversation queryset.
+
+    Ranking and paging use only the GIN index and ``search_vector``; headlines,
+    which re-parse message text, are built for the returned page alone.
+    """
+    offset = pagination.decode_offset(cursor)
+    query = SearchQuery(q, search_type="websearch", config=SEARCH_CONFIG)
+    qs = Message.objects.filter(search_vector=query, conversation__in=conversations)
+    if since is not None:
+        qs = qs.filter(created_at__gte=since)
+    ranked = list(
+        qs.annotate(rank=SearchRank(F("search_vector"), query))
+        .order_by("-rank", "-id")
+        .values_list("id", "rank")[offset: offset + size + 1]
+    )
+    next_cursor = pagination.encode_offset(offset + size) if len(ranked) > size else None
+    ranked = ranked[:size]
+
+    rows = (
+        Message.objects.filter(pk__in=[message_id for message_id, _ in ranked])
+        .annotate(headline=SearchHeadline(
+            "content", query, config=SEARCH_CONFIG,
+            start_sel="<mark>", stop_sel="</mark>", max_fragments=2,
+        ))
+        .values("id", "conversation_id", "conversation__title", "role", "created_at", "headline")
+    )
+    by_id = {r["id"]: r for r in rows}
+    items = []
+    for message_id, rank in ranked:
+        r = by_id.get(message_id)
+        if r is None:
+            continue
+        items.append({
+            "message_id": message_id,
+            "conversation_id": r["conversation_id"],
+            "conversation_title": r["conversation__title"],
+            "role": r["role"],
+            "created_at": r["created_at"],
+            "rank": rank,
+            "headline": r["headline"],
+        })
+    return {"items": items, "next_cursor": next_cursor}
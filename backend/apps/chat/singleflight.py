@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+import weakref
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Optional
+
+import httpx
+from django.conf import settings
+
+from apps.common import fastjson, metrics
+from apps.common.redis_client import get_redis
+
+from . import hedge, model_router, response_cache, upstream
+from .replay import ReplayBuffer
+
+
+# Identical upstream requests that overlap in time share one provider call.
+#
+# Within a process, waiters attach to a ``_Flight`` that buffers every chunk,
+# so late joiners replay from the start and then follow the live tail. Across
+# workers, the first one to claim ``chat:flight:{key}`` leads and appends
+# each chunk to a Redis stream; the others relay that log into a local flight
+# of their own.
+
+STREAM = "stream"
+COMPLETE = "complete"
+
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+# XREAD blocks in short slices so each call stays under the Redis socket timeout
+_BLOCK_MS = 250
+
+
+class FlightError(Exception):
+    """The shared upstream request failed without an HTTP error response."""
+
+
+class _Flight(ReplayBuffer):
+    __slots__ = ("key", "subscribers", "task", "remote_id")
+
+    def __init__(self, key: str) -> None:
+        super().__init__()
+        self.key = key
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        # Set while this worker leads the flight for other workers too
+        self.remote_id: Optional[str] = None
+
+
+# Strong references to pending _abandon checks; the loop only keeps weak ones
+_pending_abandons: set[asyncio.Task] = set()
+_flights_by_loop: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, _Flight]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _flights() -> dict[str, _Flight]:
+    loop = asyncio.get_running_loop()
+    flights = _flights_by_loop.get(loop)
+    if flights is None:
+        flights = _flights_by_loop[loop] = {}
+    return flights
+
+
+def _lock_key(key: str) -> str:
+    return f"chat:flight:{key}"
+
+
+def _log_key(flight_id: str) -> str:
+    return f"chat:flight:log:{flight_id}"
+
+
+def _readers_key(flight_id: str) -> str:
+    return f"chat:flight:readers:{flight_id}"
+
+
+class _Publisher:
+    """Mirrors a leading flight into Redis for followers on other workers."""
+
+    __slots__ = ("lock", "flight_id", "log", "failed")
+
+    def __init__(self, key: str, flight_id: str) -> None:
+        self.lock = _lock_key(key)
+        self.flight_id = flight_id
+        self.log = _log_key(flight_id)
+        self.failed = False
+
+    async def push(self, chunk: bytes) -> None:
+        if self.failed:
+            return
+        ttl = settings.CHAT_SINGLEFLIGHT_LOCK_TTL
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                await pipe.xadd(self.log, {"c": chunk}).expire(self.log, ttl).expire(self.lock, ttl).execute()
+        except Exception:
+            # Remote followers time out and fall back on their own
+            self.failed = True
+
+    async def end(self, fields: dict) -> None:
+        try:
+            r = get_redis()
+            async with r.pipeline(transaction=False) as pipe:
+                await pipe.xadd(self.log, {"end": "1", **fields}).expire(
+                    self.log, settings.CHAT_SINGLEFLIGHT_LINGER).execute()
+            await r.eval(_RELEASE_SCRIPT, 1, self.lock, self.flight_id)
+        except Exception:
+            pass
+
+
+def _end_fields(error: Optional[BaseException]) -> dict:
+    if error is None:
+        return {}
+    if isinstance(error, httpx.HTTPStatusError):
+        return {"status": error.response.status_code, "body": error.response.content[:4096]}
+    return {"error": "1"}
+
+
+def _remote_error(fields: dict) -> Optional[BaseException]:
+    status = fields.get(b"status")
+    if status is not None:
+        request = httpx.Request("POST", upstream.litellm_base_url().rstrip("/") + upstream.CHAT_COMPLETIONS_PATH)
+        response = httpx.Response(int(status), content=fields.get(b"body") or b"", request=request)
+        return httpx.HTTPStatusError("Upstream provider error", request=request, response=response)
+    if fields.get(b"error") is not None:
+        return FlightError("Shared upstream request failed")
+    return None
+
+
+async def _lead(flight: _Flight, produce: Callable[[], AsyncIterator[bytes]], publisher: Optional[_Publisher]) -> None:
+    error: Optional[BaseException] = None
+    try:
+        async with aclosing(produce()) as chunks:
+            async for chunk in chunks:
+                flight.push(chunk)
+                if publisher is not None:
+                    await publisher.push(chunk)
+    except asyncio.CancelledError:
+        error = FlightError("Shared upstream request was abandoned")
+        raise
+    except Exception as exc:  # noqa: BLE001
+        error = exc
+    finally:
+        if publisher is not None:
+            await publisher.end(_end_fields(error))
+        flight.finish(error)
+
+
+async def _relay(flight: _Flight, flight_id: str, produce: Callable[[], AsyncIterator[bytes]]) -> None:
+    r = get_redis()
+    log, readers = _log_key(flight_id), _readers_key(flight_id)
+    try:
+        async with r.pipeline(transaction=False) as pipe:
+            await pipe.incr(readers).expire(readers, settings.CHAT_SINGLEFLIGHT_LOCK_TTL).execute()
+    except Exception:
+        pass
+    last = "0-0"
+    idle_since = time.monotonic()
+    try:
+        while True:
+            try:
+                resp = await r.xread({log: last}, count=256, block=_BLOCK_MS)
+            except Exception:
+                await asyncio.sleep(_BLOCK_MS / 1000)
+                resp = None
+            if not resp:
+                if time.monotonic() - idle_since > settings.CHAT_SINGLEFLIGHT_IDLE_TIMEOUT:
+                    break
+                continue
+            idle_since = time.monotonic()
+            for _, entries in resp:
+                for entry_id, fields in entries:
+                    last = entry_id
+                    chunk = fields.get(b"c")
+                    if chunk is not None:
+                        flight.push(chunk)
+                    else:
+                        flight.finish(_remote_error(fields))
+                        return
+    finally:
+        try:
+            await r.decr(readers)
+        except Exception:
+            pass
+    # The leader went quiet. Nothing was relayed yet, so it is safe to start over here.
+    if not flight.chunks:
+        await _lead(flight, produce, None)
+    else:
+        flight.finish(FlightError("Shared upstream request stalled"))
+
+
+async def _run(flight: _Flight, produce: Callable[[], AsyncIterator[bytes]]) -> None:
+    try:
+        flight_id = uuid.uuid4().hex
+        leader: Optional[str] = None
+        try:
+            r = get_redis()
+            for _ in range(2):
+                if await r.set(_lock_key(flight.key), flight_id, nx=True, ex=settings.CHAT_SINGLEFLIGHT_LOCK_TTL):
+                    leader = flight_id
+                    break
+                other = await r.get(_lock_key(flight.key))
+                if other is not None:
+                    leader = other.decode()
+                    break
+        except Exception:
+            # Without Redis, coalesce within this process only
+            leader = None
+        if leader is None:
+            await _lead(flight, produce, None)
+        elif leader == flight_id:
+            flight.remote_id = flight_id
+            await _lead(flight, produce, _Publisher(flight.key, flight_id))
+        else:
+            metrics.incr("chat_singleflight_joined", tier="remote")
+            await _relay(flight, leader, produce)
+    finally:
+        flight.finish(FlightError("Shared upstream request ended unexpectedly"))
+        flights = _flights()
+        if flights.get(flight.key) is flight:
+            del flights[flight.key]
+
+
+async def _abandon(flight: _Flight) -> None:
+    # Keep a leading flight alive for followers on other workers
+    if flight.subscribers or flight.done or flight.task is None:
+        return
+    remote = 0
+    if flight.remote_id is not None:
+        try:
+            remote = int(await get_redis().get(_readers_key(flight.remote_id)) or 0)
+        except Exception:
+            remote = 0
+    if not flight.subscribers and not remote:
+        flight.task.cancel()
+
+
+async def _join(
+    kind: str, model: str, messages: list[dict], params: dict, produce: Callable[[], AsyncIterator[bytes]]
+) -> AsyncIterator[bytes]:
+    if not settings.CHAT_SINGLEFLIGHT_ENABLED:
+        async with aclosing(produce()) as chunks:
+            async for chunk in chunks:
+                yield chunk
+        return
+    key = f"{kind}:{response_cache.cache_key(model, messages, params)}"
+    flights = _flights()
+    flight = flights.get(key)
+    if flight is None:
+        flight = flights[key] = _Flight(key)
+        flight.task = asyncio.create_task(_run(flight, produce))
+    else:
+        metrics.incr("chat_singleflight_joined", tier="local")
+    flight.subscribers += 1
+    try:
+        async with aclosing(flight.follow()) as chunks:
+            async for chunk in chunks:
+                yield chunk
+    finally:
+        flight.subscribers -= 1
+        if not flight.subscribers and not flight.done:
+            task = asyncio.get_running_loop().create_task(_abandon(flight))
+            _pending_abandons.add(task)
+            task.add_done_callback(_pending_abandons.discard)
+
+
+async def stream_chat(model: str, messages: list[dict]) -> AsyncIterator[bytes]:
+    """``upstream.stream_chat`` shared between identical concurrent requests.
+
+    Every caller sees the full byte stream from the start, however late it
+    joined. Iterate under ``contextlib.aclosing``.
+    """
+    async def produce() -> AsyncIterator[bytes]:
+        async with aclosing(hedge.stream_chat(model, messages)) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+    async with aclosing(_join(STREAM, model, messages, {}, produce)) as chunks:
+        async for chunk in chunks:
+            yield chunk
+
+
+async def complete_chat(model: str, messages: list[dict], **params) -> dict:
+    """``upstream.complete_chat`` shared between identical concurrent requests.
+
+    Each caller gets its own copy of the response.
+    """
+    async def produce() -> AsyncIterator[bytes]:
+        # Only the caller making the request feeds the router
+        try:
+            data = await upstream.complete_chat(model, messages, **params)
+        except (httpx.HTTPError, ValueError) as exc:
+            if hedge.counts_against_alias(exc):
+                model_router.record_failure(model)
+            raise
+        model_router.record_success(model)
+        yield fastjson.dumps(data)
+
+    parts: list[bytes] = []
+    async with aclosing(_join(COMPLETE, model, messages, params, produce)) as chunks:
+        async for chunk in chunks:
+            parts.append(chunk)
+    return fastjson.loads(b"".join(parts))
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Optional, Union
+
+from apps.common import fastjson
+
+
+_DONE = b"[DONE]"
+_CONNECTION_ERROR_MARKER = "litellm.APIConnectionError"
+
+
+@dataclass(slots=True)
+class DeltaEvent:
+    content: str
+    raw: bytes = b""
+
+
+@dataclass(slots=True)
+class UsageEvent:
+    usage: dict
+    raw: bytes = b""
+
+
+@dataclass(slots=True)
+class ErrorEvent:
+    error: dict
+    raw: bytes = b""
+
+    @property
+    def is_connection_error(self) -> bool:
+        return _CONNECTION_ERROR_MARKER in str(self.error.get("message") or "")
+
+
+@dataclass(slots=True)
+class DoneEvent:
+    raw: bytes = b"data: [DONE]\n\n"
+
+
+@dataclass(slots=True)
+class PassthroughEvent:
+    """A well-formed frame without text or usage, e.g. a role-only delta or a ``finish_reason``."""
+
+    raw: bytes = b""
+
+
+SSEEvent = Union[DeltaEvent, UsageEvent, ErrorEvent, DoneEvent, PassthroughEvent]
+
+
+def encode_frame(data: bytes) -> bytes:
+    return b"data: " + data + b"\n\n"
+
+
+class SSEParser:
+    """Incremental, byte-level parser for OpenAI-style chat completion streams.
+
+    Chunks are split on ``\\n`` while still bytes, so a multi-byte character
+    straddling two chunks is only decoded once its line is complete. Each event's
+    JSON payload is decoded exactly once. ``raw`` holds the re-encoded SSE frame
+    for events worth forwarding to the client as-is.
+    """
+
+    __slots__ = ("_buf", "_data")
+
+    def __init__(self) -> None:
+        self._buf = bytearray()
+        self._data: list[bytes] = []
+
+    def feed(self, chunk: bytes) -> list[SSEEvent]:
+        buf = self._buf
+        buf += chunk
+        events: list[SSEEvent] = []
+        start = 0
+        while True:
+            nl = buf.find(b"\n", start)
+            if nl < 0:
+                break
+            end = nl - 1 if nl > start and buf[nl - 1] == 0x0D else nl
+            line = bytes(buf[start:end])
+            start = nl + 1
+            if not line:
+                self._dispatch(events)
+            elif line.startswith(b"data:"):
+                value = line[5:]
+                if value.startswith(b" "):
+                    value = value[1:]
+                self._data.append(value)
+            # Comments (":...") and other fields (event/id/retry) carry nothing we use
+        if start:
+            del buf[:start]
+        return events
+
+    def close(self) -> list[SSEEvent]:
+        """Flush a trailing event that was not terminated by a blank line."""
+        events: list[SSEEvent] = []
+        if self._buf:
+            line = bytes(self._buf).rstrip(b"\r")
+            self._buf.clear()
+            if line.startswith(b"data:"):
+                self._data.append(line[5:].lstrip(b" "))
+        self._dispatch(events)
+        return events
+
+    def _dispatch(self, events: list[SSEEvent]) -> None:
+        if not self._data:
+            return
+        data = self._data[0] if len(self._data) == 1 else b"\n".join(self._data)
+        self._data.clear()
+        payload = data.strip()
+        if not payload:
+            return
+        if payload == _DONE:
+            events.append(DoneEvent())
+            return
+        try:
+            obj = fastjson.loads(payload)
+        except ValueError:
+            # Ignore malformed events; the rest of the stream is still usable
+            return
+        if not isinstance(obj, dict):
+            return
+        raw = encode_frame(payload)
+        error = obj.get("error")
+        if error:
+            events.append(ErrorEvent(error if isinstance(error, dict) else {"message": str(error)}, raw))
+            return
+        content = _extract_content(obj)
+        if content:
+            events.append(DeltaEvent(content, raw))
+            raw = b""
+        usage = obj.get("usage")
+        if isinstance(usage, dict):
+            events.append(UsageEvent(usage, raw))
+        elif not content and _well_formed(obj.get("choices")):
+            # Forwarded as-is so clients still see the role and finish_reason
+            events.append(PassthroughEvent(raw))
+
+
+def _well_formed(choices) -> bool:
+    if not isinstance(choices, list):
+        return False
+    if not choices:
+        return True
+    choice0 = choices[0]
+    if not isinstance(choice0, dict):
+        return False
+    for key in ("delta", "message"):
+        part = choice0.get(key)
+        if part is not None and (not isinstance(part, dict) or not isinstance(part.get("content"), (str, type(None)))):
+            return False
+    return True
+
+
+def _extract_content(obj: dict) -> Optional[str]:
+    # Shapes are checked rather than trusted: a malformed event yields no text
+    choices = obj.get("choices")
+    if not isinstance(choices, list) or not choices or not isinstance(choices[0], dict):
+        return None
+    choice0 = choices[0]
+    # OpenAI-style delta; some providers send message.content directly
+    delta = choice0.get("delta")
+    if isinstance(delta, dict):
+        content = delta.get("content")
+        if isinstance(content, str) and content:
+            return content
+    msg = choice0.get("message")
+    if isinstance(msg, dict):
+        content = msg.get("content")
+        if isinstance(content, str) and content:
+            return content
+    return None
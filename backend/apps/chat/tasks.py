@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+from asgiref.sync import sync_to_async
+from celery import shared_task
+from django.conf import settings
+
+from apps.common.redis_client import get_redis, get_sync_redis
+
+from . import context, history_cache, notifications, response_cache, retrieval, titles
+
+
+def _dedupe_key(name: str, scope: object) -> str:
+    return f"chat:task:{name}:{scope}"
+
+
+def _release(name: str, scope: object) -> None:
+    try:
+        get_sync_redis().delete(_dedupe_key(name, scope))
+    except Exception:
+        pass
+
+
+async def enqueue_once(task, name: str, scope: object, *args, ttl: int) -> bool:
+    """Enqueue ``task.delay(*args)`` unless one with the same name and scope is pending.
+
+    ``scope`` is usually a conversation id. The marker lives in Redis for
+    ``ttl`` seconds or until the task releases it. Tasks are idempotent, so if
+    Redis is unreachable we enqueue anyway.
+    """
+    key = _dedupe_key(name, scope)
+    try:
+        if not await get_redis().set(key, "1", nx=True, ex=ttl):
+            return False
+    except Exception:
+        pass
+    try:
+        await sync_to_async(task.delay, thread_sensitive=False)(*args)
+    except Exception:
+        # Broker unavailable; drop the marker so a later turn can retry
+        try:
+            await get_redis().delete(key)
+        except Exception:
+            pass
+        return False
+    return True
+
+
+@shared_task(ignore_result=True)
+def refresh_conversation_summary(conversation_id: int, model: str) -> None:
+    try:
+        if context.refresh_summary(conversation_id, model):
+            history_cache.invalidate_sync(conversation_id)
+    finally:
+        # Later overflowing turns may need another pass
+        _release("summary", conversation_id)
+
+
+@shared_task(ignore_result=True)
+def generate_conversation_title(conversation_id: int, last_user: str, assistant_text: str) -> None:
+    try:
+        title = titles.generate_title(conversation_id, last_user, assistant_text)
+    except Exception:
+        # Let the next turn try again
+        _release("title", conversation_id)
+        raise
+    # The marker is kept on success: the conversation is titled, so repeat
+    # enqueues on later turns are skipped until it expires
+    if title:
+        try:
+            notifications.publish_sync(
+                conversation_id, {"type": "title", "conversation_id": conversation_id, "title": title})
+        except Exception:
+            pass
+
+
+@shared_task(ignore_result=True)
+def embed_pending_messages() -> None:
+    more = False
+    try:
+        _, more = retrieval.embed_pending(
+            settings.CHAT_EMBEDDING_BATCH_SIZE, settings.CHAT_EMBEDDING_MAX_BATCHES)
+    finally:
+        _release("embed", "pending")
+    if more:
+        # Keep draining in fresh task runs so one backlog never hogs a worker
+        try:
+            claimed = get_sync_redis().set(
+                _dedupe_key("embed", "pending"), "1", nx=True, ex=settings.CHAT_TASK_DEDUPE_TTL)
+        except Exception:
+            claimed = True
+        if claimed:
+            embed_pending_messages.delay()
+
+
+@shared_task(ignore_result=True)
+def prune_response_cache() -> None:
+    # The marker is left to expire, so pruning runs at most once per interval
+    response_cache.prune(settings.CHAT_RESPONSE_CACHE_SEMANTIC_MAX_ENTRIES)
+
+
+async def schedule_summary_refresh(conversation_id: int, model: str) -> bool:
+    return await enqueue_once(
+        refresh_conversation_summary, "summary", conversation_id, conversation_id, model,
+        ttl=settings.CHAT_TASK_DEDUPE_TTL)
+
+
+async def schedule_title(conversation_id: int, last_user: str, assistant_text: str) -> bool:
+    return await enqueue_once(
+        generate_conversation_title, "title", conversation_id,
+        conversation_id, last_user[:1000], assistant_text[:1000],
+        ttl=settings.CHAT_TITLE_DEDUPE_TTL)
+
+
+async def schedule_embeddings() -> bool:
+    # One drain task at a time for the whole deployment; it batches across conversations
+    return await enqueue_once(
+        embed_pending_messages, "embed", "pending", ttl=settings.CHAT_TASK_DEDUPE_TTL)
+
+
+async def schedule_response_cache_prune() -> bool:
+    return await enqueue_once(
+        prune_response_cache, "response-cache", "prune", ttl=settings.CHAT_RESPONSE_CACHE_PRUNE_INTERVAL)
@@ -0,0 +1,13 @@
+from __future__ import annotations
+
+import pytest
+
+from apps.chat import model_router
+
+
+@pytest.fixture(autouse=True)
+def _fresh_router_stats():
+    # Router stats are process-wide; keep each test's recordings to itself
+    model_router._stats.clear()
+    yield
+    model_router._stats.clear()
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from apps.chat import admission
+
+
+@pytest.fixture(autouse=True)
+def _one_slot(settings):
+    settings.CHAT_ADMISSION_ENABLED = True
+    settings.CHAT_ADMISSION_MODEL_LIMITS = {"m": 1}
+    settings.CHAT_ADMISSION_INTERACTIVE_RESERVE = 0
+    settings.CHAT_ADMISSION_USER_CONCURRENCY = 0
+    settings.CHAT_ADMISSION_MODEL_TPM = {}
+    settings.CHAT_ADMISSION_QUEUE_SIZE = 4
+    settings.CHAT_ADMISSION_QUEUE_TIMEOUT = 1
+
+
+def test_disabled_admits_everything(settings):
+    settings.CHAT_ADMISSION_ENABLED = False
+
+    async def run():
+        return await admission.acquire("m", "u"), admission.try_acquire("m", "u")
+
+    assert asyncio.run(run()) == (None, None)
+
+
+def test_waiters_are_served_on_release():
+    async def run():
+        held = await admission.acquire("m", "u")
+        waiter = asyncio.create_task(admission.acquire("m", "v"))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        held.release()
+        held.release()  # idempotent
+        ticket = await asyncio.wait_for(waiter, 1)
+        ticket.release()
+
+    asyncio.run(run())
+
+
+def test_interactive_is_served_before_background():
+    async def run():
+        held = await admission.acquire("m", None)
+        order = []
+
+        async def wait(priority):
+            ticket = await admission.acquire("m", None, priority)
+            order.append(priority)
+            ticket.release()
+
+        background = asyncio.create_task(wait(admission.BACKGROUND))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(wait(admission.INTERACTIVE))
+        await asyncio.sleep(0)
+        held.release()
+        await asyncio.gather(background, interactive)
+        return order
+
+    assert asyncio.run(run()) == [admission.INTERACTIVE, admission.BACKGROUND]
+
+
+def test_queue_timeout_and_full_queue(settings):
+    settings.CHAT_ADMISSION_QUEUE_TIMEOUT = 0.05
+    settings.CHAT_ADMISSION_QUEUE_SIZE = 1
+
+    async def run():
+        held = await admission.acquire("m", None)
+        queued = asyncio.create_task(admission.acquire("m", None))
+        await asyncio.sleep(0)
+        with pytest.raises(admission.Rejected) as full:
+            await admission.acquire("m", None)
+        with pytest.raises(admission.Rejected) as timed_out:
+            await queued
+        held.release()
+        return full.value, timed_out.value
+
+    full, timed_out = asyncio.run(run())
+    assert (full.reason, timed_out.reason) == ("queue_full", "queue_timeout")
+    assert full.retry_after >= 1
+
+
+def test_user_cap_does_not_block_other_users(settings):
+    settings.CHAT_ADMISSION_MODEL_LIMITS = {"m": 4}
+    settings.CHAT_ADMISSION_USER_CONCURRENCY = 1
+
+    async def run():
+        mine = await admission.acquire("m", "u")
+        queued = asyncio.create_task(admission.acquire("m", "u"))
+        theirs = await asyncio.wait_for(admission.acquire("m", "v"), 0.1)
+        # The cap is per priority class
+        batch = await asyncio.wait_for(admission.acquire("m", "u", admission.BACKGROUND), 0.1)
+        await asyncio.sleep(0)
+        assert not queued.done()
+        mine.release()
+        for ticket in (await asyncio.wait_for(queued, 1), theirs, batch):
+            ticket.release()
+
+    asyncio.run(run())
+
+
+def test_try_acquire_never_queues():
+    async def run():
+        ticket = admission.try_acquire("m", None)
+        with pytest.raises(admission.Rejected) as busy:
+            admission.try_acquire("m", None, admission.BACKGROUND)
+        ticket.release()
+        with admission.try_acquire("m", None):
+            pass
+        # The with block gave the slot back
+        admission.try_acquire("m", None).release()
+        return busy.value
+
+    assert asyncio.run(run()).reason == "busy"
+
+
+def test_unclaimed_lease_gives_the_slot_back():
+    async def run():
+        ticket = await admission.acquire("m", None)
+        ticket.lease(0.01)
+        await asyncio.sleep(0.05)
+        # Expired: the slot is free again
+        admission.try_acquire("m", None).release()
+
+        claimed = await admission.acquire("m", None)
+        claimed.lease(0.01)
+        claimed.claim()
+        await asyncio.sleep(0.05)
+        with pytest.raises(admission.Rejected):
+            admission.try_acquire("m", None)
+        claimed.release()
+
+    asyncio.run(run())
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from apps.chat import batching, sse
+
+
+async def _collect(batches) -> list[list[sse.SSEEvent]]:
+    return [events async for events in batches]
+
+
+def _text(batch) -> str:
+    return "".join(e.content for e in batch if isinstance(e, sse.DeltaEvent))
+
+
+def test_adjacent_deltas_are_merged():
+    async def source():
+        for part in ("a", "b", "c"):
+            yield [sse.DeltaEvent(part, b"")]
+        yield [sse.DoneEvent()]
+
+    batches = asyncio.run(_collect(batching.coalesce(source(), interval=10, max_bytes=1 << 20)))
+    events = [e for batch in batches for e in batch]
+    assert _text(events) == "abc"
+    assert len([e for e in events if isinstance(e, sse.DeltaEvent)]) == 1
+    assert isinstance(events[-1], sse.DoneEvent)
+
+
+def test_first_delta_goes_out_at_once_and_done_is_not_held_back():
+    async def source():
+        yield [sse.DeltaEvent("a", b"")]
+        await asyncio.sleep(0.01)
+        yield [sse.DeltaEvent("b", b"")]
+        await asyncio.sleep(0.01)
+        yield [sse.DeltaEvent("c", b""), sse.DoneEvent()]
+
+    async def run():
+        started = asyncio.get_running_loop().time()
+        batches = await _collect(batching.coalesce(source(), interval=10, max_bytes=1 << 20))
+        return batches, asyncio.get_running_loop().time() - started
+
+    batches, elapsed = asyncio.run(run())
+    assert [_text(b) for b in batches] == ["a", "bc"]
+    assert isinstance(batches[-1][-1], sse.DoneEvent)
+    # The pending "b" did not wait out the 10s interval once the done event arrived
+    assert elapsed < 5
+
+
+def test_frames_of_merged_deltas_are_valid_sse():
+    event = batching.delta_event("hi")
+    (parsed,) = sse.SSEParser().feed(event.raw)
+    assert parsed.content == "hi"
+
+
+def test_upstream_error_is_raised_after_pending_events():
+    async def source():
+        yield [sse.DeltaEvent("a", b"")]
+        raise RuntimeError("upstream broke")
+
+    async def run():
+        seen = []
+        with pytest.raises(RuntimeError, match="upstream broke"):
+            async for events in batching.coalesce(source(), interval=0, max_bytes=1 << 20):
+                seen.append(_text(events))
+        return seen
+
+    assert asyncio.run(run()) == ["a"]
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+
+import pytest
+from django.contrib.auth import get_user_model
+
+from apps.chat import export, persistence
+from apps.common import fastjson
+
+
+# Exports read on the DB executor's own connections, so rows must be committed
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+@pytest.fixture
+def user():
+    return get_user_model().objects.create_user(username="bob", password="x")
+
+
+async def _read(user, conversation_id=None, *, compress=False) -> bytes:
+    return b"".join([chunk async for chunk in export.stream(user, conversation_id, compress=compress)])
+
+
+def _lines(body: bytes) -> list[dict]:
+    return [fastjson.loads(line) for line in body.splitlines()]
+
+
+def test_ndjson_of_all_conversations(user, settings):
+    settings.CHAT_EXPORT_CHUNK_BYTES = 64
+    first, _ = persistence.save_messages(None, user, [("user", "a"), ("user", "b")])
+    persistence.save_assistant_message(first, "c")
+    second, _ = persistence.save_messages(None, user, [("user", "d")])
+    persistence.save_messages(None, None, [("user", "not mine")])
+
+    lines = _lines(asyncio.run(_read(user)))
+    assert [(line["type"], line.get("content")) for line in lines] == [
+        ("conversation", None), ("message", "a"), ("message", "b"), ("message", "c"),
+        ("conversation", None), ("message", "d"),
+    ]
+    assert [line["id"] for line in lines if line["type"] == "conversation"] == [first, second]
+    assert lines[0]["message_count"] == 3
+    assert all(line["conversation_id"] == second for line in lines[5:])
+
+
+def test_single_conversation_gzipped(user):
+    conversation_id, _ = persistence.save_messages(None, user, [("user", "é" * 1000)])
+    persistence.save_messages(None, user, [("user", "other")])
+
+    lines = _lines(gzip.decompress(asyncio.run(_read(user, conversation_id, compress=True))))
+    assert [line["type"] for line in lines] == ["conversation", "message"]
+    assert lines[1]["content"] == "é" * 1000
+
+
+def test_exists_is_scoped_to_the_owner(user):
+    conversation_id, _ = persistence.save_messages(None, user, [("user", "a")])
+    other = get_user_model().objects.create_user(username="carol", password="x")
+
+    async def run():
+        return await export.exists(user, conversation_id), await export.exists(other, conversation_id)
+
+    assert asyncio.run(run()) == (True, False)
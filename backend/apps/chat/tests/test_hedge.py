@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import asyncio
+from contextlib import aclosing
+
+import httpx
+import pytest
+
+from apps.chat import admission, hedge, model_router, upstream
+
+
+def _chunk(text: str) -> bytes:
+    return b'data: {"choices":[{"delta":{"content":"' + text.encode() + b'"}}]}\n\n'
+
+
+@pytest.fixture(autouse=True)
+def _hedged(settings, monkeypatch):
+    settings.CHAT_HEDGE_ALIASES = {"a": "b"}
+    settings.CHAT_HEDGE_AFTER = 0.05
+    settings.CHAT_STREAM_TTFT_TIMEOUT = 2
+    settings.CHAT_STREAM_IDLE_TIMEOUT = 2
+    settings.CHAT_ADMISSION_ENABLED = True
+    settings.CHAT_ADMISSION_MODEL_LIMITS = {"b": 1}
+    settings.CHAT_ADMISSION_INTERACTIVE_RESERVE = 0
+
+    delays = {"a": 0.3, "b": 0.0}
+
+    async def stream_chat(model, messages):
+        await asyncio.sleep(delays[model])
+        yield _chunk(model)
+        yield b"data: [DONE]\n\n"
+
+    monkeypatch.setattr(upstream, "stream_chat", stream_chat)
+
+
+async def _read() -> bytes:
+    parts = []
+    async with aclosing(hedge.stream_chat("a", [{"role": "user", "content": "hi"}])) as chunks:
+        async for chunk in chunks:
+            parts.append(chunk)
+    return b"".join(parts)
+
+
+def test_slow_primary_is_raced_and_each_alias_recorded_once():
+    body = asyncio.run(_read())
+    assert _chunk("b") in body and _chunk("a") not in body
+    assert body.endswith(b"data: [DONE]\n\n")
+    a, b = model_router._stats["a"], model_router._stats["b"]
+    # The primary only gets a lower bound on its first token, the hedge a full sample
+    assert len(a.ttft_samples) == 1 and a.consecutive_failures == 0
+    assert len(b.ttft_samples) == 1 and b.ttft_ewma < a.ttft_ewma
+
+
+def test_failed_primary_fails_over_at_once(settings, monkeypatch):
+    settings.CHAT_HEDGE_AFTER = 10
+    request = httpx.Request("POST", "http://litellm/v1/chat/completions")
+
+    async def stream_chat(model, messages):
+        if model == "a":
+            raise httpx.HTTPStatusError("down", request=request, response=httpx.Response(503, request=request))
+        yield _chunk(model)
+
+    monkeypatch.setattr(upstream, "stream_chat", stream_chat)
+    assert asyncio.run(asyncio.wait_for(_read(), 1)) == _chunk("b")
+    assert model_router._stats["a"].consecutive_failures == 1
+
+
+def test_no_first_token_in_time(settings):
+    settings.CHAT_HEDGE_ALIASES = {}
+    settings.CHAT_STREAM_TTFT_TIMEOUT = 0.05
+    with pytest.raises(hedge.StreamTimeout):
+        asyncio.run(_read())
+
+
+def test_hedge_is_skipped_without_a_free_slot():
+    async def run():
+        held = admission.try_acquire("b", None, admission.BACKGROUND)
+        try:
+            return await _read()
+        finally:
+            held.release()
+
+    body = asyncio.run(run())
+    assert _chunk("a") in body and _chunk("b") not in body
+    assert "b" not in model_router._stats
+
+
+def test_hedge_ticket_is_released_with_the_call():
+    async def run():
+        await _read()
+        await asyncio.sleep(0)
+        # Raises if the hedge still held b's only slot
+        admission.try_acquire("b", None).release()
+
+    asyncio.run(run())
+
+
+def test_primary_ending_cleanly_without_a_token_is_not_hedged(settings, monkeypatch):
+    settings.CHAT_HEDGE_AFTER = 10
+    calls = []
+    error = b'data: {"error":{"message":"content policy"}}\n\n'
+
+    async def stream_chat(model, messages):
+        calls.append(model)
+        yield error
+
+    monkeypatch.setattr(upstream, "stream_chat", stream_chat)
+    assert asyncio.run(asyncio.wait_for(_read(), 1)) == error
+    assert calls == ["a"]
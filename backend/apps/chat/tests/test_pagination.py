@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.test import Client
+from django.utils import timezone as django_timezone
+
+from apps.chat import pagination, persistence
+from apps.chat.models import Conversation
+
+
+TS = datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+
+
+def test_cursor_round_trip():
+    cursor = pagination.encode_cursor(TS, 42)
+    assert "=" not in cursor
+    assert pagination.decode_cursor(cursor) == (TS, 42)
+
+
+@pytest.mark.parametrize("cursor", ["", "!!!", "bm90IGpzb24", pagination.encode_offset(3)])
+def test_invalid_cursor(cursor):
+    with pytest.raises(pagination.InvalidCursor):
+        pagination.decode_cursor(cursor)
+
+
+def test_before_is_strictly_after_the_cursor_row():
+    assert pagination.before("updated_at", None) == pagination.Q()
+    q = pagination.before("updated_at", pagination.encode_cursor(TS, 7))
+    assert q == pagination.Q(updated_at__lt=TS) | pagination.Q(updated_at=TS, id__lt=7)
+
+
+def test_paginate_trims_the_lookahead_row():
+    rows = [{"id": i, "created_at": TS} for i in (5, 4, 3)]
+    page, cursor = pagination.paginate(rows, 2, "created_at")
+    assert [r["id"] for r in page] == [5, 4]
+    assert pagination.decode_cursor(cursor) == (TS, 4)
+    assert pagination.paginate(rows, 3, "created_at") == (rows, None)
+
+
+def test_page_size(settings):
+    settings.CHAT_MAX_PAGE_SIZE = 100
+    assert pagination.page_size(None, 20) == 20
+    assert pagination.page_size(0, 20) == 20
+    assert pagination.page_size(500, 20) == 100
+
+
+def test_offset_cursor():
+    assert pagination.decode_offset(None) == 0
+    assert pagination.decode_offset(pagination.encode_offset(40)) == 40
+    with pytest.raises(pagination.InvalidCursor):
+        pagination.decode_offset(pagination.encode_cursor(TS, 1))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_conversation_list_keyset_pages():
+    user = get_user_model().objects.create_user(username="alice", password="x")
+    ids = [persistence.save_messages(None, user, [("user", f"m{i}")])[0] for i in range(5)]
+    # Ties on updated_at are broken by id
+    Conversation.objects.filter(pk__in=ids[1:4]).update(updated_at=django_timezone.now())
+
+    client = Client()
+    client.force_login(user)
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/api/chat/conversations", params).json()
+        seen += [item["id"] for item in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    expected = list(Conversation.objects.order_by("-updated_at", "-id").values_list("id", flat=True))
+    assert seen == expected
+    assert sorted(seen) == sorted(ids)
+
+    response = client.get("/api/chat/conversations", {"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+    assert response.json() == {"message": "invalid cursor"}
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+from datetime import timedelta
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.utils import timezone
+
+from apps.chat import persistence
+from apps.chat.models import PREVIEW_LENGTH, Conversation, Message
+
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def user():
+    return get_user_model().objects.create_user(username="alice", password="x")
+
+
+def test_new_conversation_counters(user):
+    conversation_id, rows = persistence.save_messages(None, user, [("user", "hi"), ("user", "there")])
+    conv = Conversation.objects.get(pk=conversation_id)
+    assert conv.owner == user
+    assert conv.message_count == 2
+    assert conv.last_message_preview == "there"
+    assert [r["content"] for r in rows] == ["hi", "there"]
+    assert all(r["id"] for r in rows)
+
+
+def test_appending_bumps_counters_and_updated_at(user):
+    conversation_id, _ = persistence.save_messages(None, user, [("user", "hi")])
+    stale = timezone.now() - timedelta(days=1)
+    Conversation.objects.filter(pk=conversation_id).update(updated_at=stale)
+
+    persistence.save_messages(conversation_id, user, [("user", "again")])
+    saved = persistence.save_assistant_message(conversation_id, "x" * 500)
+
+    conv = Conversation.objects.get(pk=conversation_id)
+    assert conv.message_count == 3 == Message.objects.filter(conversation_id=conversation_id).count()
+    assert conv.updated_at == conv.last_message_at == saved["created_at"]
+    assert conv.last_message_preview == "x" * PREVIEW_LENGTH
+
+
+def test_unknown_conversation():
+    assert persistence.save_messages(10**9, None, [("user", "hi")]) is None
+    assert persistence.save_messages(None, None, []) is None
+
+
+def test_ownership(user):
+    mine, _ = persistence.save_messages(None, user, [("user", "hi")])
+    anonymous, _ = persistence.save_messages(None, None, [("user", "hi")])
+    assert persistence.owns(user, mine)
+    assert not persistence.owns(user, anonymous)
+    assert not persistence.owns(AnonymousUser(), mine)
+    assert persistence.owns(AnonymousUser(), anonymous)
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import asyncio
+from contextlib import aclosing
+
+import pytest
+
+from apps.chat import context, model_router, pipeline, singleflight, sse
+from apps.common import metrics
+
+
+def _chunk(text: str) -> bytes:
+    return b'data: {"choices":[{"delta":{"content":"' + text.encode() + b'"}}]}\n\n'
+
+
+@pytest.fixture
+def finished(settings, monkeypatch):
+    settings.CHAT_FANOUT_ENABLED = False
+    replies: list[str] = []
+
+    async def _finish(turn, assistant_text):
+        replies.append(assistant_text)
+
+    monkeypatch.setattr(pipeline, "_finish", _finish)
+    return replies
+
+
+def _turn() -> pipeline.Turn:
+    return pipeline.Turn(
+        conversation_id=1,
+        route=model_router.Route(model="m", reason="requested", complexity=0.0),
+        history=None,
+        messages=[{"role": "user", "content": "hi"}],
+        context_usage=context.ContextUsage(model="m", budget=1000),
+        last_user="hi",
+    )
+
+
+def _upstream(monkeypatch, *chunks: bytes) -> None:
+    async def stream_chat(model, messages):
+        for chunk in chunks:
+            yield chunk
+
+    monkeypatch.setattr(singleflight, "stream_chat", stream_chat)
+
+
+async def _events(turn: pipeline.Turn) -> list[sse.SSEEvent]:
+    async with aclosing(pipeline.stream(turn)) as batches:
+        return [event async for events in batches for event in events]
+
+
+def test_stream_ends_with_done_and_persists_the_reply(monkeypatch, finished):
+    _upstream(monkeypatch, _chunk("Hel"), _chunk("lo"), b"data: [DONE]\n\n")
+    events = asyncio.run(_events(_turn()))
+    assert [e.content for e in events if isinstance(e, sse.DeltaEvent)] == ["Hel", "lo"]
+    assert isinstance(events[-1], sse.DoneEvent)
+    assert sum(isinstance(e, sse.DoneEvent) for e in events) == 1
+    assert finished == ["Hello"]
+
+
+def test_done_is_added_when_upstream_closes_without_one(monkeypatch, finished):
+    _upstream(monkeypatch, _chunk("partial"))
+    events = asyncio.run(_events(_turn()))
+    assert isinstance(events[-1], sse.DoneEvent)
+    assert finished == ["partial"]
+
+
+def test_finish_reason_and_unterminated_last_event_reach_the_client(monkeypatch, finished):
+    finish = b'data: {"choices":[{"delta":{},"finish_reason":"length"}]}\n\n'
+    _upstream(monkeypatch, _chunk("cut"), finish, _chunk(" off").rstrip(b"\n"))
+    events = asyncio.run(_events(_turn()))
+    assert [e.raw for e in events if isinstance(e, sse.PassthroughEvent)] == [finish]
+    assert isinstance(events[-1], sse.DoneEvent)
+    assert finished == ["cut off"]
+
+
+def test_disconnect_while_finishing_still_saves(monkeypatch, settings):
+    settings.CHAT_FANOUT_ENABLED = False
+    _upstream(monkeypatch, _chunk("all of it"), b"data: [DONE]\n\n")
+    saved: list[str] = []
+
+    async def run():
+        gate = asyncio.Event()
+
+        async def _finish(turn, assistant_text):
+            await gate.wait()
+            saved.append(assistant_text)
+
+        monkeypatch.setattr(pipeline, "_finish", _finish)
+        reader = asyncio.create_task(_events(_turn()))
+        await asyncio.sleep(0.05)
+        reader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await reader
+        gate.set()
+        await asyncio.gather(*pipeline._finalizers)
+
+    aborts = metrics.snapshot()["counters"].get("chat_stream_aborts{model=m}", 0)
+    asyncio.run(run())
+    assert saved == ["all of it"]
+    assert metrics.snapshot()["counters"]["chat_stream_aborts{model=m}"] == aborts + 1
@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from apps.chat import resumable
+
+
+def _no_redis():
+    raise ConnectionError("redis unavailable")
+
+
+@pytest.fixture(autouse=True)
+def _local_only(monkeypatch):
+    monkeypatch.setattr(resumable, "get_redis", _no_redis)
+
+
+def test_event_ids():
+    assert resumable.parse_event_id(resumable.event_id("abc", 12)) == ("abc", 12)
+    assert resumable.parse_event_id(" abc.3 ") == ("abc", 3)
+    for value in (None, "", "abc", "abc.", ".3", "abc.x"):
+        assert resumable.parse_event_id(value) is None
+
+
+def test_generations_remember_their_conversation():
+    async def run():
+        resumable._local()["gen"] = resumable._Generation(7)
+        return await resumable.conversation_of("gen"), await resumable.conversation_of("other")
+
+    assert asyncio.run(run()) == (7, None)
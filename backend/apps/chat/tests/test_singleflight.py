@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import asyncio
+from contextlib import aclosing
+
+import pytest
+
+from apps.chat import model_router, singleflight, upstream
+
+
+CHUNKS = [
+    b'data: {"choices":[{"delta":{"content":"one "}}]}\n\n',
+    b'data: {"choices":[{"delta":{"content":"two"}}]}\n\n',
+    b"data: [DONE]\n\n",
+]
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def _no_redis():
+    raise ConnectionError("redis unavailable")
+
+
+@pytest.fixture(autouse=True)
+def _local_only(settings, monkeypatch):
+    settings.CHAT_SINGLEFLIGHT_ENABLED = True
+    settings.CHAT_HEDGE_ALIASES = {}
+    # Flights coalesce within the process when Redis is unreachable
+    monkeypatch.setattr(singleflight, "get_redis", _no_redis)
+
+
+class FakeUpstream:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def stream_chat(self, model, messages):
+        self.calls += 1
+        yield CHUNKS[0]
+        await self.release.wait()
+        for chunk in CHUNKS[1:]:
+            yield chunk
+
+
+async def _read(model: str) -> bytes:
+    parts = []
+    async with aclosing(singleflight.stream_chat(model, MESSAGES)) as chunks:
+        async for chunk in chunks:
+            parts.append(chunk)
+    return b"".join(parts)
+
+
+def test_concurrent_identical_streams_share_one_call(monkeypatch):
+    async def run():
+        fake = FakeUpstream()
+        monkeypatch.setattr(upstream, "stream_chat", fake.stream_chat)
+        readers = [asyncio.create_task(_read("m")) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        # A late joiner still replays the stream from its first byte
+        readers.append(asyncio.create_task(_read("m")))
+        await asyncio.sleep(0.05)
+        fake.release.set()
+        return fake.calls, await asyncio.gather(*readers)
+
+    calls, bodies = asyncio.run(run())
+    assert calls == 1
+    assert bodies == [b"".join(CHUNKS)] * 4
+    # The router hears about the shared call once
+    assert model_router._stats["m"].ttft_ewma is not None
+    assert len(model_router._stats["m"].ttft_samples) == 1
+
+
+def test_different_requests_do_not_share(monkeypatch):
+    async def run():
+        fake = FakeUpstream()
+        fake.release.set()
+        monkeypatch.setattr(upstream, "stream_chat", fake.stream_chat)
+        await asyncio.gather(_read("m"), _read("other"))
+        return fake.calls
+
+    assert asyncio.run(run()) == 2
+
+
+def test_complete_chat_callers_get_their_own_copy(monkeypatch):
+    calls = []
+
+    async def complete_chat(model, messages, **params):
+        calls.append(model)
+        await asyncio.sleep(0.05)
+        return {"choices": [{"message": {"content": "hi"}}]}
+
+    monkeypatch.setattr(upstream, "complete_chat", complete_chat)
+
+    async def run():
+        return await asyncio.gather(*(singleflight.complete_chat("m", MESSAGES) for _ in range(3)))
+
+    first, second, third = asyncio.run(run())
+    assert calls == ["m"]
+    assert first == second == third
+    first["choices"].clear()
+    assert second["choices"]
+
+
+def test_upstream_failure_reaches_every_joiner(monkeypatch):
+    async def stream_chat(model, messages):
+        await asyncio.sleep(0.05)
+        raise ValueError("bad upstream")
+        yield b""  # pragma: no cover
+
+    monkeypatch.setattr(upstream, "stream_chat", stream_chat)
+
+    async def run():
+        return await asyncio.gather(_read("m"), _read("m"), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert model_router._stats["m"].consecutive_failures == 1
@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+import importlib
+import inspect
+
+from django.conf import settings
+
+
+def test_asgi_application_imports():
+    asgi = importlib.import_module("meeter_platform.asgi")
+    assert callable(asgi.application)
+
+
+def test_pool_options_are_accepted_by_psycopg_pool():
+    from psycopg_pool import ConnectionPool
+
+    database = settings.DATABASES["default"]
+    pool = database["OPTIONS"].get("pool")
+    if not settings.DB_POOL_ENABLED:
+        assert pool is None
+        return
+    accepted = inspect.signature(ConnectionPool).parameters
+    assert set(pool) <= set(accepted)
+    # Django passes check= itself, from CONN_HEALTH_CHECKS
+    assert "check" not in pool
+    assert database["CONN_HEALTH_CHECKS"] is True
+    assert database["CONN_MAX_AGE"] == 0
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+from apps.chat import sse
+
+
+def _texts(events):
+    return [e.content for e in events if isinstance(e, sse.DeltaEvent)]
+
+
+def _frame(content: str) -> bytes:
+    return b'data: {"choices":[{"delta":{"content":"' + content.encode() + b'"}}]}\n\n'
+
+
+def test_parses_deltas_usage_and_done():
+    parser = sse.SSEParser()
+    events = parser.feed(
+        _frame("Hel")
+        + b": keep-alive\n\n"
+        + _frame("lo")
+        + b'data: {"choices":[],"usage":{"completion_tokens":2}}\n\n'
+        + b"data: [DONE]\n\n"
+    )
+    assert _texts(events) == ["Hel", "lo"]
+    assert isinstance(events[2], sse.UsageEvent)
+    assert events[2].usage == {"completion_tokens": 2}
+    assert isinstance(events[3], sse.DoneEvent)
+    assert events[0].raw == sse.encode_frame(b'{"choices":[{"delta":{"content":"Hel"}}]}')
+
+
+def test_multibyte_character_split_across_chunks():
+    frame = _frame("héllo ☃")
+    parser = sse.SSEParser()
+    events = []
+    for i in range(len(frame)):
+        events += parser.feed(frame[i:i + 1])
+    assert _texts(events) == ["héllo ☃"]
+
+
+def test_crlf_lines_and_multiline_data():
+    parser = sse.SSEParser()
+    events = parser.feed(b'data: {"choices":\r\ndata: [{"delta":{"content":"x"}}]}\r\n\r\n')
+    assert _texts(events) == ["x"]
+
+
+def test_error_event():
+    parser = sse.SSEParser()
+    (event,) = parser.feed(b'data: {"error":{"message":"litellm.APIConnectionError: boom"}}\n\n')
+    assert isinstance(event, sse.ErrorEvent)
+    assert event.is_connection_error
+
+
+def test_malformed_events_are_skipped():
+    parser = sse.SSEParser()
+    events = parser.feed(
+        b"data: {not json\n\n"
+        + b"data: [1, 2]\n\n"
+        + b'data: {"choices":"nope"}\n\n'
+        + b'data: {"choices":[null]}\n\n'
+        + b'data: {"choices":[{"delta":"text"}]}\n\n'
+        + b'data: {"choices":[{"delta":{"content":5}}]}\n\n'
+        + _frame("ok")
+    )
+    assert _texts(events) == ["ok"]
+    assert len(events) == 1
+
+
+def test_frames_without_text_are_passed_through():
+    role = b'{"choices":[{"index":0,"delta":{"role":"assistant","content":""}}]}'
+    finish = b'{"choices":[{"index":0,"delta":{},"finish_reason":"length"}]}'
+    parser = sse.SSEParser()
+    events = parser.feed(b"data: " + role + b"\n\n" + _frame("hi") + b"data: " + finish + b"\n\n")
+    assert [type(e) for e in events] == [sse.PassthroughEvent, sse.DeltaEvent, sse.PassthroughEvent]
+    assert events[0].raw == sse.encode_frame(role)
+    assert events[2].raw == sse.encode_frame(finish)
+
+
+def test_message_content_fallback():
+    parser = sse.SSEParser()
+    events = parser.feed(b'data: {"choices":[{"message":{"content":"full"}}]}\n\n')
+    assert _texts(events) == ["full"]
+
+
+def test_close_flushes_unterminated_event():
+    parser = sse.SSEParser()
+    assert parser.feed(b'data: {"choices":[{"delta":{"content":"tail"}}]}') == []
+    assert _texts(parser.close()) == ["tail"]
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import os
+from typing import Optional
+
+from . import response_cache, upstream
+from .models import Conversation
+
+
+_TITLE_SYSTEM_PROMPT = (
+    "You are a helpful assistant that generates short conversation titles. "
+    "Create a concise title (max 5 words) that starts with an emoji and summarizes the user's question and assistant's answer. "
+    "Return ONLY the title text."
+)
+
+
+def title_model() -> str:
+    return os.getenv("TITLE_MODEL", "groq-llama3-8b")
+
+
+def title_messages(last_user: str, assistant_text: str) -> list[dict]:
+    return [
+        {"role": "system", "content": _TITLE_SYSTEM_PROMPT},
+        {"role": "user", "content": last_user[:1000] if last_user else ""},
+        {"role": "assistant",
+            "content": assistant_text[:1000] if assistant_text else ""},
+    ]
+
+
+def fallback_title(last_user: str, assistant_text: str) -> str:
+    # Derive a short 5-word summary from user text if the LLM failed
+    base_text = (last_user or assistant_text or "").strip()
+    words = base_text.split()
+    fallback = " ".join(words[:5]).strip()
+    return fallback or "New Conversation"
+
+
+def generate_title(conversation_id: int, last_user: str, assistant_text: str) -> Optional[str]:
+    """Title an untitled conversation; returns the new title or ``None`` if it already had one.
+
+    Idempotent: the write only lands while the title is still empty, so
+    duplicate or retried runs never overwrite a title set meanwhile.
+    """
+    current = Conversation.objects.filter(pk=conversation_id).values_list("title", flat=True).first()
+    if current is None or current:
+        return None
+
+    model, messages = title_model(), title_messages(last_user, assistant_text)
+    try:
+        # The prompt is deterministic, so repeated exchanges reuse a cached title
+        data = response_cache.lookup_sync(model, messages)
+        if data is None:
+            data = upstream.complete_chat_sync(model, messages, timeout=30) or {}
+            response_cache.store_sync(model, messages, data)
+        title = upstream.completion_text(data)
+    except Exception:
+        title = ""
+    if not title:
+        title = fallback_title(last_user, assistant_text)
+
+    updated = Conversation.objects.filter(pk=conversation_id, title="").update(title=title[:255])
+    return title[:255] if updated else None
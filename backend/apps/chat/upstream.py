@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import weakref
+from typing import AsyncIterator, Optional
+
+import httpx
+from django.conf import settings
+
+
+CHAT_COMPLETIONS_PATH = "/v1/chat/completions"
+EMBEDDINGS_PATH = "/v1/embeddings"
+
+# One pooled client per event loop. Under uvicorn that is a single client for the
+# whole process; loops created ad hoc (async_to_sync, tests) get their own.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+# Blocking client for Celery workers and other sync callers
+_sync_client: Optional[httpx.Client] = None
+_sync_client_lock = threading.Lock()
+
+
+def _running_in_docker() -> bool:
+    try:
+        return os.path.exists("/.dockerenv")
+    except Exception:
+        return False
+
+
+def litellm_base_url() -> str:
+    # Prefer explicit env, unless it's localhost while in Docker
+    env_url = os.getenv("LITELLM_BASE_URL")
+    if env_url:
+        if _running_in_docker() and ("localhost" in env_url or "127.0.0.1" in env_url):
+            return "http://llm_proxy:4000"
+        return env_url
+    return "http://llm_proxy:4000" if _running_in_docker() else "http://localhost:41337"
+
+
+def litellm_api_key() -> str:
+    # Using master key if configured for proxy auth; optional
+    return os.getenv("LITELLM_MASTER_KEY", "")
+
+
+def _default_headers() -> dict[str, str]:
+    headers = {"Content-Type": "application/json"}
+    if litellm_api_key():
+        headers["Authorization"] = f"Bearer {litellm_api_key()}"
+    return headers
+
+
+def _timeout(read: Optional[float]) -> httpx.Timeout:
+    return httpx.Timeout(
+        connect=settings.LITELLM_CONNECT_TIMEOUT,
+        read=read,
+        write=settings.LITELLM_CONNECT_TIMEOUT,
+        pool=settings.LITELLM_POOL_TIMEOUT,
+    )
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.LITELLM_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LITELLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.LITELLM_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_async_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            base_url=litellm_base_url().rstrip("/"),
+            headers=_default_headers(),
+            limits=_limits(),
+            timeout=_timeout(settings.LITELLM_READ_TIMEOUT),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def get_sync_client() -> httpx.Client:
+    global _sync_client
+    with _sync_client_lock:
+        if _sync_client is None or _sync_client.is_closed:
+            _sync_client = httpx.Client(
+                base_url=litellm_base_url().rstrip("/"),
+                headers=_default_headers(),
+                limits=_limits(),
+                timeout=_timeout(settings.LITELLM_READ_TIMEOUT),
+            )
+        return _sync_client
+
+
+def completion_text(data: dict) -> str:
+    try:
+        choice0 = (data or {}).get("choices", [{}])[0]
+        msg = choice0.get("message") or {}
+        return (msg.get("content") or choice0.get("text") or "").strip()
+    except Exception:
+        return ""
+
+
+async def stream_chat(model: str, messages: list[dict]) -> AsyncIterator[bytes]:
+    """Yield raw SSE bytes from the proxy as they arrive on the event loop.
+
+    Non-2xx responses raise ``httpx.HTTPStatusError`` with the body already read,
+    so callers can inspect ``exc.response.json()``. Consumers that stop early
+    should iterate under ``contextlib.aclosing`` so the connection goes back to
+    the pool immediately.
+    """
+    payload = {
+        "model": model,
+        "messages": messages,
+        "stream": True,
+        "stream_options": {"include_usage": True},
+    }
+    async with get_async_client().stream("POST", CHAT_COMPLETIONS_PATH, json=payload) as resp:
+        if resp.is_error:
+            await resp.aread()
+            resp.raise_for_status()
+        async for chunk in resp.aiter_bytes():
+            if not chunk:
+                continue
+            yield chunk
+
+
+async def complete_chat(
+    model: str, messages: list[dict], *, timeout: Optional[float] = None, **params
+) -> dict:
+    request_timeout = _timeout(timeout) if timeout is not None else httpx.USE_CLIENT_DEFAULT
+    resp = await get_async_client().post(
+        CHAT_COMPLETIONS_PATH,
+        json={"model": model, "messages": messages, **params},
+        timeout=request_timeout,
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+def complete_chat_sync(
+    model: str, messages: list[dict], *, timeout: Optional[float] = None, **params
+) -> dict:
+    request_timeout = _timeout(timeout) if timeout is not None else httpx.USE_CLIENT_DEFAULT
+    resp = get_sync_client().post(
+        CHAT_COMPLETIONS_PATH,
+        json={"model": model, "messages": messages, **params},
+        timeout=request_timeout,
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+def _embedding_vectors(data: dict) -> list[list[float]]:
+    items = sorted(data.get("data") or [], key=lambda d: d.get("index", 0))
+    return [item["embedding"] for item in items]
+
+
+async def embed(model: str, inputs: list[str], *, timeout: Optional[float] = None) -> list[list[float]]:
+    """Embed a batch of texts in one request; vectors come back in input order."""
+    request_timeout = _timeout(timeout) if timeout is not None else httpx.USE_CLIENT_DEFAULT
+    resp = await get_async_client().post(
+        EMBEDDINGS_PATH, json={"model": model, "input": inputs}, timeout=request_timeout)
+    resp.raise_for_status()
+    return _embedding_vectors(resp.json())
+
+
+def embed_sync(model: str, inputs: list[str], *, timeout: Optional[float] = None) -> list[list[float]]:
+    request_timeout = _timeout(timeout) if timeout is not None else httpx.USE_CLIENT_DEFAULT
+    resp = get_sync_client().post(
+        EMBEDDINGS_PATH, json={"model": model, "input": inputs}, timeout=request_timeout)
+    resp.raise_for_status()
+    return _embedding_vectors(resp.json())
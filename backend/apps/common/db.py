@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from apps.common import metrics
+
+
+# ORM work from async views runs on a bounded pool of DB threads instead of
+# asgiref's single thread-sensitive thread, so queries from concurrent requests
+# no longer queue behind each other. Each thread holds its own connection, so
+# DB_EXECUTOR_WORKERS should not exceed what the database (or pool) can serve.
+# With DB_POOL_ENABLED those connections are borrowed from a psycopg pool per
+# call; its counters (requests_wait_ms, requests_waiting, ...) are exported
+# as the db_pool gauges.
+
+T = TypeVar("T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+    return _executor
+
+
+def database_sync_to_async(func: Callable[..., T]) -> Callable[..., Awaitable[T]]:
+    """Run ``func`` on the DB executor; use where ``sync_to_async(thread_sensitive=True)`` was.
+
+    Stale or over-age connections are closed around each call, as Django does
+    around a request, since executor threads never see request signals.
+    ``func`` must do all of its ORM work itself, including any transaction.
+    """
+
+    def call(queued_at: float, args, kwargs):
+        metrics.observe("db_executor_wait_seconds", time.monotonic() - queued_at)
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        run = sync_to_async(call, thread_sensitive=False, executor=get_executor())
+        return await run(time.monotonic(), args, kwargs)
+
+    return wrapper
+
+
+def pool_stats() -> dict:
+    """Counters of the default database's connection pool, empty when pooling is off."""
+    if not settings.DB_POOL_ENABLED:
+        return {}
+    pool = connections["default"].pool
+    return pool.get_stats() if pool is not None else {}
+
+
+metrics.register_gauges("db_pool", pool_stats)
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import json
+from typing import Any
+
+from ninja.parser import Parser
+from ninja.renderers import BaseRenderer
+from ninja.responses import NinjaJSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib fallback
+    orjson = None
+
+
+# JSON on the hot paths (SSE frames, Redis caches, API bodies) goes through
+# dumps()/loads(): orjson when it is installed, the stdlib otherwise. dumps()
+# returns compact UTF-8 bytes that are written out as-is; datetimes, UUIDs and
+# dataclasses are encoded natively, anything else the way Ninja would.
+
+_encoder = NinjaJSONEncoder()
+
+
+def _default(obj: Any) -> Any:
+    # Decimal, lazy translations, pydantic models, ...
+    return _encoder.default(obj)
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+
+    loads = orjson.loads
+else:
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, cls=NinjaJSONEncoder, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    loads = json.loads
+
+
+class JSONRenderer(BaseRenderer):
+    media_type = "application/json"
+    charset = "utf-8"
+
+    def render(self, request, data, *, response_status):
+        return dumps(data)
+
+
+class JSONParser(Parser):
+    def parse_body(self, request):
+        return loads(request.body)
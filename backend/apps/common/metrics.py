@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import threading
+from collections import defaultdict
+from typing import Callable
+
+
+# Process-local counters and value summaries, exposed as JSON at /api/metrics.
+# Each worker reports its own numbers; aggregate across workers when scraping.
+_lock = threading.Lock()
+_counters: "defaultdict[str, float]" = defaultdict(float)
+_summaries: dict[str, dict[str, float]] = {}
+# Point-in-time values read from their owner on each snapshot
+_gauges: dict[str, Callable[[], dict]] = {}
+
+
+def _name(name: str, labels: dict[str, object]) -> str:
+    if not labels:
+        return name
+    inner = ",".join(f"{k}={labels[k]}" for k in sorted(labels))
+    return f"{name}{{{inner}}}"
+
+
+def incr(name: str, value: float = 1, **labels: object) -> None:
+    key = _name(name, labels)
+    with _lock:
+        _counters[key] += value
+
+
+def observe(name: str, value: float, **labels: object) -> None:
+    key = _name(name, labels)
+    with _lock:
+        s = _summaries.get(key)
+        if s is None:
+            _summaries[key] = {"count": 1, "sum": value, "max": value}
+        else:
+            s["count"] += 1
+            s["sum"] += value
+            if value > s["max"]:
+                s["max"] = value
+
+
+def register_gauges(name: str, read: Callable[[], dict]) -> None:
+    """Report the mapping returned by ``read()`` under ``gauges[name]`` in each snapshot."""
+    _gauges[name] = read
+
+
+def snapshot() -> dict:
+    gauges = {}
+    for name, read in list(_gauges.items()):
+        try:
+            gauges[name] = read()
+        except Exception:
+            pass
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "summaries": {k: dict(v) for k, v in _summaries.items()},
+            "gauges": gauges,
+        }
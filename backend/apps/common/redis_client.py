@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import weakref
+from typing import Optional
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+
+# Same per-loop pattern as the upstream HTTP client: connection pools are bound
+# to the loop that created them.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aioredis.Redis]" = (
+    weakref.WeakKeyDictionary()
+)
+_sync_client: Optional[redis.Redis] = None
+_sync_client_lock = threading.Lock()
+
+
+def get_redis() -> aioredis.Redis:
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = aioredis.Redis.from_url(
+            settings.REDIS_URL,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def get_sync_redis() -> redis.Redis:
+    global _sync_client
+    with _sync_client_lock:
+        if _sync_client is None:
+            _sync_client = redis.Redis.from_url(
+                settings.REDIS_URL,
+                socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            )
+        return _sync_client
@@ -2,12 +2,14 @@ import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
-from . import routing as app_routing
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "meeter_platform.settings")
 
+# Set up Django before the websocket consumers import any models
 django_asgi = get_asgi_application()
 
+from . import routing as app_routing  # noqa: E402
+
 application = ProtocolTypeRouter({
     "http": django_asgi,
     "websocket": AuthMiddlewareStack(
@@ -1,6 +1,8 @@
 from django.urls import path
-from .ws_consumers import EchoConsumer
+from .ws_consumers import ChatConsumer, ConversationConsumer, EchoConsumer
 
 websocket_urlpatterns = [
     path("ws/echo/", EchoConsumer.as_asgi()),
+    path("ws/chat/", ChatConsumer.as_asgi()),
+    path("ws/conversations/<int:conversation_id>/", ConversationConsumer.as_asgi()),
 ]
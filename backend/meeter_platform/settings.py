@@ -78,6 +78,43 @@ else:
         }
     }
 
+# Connection pool (psycopg_pool through Django's "pool" option). Connections are
+# returned after each request or executor call, so persistent per-thread
+# connections (CONN_MAX_AGE) are off while it is enabled. CONN_HEALTH_CHECKS
+# also makes Django check pooled connections on checkout.
+DB_POOL_ENABLED = os.getenv("DB_POOL_ENABLED", "true").lower() in {"1", "true", "yes"}
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "16"))
+# Seconds to wait for a free connection before the query fails
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+# Server-side parameter binding is opt-in: it changes how every statement is
+# sent (typed parameters, no client-side interpolation), which some queries
+# and transaction-mode pgbouncer do not tolerate. Only with it on are
+# statements run DB_PREPARE_THRESHOLD times on a connection prepared
+# server-side; an empty threshold disables preparing.
+DB_SERVER_SIDE_BINDING = os.getenv("DB_SERVER_SIDE_BINDING", "false").lower() in {"1", "true", "yes"}
+DB_PREPARE_THRESHOLD = int(os.getenv("DB_PREPARE_THRESHOLD", "5") or -1)
+
+_db_options = DATABASES["default"].setdefault("OPTIONS", {})
+if DB_SERVER_SIDE_BINDING:
+    _db_options["server_side_binding"] = True
+    if DB_PREPARE_THRESHOLD >= 0:
+        _db_options["prepare_threshold"] = DB_PREPARE_THRESHOLD
+if DB_POOL_ENABLED:
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+    _db_options["pool"] = {
+        "min_size": DB_POOL_MIN_SIZE,
+        "max_size": DB_POOL_MAX_SIZE,
+        "timeout": DB_POOL_TIMEOUT,
+        "max_idle": DB_POOL_MAX_IDLE,
+    }
+DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+
+# Threads running ORM work for async views (apps.common.db); each holds one
+# database connection, so by default it matches the pool
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS") or DB_POOL_MAX_SIZE)
+
 # Channels (Redis layer)
 CHANNEL_LAYERS = {
     "default": {
@@ -88,6 +125,41 @@ CHANNEL_LAYERS = {
     }
 }
 
+# Fan-out of each generation to its conversation group (ws/conversations/<id>/
+# and /api/chat/conversations/<id>/live). Buffers hold pending delta text per
+# subscriber (bytes) before it is told it lagged and should refetch.
+CHAT_FANOUT_ENABLED = os.getenv("CHAT_FANOUT_ENABLED", "true").lower() in {"1", "true", "yes"}
+CHAT_FANOUT_BUFFER_BYTES = int(os.getenv("CHAT_FANOUT_BUFFER_BYTES", "262144"))
+CHAT_FANOUT_PUBLISH_BUFFER_BYTES = int(os.getenv("CHAT_FANOUT_PUBLISH_BUFFER_BYTES", "1048576"))
+CHAT_FANOUT_KEEPALIVE = float(os.getenv("CHAT_FANOUT_KEEPALIVE", "15"))
+
+# Output batching for chat streams: merged delta frames are written at most
+# once per interval (seconds) unless this many bytes are pending
+CHAT_STREAM_FLUSH_INTERVAL = float(os.getenv("CHAT_STREAM_FLUSH_INTERVAL", "0.03"))
+CHAT_STREAM_FLUSH_BYTES = int(os.getenv("CHAT_STREAM_FLUSH_BYTES", "4096"))
+
+# Resumable SSE generations (per request "resumable", default below): frames are
+# logged to a capped Redis stream kept CHAT_RESUME_TTL seconds after completion
+CHAT_STREAM_RESUMABLE = os.getenv("CHAT_STREAM_RESUMABLE", "false").lower() in {"1", "true", "yes"}
+CHAT_RESUME_TTL = int(os.getenv("CHAT_RESUME_TTL", "300"))
+CHAT_RESUME_MAX_EVENTS = int(os.getenv("CHAT_RESUME_MAX_EVENTS", "10000"))
+# Seconds a resumable generation keeps running with no reader attached before it is cancelled
+CHAT_RESUME_GRACE = float(os.getenv("CHAT_RESUME_GRACE", "30"))
+
+# Concurrent generations per multiplexed chat socket (ws/chat/)
+CHAT_WS_MAX_STREAMS = int(os.getenv("CHAT_WS_MAX_STREAMS", "8"))
+
+# Celery (Redis broker)
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/0")
+# Post-turn tasks are deduplicated per conversation with a Redis marker (seconds)
+CHAT_TASK_DEDUPE_TTL = int(os.getenv("CHAT_TASK_DEDUPE_TTL", "300"))
+CHAT_TITLE_DEDUPE_TTL = int(os.getenv("CHAT_TITLE_DEDUPE_TTL", "3600"))
+
+# Shared Redis for application caches (history cache, coordination keys)
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/2")
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.5"))
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator"},
@@ -111,11 +183,166 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # CORS / CSRF
 
 
-def _split_env_list(name: str) -> list[str]:
-    raw = os.getenv(name, "")
+def _split_env_list(name: str, default: str = "") -> list[str]:
+    raw = os.getenv(name, default)
     return [x.strip() for x in raw.split(",") if x.strip()]
 
 
 CORS_ALLOWED_ORIGINS = _split_env_list("CORS_ALLOWED_ORIGINS")
 CORS_ALLOW_CREDENTIALS = True
 CSRF_TRUSTED_ORIGINS = _split_env_list("CSRF_TRUSTED_ORIGINS")
+
+
+def _env_optional_float(name: str, default: str = "") -> float | None:
+    raw = os.getenv(name, default).strip()
+    return float(raw) if raw else None
+
+
+# LiteLLM proxy client: one pooled keep-alive connection pool per process.
+# Read timeout is unset by default because streams can legitimately idle between tokens.
+LITELLM_MAX_CONNECTIONS = int(os.getenv("LITELLM_MAX_CONNECTIONS", "100"))
+LITELLM_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("LITELLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LITELLM_KEEPALIVE_EXPIRY = float(os.getenv("LITELLM_KEEPALIVE_EXPIRY", "60"))
+LITELLM_CONNECT_TIMEOUT = float(os.getenv("LITELLM_CONNECT_TIMEOUT", "5"))
+LITELLM_POOL_TIMEOUT = float(os.getenv("LITELLM_POOL_TIMEOUT", "10"))
+LITELLM_READ_TIMEOUT = _env_optional_float("LITELLM_READ_TIMEOUT")
+
+
+def _env_int_map(name: str) -> dict[str, int]:
+    # "alias=value,alias=value"
+    out: dict[str, int] = {}
+    for item in _split_env_list(name):
+        key, _, value = item.partition("=")
+        if key.strip() and value.strip():
+            out[key.strip()] = int(value)
+    return out
+
+
+def _env_str_map(name: str) -> dict[str, str]:
+    # "alias=value,alias=value"
+    out: dict[str, str] = {}
+    for item in _split_env_list(name):
+        key, _, value = item.partition("=")
+        if key.strip() and value.strip():
+            out[key.strip()] = value.strip()
+    return out
+
+
+# Chat context assembly: per-model prompt token budgets; older turns are folded
+# into a rolling per-conversation summary by a background task.
+CHAT_CONTEXT_DEFAULT_BUDGET = int(os.getenv("CHAT_CONTEXT_DEFAULT_BUDGET", "16000"))
+CHAT_CONTEXT_BUDGETS = {
+    "groq-gpt-oss-20b": 24000,
+    "groq-gpt-oss-120b": 24000,
+    "groq-llama3-8b": 6000,
+    **_env_int_map("CHAT_CONTEXT_BUDGETS"),
+}
+CHAT_SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "groq-llama3-8b")
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "1024"))
+CHAT_SUMMARY_KEEP_RATIO = float(os.getenv("CHAT_SUMMARY_KEEP_RATIO", "0.6"))
+
+# Write-through conversation history cache (process-local LRU in front of Redis)
+CHAT_HISTORY_CACHE_SIZE = int(os.getenv("CHAT_HISTORY_CACHE_SIZE", "256"))
+CHAT_HISTORY_CACHE_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_CACHE_MAX_MESSAGES", "200"))
+CHAT_HISTORY_CACHE_TTL = int(os.getenv("CHAT_HISTORY_CACHE_TTL", "3600"))
+CHAT_HISTORY_CACHE_LOCAL_TTL = float(os.getenv("CHAT_HISTORY_CACHE_LOCAL_TTL", "300"))
+
+# Keyset pagination for conversation lists and message pages
+CHAT_CONVERSATIONS_PAGE_SIZE = int(os.getenv("CHAT_CONVERSATIONS_PAGE_SIZE", "50"))
+CHAT_MESSAGES_PAGE_SIZE = int(os.getenv("CHAT_MESSAGES_PAGE_SIZE", "100"))
+CHAT_MAX_PAGE_SIZE = int(os.getenv("CHAT_MAX_PAGE_SIZE", "500"))
+CHAT_SEARCH_PAGE_SIZE = int(os.getenv("CHAT_SEARCH_PAGE_SIZE", "20"))
+
+# NDJSON export: rows per server-side cursor fetch, bytes per written chunk, and
+# exports running at once per process (each holds a DB executor thread)
+CHAT_EXPORT_FETCH_SIZE = int(os.getenv("CHAT_EXPORT_FETCH_SIZE", "500"))
+CHAT_EXPORT_CHUNK_BYTES = int(os.getenv("CHAT_EXPORT_CHUNK_BYTES", "65536"))
+CHAT_EXPORT_MAX_CONCURRENT = int(os.getenv("CHAT_EXPORT_MAX_CONCURRENT", "2"))
+
+# Semantic retrieval: embeddings are computed in batches by Celery and stored in
+# pgvector; chat requests opt in with "retrieve": true
+CHAT_EMBEDDING_MODEL = os.getenv("CHAT_EMBEDDING_MODEL", "text-embedding-3-small")
+CHAT_EMBEDDING_BATCH_SIZE = int(os.getenv("CHAT_EMBEDDING_BATCH_SIZE", "64"))
+CHAT_EMBEDDING_MAX_BATCHES = int(os.getenv("CHAT_EMBEDDING_MAX_BATCHES", "20"))
+CHAT_RETRIEVAL_TOP_K = int(os.getenv("CHAT_RETRIEVAL_TOP_K", "5"))
+CHAT_RETRIEVAL_MAX_K = int(os.getenv("CHAT_RETRIEVAL_MAX_K", "20"))
+CHAT_RETRIEVAL_MAX_DISTANCE = float(os.getenv("CHAT_RETRIEVAL_MAX_DISTANCE", "0.6"))
+# Nearest-neighbour lookups scan the HNSW index on the embeddings alone, then
+# filter by conversation/owner: retrieval takes top_k * OVERFETCH candidates,
+# and the index search keeps at least EF_SEARCH of them (max 1000)
+CHAT_RETRIEVAL_OVERFETCH = int(os.getenv("CHAT_RETRIEVAL_OVERFETCH", "20"))
+CHAT_VECTOR_EF_SEARCH = int(os.getenv("CHAT_VECTOR_EF_SEARCH", "100"))
+
+# Response cache for /chat/complete and titles. Models opt in per tier: exact
+# (normalized hash; local LRU in front of Redis) and semantic (pgvector lookup
+# of short prompts, bounded table pruned by Celery).
+CHAT_RESPONSE_CACHE_MODELS = _split_env_list("CHAT_RESPONSE_CACHE_MODELS", "groq-llama3-8b")
+CHAT_RESPONSE_CACHE_SEMANTIC_MODELS = _split_env_list("CHAT_RESPONSE_CACHE_SEMANTIC_MODELS")
+CHAT_RESPONSE_CACHE_TTL = int(os.getenv("CHAT_RESPONSE_CACHE_TTL", "86400"))
+CHAT_RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.getenv("CHAT_RESPONSE_CACHE_MAX_ENTRY_BYTES", "65536"))
+CHAT_RESPONSE_CACHE_LOCAL_SIZE = int(os.getenv("CHAT_RESPONSE_CACHE_LOCAL_SIZE", "1024"))
+CHAT_RESPONSE_CACHE_LOCAL_MAX_BYTES = int(os.getenv("CHAT_RESPONSE_CACHE_LOCAL_MAX_BYTES", str(16 * 1024 * 1024)))
+CHAT_RESPONSE_CACHE_SIMILARITY = float(os.getenv("CHAT_RESPONSE_CACHE_SIMILARITY", "0.95"))
+CHAT_RESPONSE_CACHE_SEMANTIC_MAX_CHARS = int(os.getenv("CHAT_RESPONSE_CACHE_SEMANTIC_MAX_CHARS", "2000"))
+CHAT_RESPONSE_CACHE_SEMANTIC_MAX_ENTRIES = int(os.getenv("CHAT_RESPONSE_CACHE_SEMANTIC_MAX_ENTRIES", "10000"))
+# Nearest embeddings checked for a cached prompt (the index is shared with messages)
+CHAT_RESPONSE_CACHE_SEMANTIC_CANDIDATES = int(os.getenv("CHAT_RESPONSE_CACHE_SEMANTIC_CANDIDATES", "20"))
+CHAT_RESPONSE_CACHE_PRUNE_INTERVAL = int(os.getenv("CHAT_RESPONSE_CACHE_PRUNE_INTERVAL", "600"))
+
+# Single-flight: identical in-flight upstream requests share one provider call,
+# within a process and across workers (Redis lock + stream log)
+CHAT_SINGLEFLIGHT_ENABLED = os.getenv("CHAT_SINGLEFLIGHT_ENABLED", "true").lower() in {"1", "true", "yes"}
+CHAT_SINGLEFLIGHT_LOCK_TTL = int(os.getenv("CHAT_SINGLEFLIGHT_LOCK_TTL", "30"))
+CHAT_SINGLEFLIGHT_IDLE_TIMEOUT = float(os.getenv("CHAT_SINGLEFLIGHT_IDLE_TIMEOUT", "20"))
+CHAT_SINGLEFLIGHT_LINGER = int(os.getenv("CHAT_SINGLEFLIGHT_LINGER", "30"))
+
+# Model routing for requests without an explicit model (or "auto"): aliases
+# ordered from fastest to most capable; latency budget in seconds for a typical
+# answer (p95 TTFT + CHAT_ROUTER_EXPECTED_TOKENS at the observed tokens/sec)
+CHAT_DEFAULT_MODEL = os.getenv("CHAT_DEFAULT_MODEL", "groq-gpt-oss-20b")
+CHAT_ROUTER_MODELS = _split_env_list("CHAT_ROUTER_MODELS", "groq-gpt-oss-20b,groq-gpt-oss-120b")
+CHAT_ROUTER_LATENCY_BUDGET = float(os.getenv("CHAT_ROUTER_LATENCY_BUDGET", "3.0"))
+CHAT_ROUTER_EXPECTED_TOKENS = int(os.getenv("CHAT_ROUTER_EXPECTED_TOKENS", "200"))
+CHAT_ROUTER_COMPLEXITY_THRESHOLD = float(os.getenv("CHAT_ROUTER_COMPLEXITY_THRESHOLD", "0.5"))
+CHAT_ROUTER_EWMA_ALPHA = float(os.getenv("CHAT_ROUTER_EWMA_ALPHA", "0.2"))
+CHAT_ROUTER_WINDOW = float(os.getenv("CHAT_ROUTER_WINDOW", "120"))
+CHAT_ROUTER_DEGRADED_TTFT = float(os.getenv("CHAT_ROUTER_DEGRADED_TTFT", "5.0"))
+CHAT_ROUTER_FAILURE_THRESHOLD = int(os.getenv("CHAT_ROUTER_FAILURE_THRESHOLD", "3"))
+CHAT_ROUTER_COOLDOWN = float(os.getenv("CHAT_ROUTER_COOLDOWN", "30"))
+
+# Stream deadlines (seconds): first token, and gap between chunks afterwards.
+# A stream without a token after CHAT_HEDGE_AFTER (empty disables) is raced
+# against its secondary alias; the first to produce a token wins.
+CHAT_STREAM_TTFT_TIMEOUT = float(os.getenv("CHAT_STREAM_TTFT_TIMEOUT", "20"))
+CHAT_STREAM_IDLE_TIMEOUT = float(os.getenv("CHAT_STREAM_IDLE_TIMEOUT", "15"))
+CHAT_HEDGE_AFTER = _env_optional_float("CHAT_HEDGE_AFTER", "2.5")
+CHAT_HEDGE_ALIASES = {
+    "groq-gpt-oss-20b": "groq-gpt-oss-120b",
+    "groq-gpt-oss-120b": "groq-gpt-oss-20b",
+    **_env_str_map("CHAT_HEDGE_ALIASES"),
+}
+
+# /chat/batch: jobs per request, and upstream calls in flight per model alias
+# across all batches of a process ("alias=n,..." overrides the default)
+CHAT_BATCH_MAX_JOBS = int(os.getenv("CHAT_BATCH_MAX_JOBS", "32"))
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
+CHAT_BATCH_MODEL_CONCURRENCY = _env_int_map("CHAT_BATCH_MODEL_CONCURRENCY")
+
+# Admission control for upstream calls (per process). Per model alias: calls in
+# flight ("alias=n,..." overrides the default), slots only interactive requests
+# may take, and an optional tokens-per-minute budget fed by reported usage.
+# Waiting calls queue per priority class, up to CHAT_ADMISSION_QUEUE_SIZE and
+# CHAT_ADMISSION_QUEUE_TIMEOUT seconds, before a 429 with Retry-After.
+CHAT_ADMISSION_ENABLED = os.getenv("CHAT_ADMISSION_ENABLED", "true").lower() in {"1", "true", "yes"}
+CHAT_ADMISSION_MODEL_CONCURRENCY = int(os.getenv("CHAT_ADMISSION_MODEL_CONCURRENCY", "32"))
+CHAT_ADMISSION_MODEL_LIMITS = _env_int_map("CHAT_ADMISSION_MODEL_LIMITS")
+CHAT_ADMISSION_INTERACTIVE_RESERVE = int(os.getenv("CHAT_ADMISSION_INTERACTIVE_RESERVE", "8"))
+CHAT_ADMISSION_MODEL_TPM = _env_int_map("CHAT_ADMISSION_MODEL_TPM")
+# Calls one user holds at once per priority class, across models; 0 disables
+CHAT_ADMISSION_USER_CONCURRENCY = int(os.getenv("CHAT_ADMISSION_USER_CONCURRENCY", "8"))
+CHAT_ADMISSION_QUEUE_SIZE = int(os.getenv("CHAT_ADMISSION_QUEUE_SIZE", "64"))
+CHAT_ADMISSION_QUEUE_TIMEOUT = float(os.getenv("CHAT_ADMISSION_QUEUE_TIMEOUT", "10"))
+# Seconds an admitted turn may wait for its generation to start (e.g. a response
+# body the client never reads) before its slot is given back
+CHAT_ADMISSION_CLAIM_TIMEOUT = float(os.getenv("CHAT_ADMISSION_CLAIM_TIMEOUT", "15"))
@@ -2,8 +2,14 @@ from django.contrib import admin
 from django.urls import path
 from ninja import NinjaAPI
 from apps.chat.api import router as chat_router
+from apps.common import fastjson, metrics
 
-api = NinjaAPI(title="Meeter API", version="0.1.0")
+api = NinjaAPI(
+    title="Meeter API",
+    version="0.1.0",
+    renderer=fastjson.JSONRenderer(),
+    parser=fastjson.JSONParser(),
+)
 api.add_router("/chat", chat_router)
 
 
@@ -12,6 +18,11 @@ def health(request):
     return {"status": "ok"}
 
 
+@api.get("/metrics", auth=None)
+def metrics_view(request):
+    return metrics.snapshot()
+
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", api.urls),
@@ -1,5 +1,14 @@
 from channels.generic.websocket import AsyncWebsocketConsumer
-import json
+import asyncio
+from contextlib import aclosing
+
+from django.conf import settings
+from pydantic import ValidationError
+
+from apps.chat import batching, fanout, pipeline, sse
+from apps.chat.notifications import conversation_group
+from apps.chat.schemas import ChatRequest
+from apps.common import fastjson
 
 
 class EchoConsumer(AsyncWebsocketConsumer):
@@ -8,6 +17,142 @@ class EchoConsumer(AsyncWebsocketConsumer):
 
     async def receive(self, text_data=None, bytes_data=None):
         if text_data is not None:
-            await self.send(text_data=json.dumps({"echo": text_data}))
+            await self.send(text_data=fastjson.dumps({"echo": text_data}).decode("utf-8"))
         elif bytes_data is not None:
             await self.send(bytes_data=bytes_data)
+
+
+class ConversationConsumer(AsyncWebsocketConsumer):
+    """Pushes background results (e.g. generated titles) and mirrored generations for one conversation.
+
+    Events go through a per-socket ``SubscriberBuffer`` drained by a writer
+    task, so a slow client gets merged deltas instead of backing up the
+    channel layer.
+    """
+
+    async def connect(self):
+        conversation_id = int(self.scope["url_route"]["kwargs"]["conversation_id"])
+        self.writer = None
+        if not await fanout.can_follow(self.scope.get("user"), conversation_id):
+            # Accept first so the client sees the close code
+            await self.accept()
+            await self.close(code=4404)
+            return
+        self.group_name = conversation_group(conversation_id)
+        self.buffer = fanout.SubscriberBuffer()
+        self.writer = asyncio.create_task(self._write())
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if self.writer is None:
+            return
+        self.writer.cancel()
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def conversation_event(self, event):
+        self.buffer.put(event["payload"])
+
+    async def _write(self):
+        while True:
+            for payload in await self.buffer.get():
+                await self.send(text_data=fastjson.dumps(payload).decode("utf-8"))
+
+
+def _compact(sid: str, events: list) -> list[dict]:
+    # Deltas of one upstream chunk are merged into a single frame
+    frames: list[dict] = []
+    for event in events:
+        if isinstance(event, sse.DeltaEvent):
+            if frames and frames[-1]["t"] == "d":
+                frames[-1]["c"] += event.content
+            else:
+                frames.append({"t": "d", "id": sid, "c": event.content})
+        elif isinstance(event, sse.UsageEvent):
+            frames.append({"t": "u", "id": sid, "u": event.usage})
+        elif isinstance(event, sse.ErrorEvent):
+            frames.append({"t": "e", "id": sid, "e": event.error})
+        elif isinstance(event, sse.DoneEvent):
+            frames.append({"t": "done", "id": sid})
+    return frames
+
+
+class ChatConsumer(AsyncWebsocketConsumer):
+    """Runs many chat generations concurrently over one socket.
+
+    Client frames: ``{"type": "chat", "id": <stream id>, ...ChatRequest fields}``
+    starts a generation and ``{"type": "cancel", "id": <stream id>}`` stops it.
+    Server frames are compact and tagged by ``t``: ``meta``, ``d`` (text
+    delta in ``c``), ``u`` (usage), ``e`` (error) and ``done``, each carrying
+    the stream id.
+    """
+
+    async def connect(self):
+        self.streams: dict[str, asyncio.Task] = {}
+        await self.accept()
+
+    async def disconnect(self, code):
+        for task in list(self.streams.values()):
+            task.cancel()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            frame = fastjson.loads(text_data if text_data is not None else bytes_data or b"")
+        except ValueError:
+            await self._send({"t": "e", "e": {"message": "invalid JSON"}})
+            return
+        if not isinstance(frame, dict) or not isinstance(frame.get("id"), (str, int)):
+            await self._send({"t": "e", "e": {"message": "frames must be objects with an id"}})
+            return
+        sid = str(frame["id"])
+        kind = frame.get("type")
+        if kind == "cancel":
+            task = self.streams.get(sid)
+            if task is not None:
+                task.cancel()
+            return
+        if kind != "chat":
+            await self._send({"t": "e", "id": sid, "e": {"message": "type must be chat or cancel"}})
+            return
+        if sid in self.streams:
+            await self._send({"t": "e", "id": sid, "e": {"message": "stream id already in use"}})
+            return
+        if len(self.streams) >= settings.CHAT_WS_MAX_STREAMS:
+            await self._send({"t": "e", "id": sid, "e": {"message": "too many concurrent streams", "status": 429}})
+            return
+        try:
+            body = ChatRequest(**{k: v for k, v in frame.items() if k not in ("type", "id")})
+        except ValidationError as exc:
+            await self._send({"t": "e", "id": sid, "e": {"message": str(exc)[:500], "status": 422}})
+            return
+        task = asyncio.create_task(self._run(sid, body))
+        self.streams[sid] = task
+        task.add_done_callback(lambda _t, sid=sid: self.streams.pop(sid, None))
+
+    async def _send(self, frame: dict) -> None:
+        await self.send(text_data=fastjson.dumps(frame).decode("utf-8"))
+
+    async def _run(self, sid: str, body: ChatRequest) -> None:
+        try:
+            turn = await pipeline.prepare(self.scope.get("user"), body)
+        except pipeline.TurnError as err:
+            error = {"message": err.message, "status": err.status}
+            if err.retry_after is not None:
+                error["retry_after"] = err.retry_after
+            await self._send({"t": "e", "id": sid, "e": error})
+            await self._send({"t": "done", "id": sid})
+            return
+        try:
+            await self._send({"t": "meta", "id": sid, **turn.meta()})
+            async with aclosing(batching.coalesce(pipeline.stream(turn))) as batches:
+                async for events in batches:
+                    for frame in _compact(sid, events):
+                        await self._send(frame)
+        except asyncio.CancelledError:
+            try:
+                await self._send({"t": "done", "id": sid, "cancelled": True})
+            except Exception:
+                # The socket is already gone
+                pass
+        finally:
+            turn.release()
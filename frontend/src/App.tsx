@@ -24,12 +24,16 @@ export default function App() {
     const [miraiConversationId, setMiraiConversationId] = useState<number | null>(null)
     const [miraiMessages, setMiraiMessages] = useState<ChatMessage[]>([])
     const [miraiConversationTitle, setMiraiConversationTitle] = useState<string | null>(null)
+    // Messages come in pages, newest first; this cursor loads the page before the oldest shown
+    const [miraiOlderCursor, setMiraiOlderCursor] = useState<string | null>(null)
+    const [miraiLoadingOlder, setMiraiLoadingOlder] = useState(false)
 
     // History dropdown state
     const [isHistoryOpen, setIsHistoryOpen] = useState(false)
     const [historyLoading, setHistoryLoading] = useState(false)
     const [historyError, setHistoryError] = useState<string | null>(null)
     const [historyItems, setHistoryItems] = useState<Array<{ id: number; title: string | null; message_count: number; updated_at: string }>>([])
+    const [historyCursor, setHistoryCursor] = useState<string | null>(null)
     const historyRef = React.useRef<HTMLDivElement | null>(null)
 
     // On fresh load, start with no conversation selected. We still persist changes below.
@@ -41,18 +45,53 @@ export default function App() {
         } catch { }
     }, [miraiConversationId, miraiMessages, miraiConversationTitle])
 
+    // Titles are generated in a background task and pushed over the conversation socket
+    useEffect(() => {
+        const id = miraiConversationId
+        if (!id) return
+        const proto = window.location.protocol === 'https:' ? 'wss' : 'ws'
+        const ws = new WebSocket(`${proto}://${window.location.host}/ws/conversations/${id}/`)
+        function applyTitle(title: unknown) {
+            if (typeof title !== 'string' || !title.trim()) return
+            setMiraiConversationTitle(title)
+            setHistoryItems(prev => prev.map(it => (it.id === id ? { ...it, title } : it)))
+        }
+        ws.onopen = async () => {
+            // A title generated before we joined was not pushed to us
+            try {
+                const res = await fetch(`/api/chat/conversations/${id}?limit=1`, { credentials: 'include' })
+                if (res.ok) applyTitle((await res.json())?.title)
+            } catch { }
+        }
+        ws.onmessage = (e) => {
+            try {
+                const event = JSON.parse(e.data)
+                if (event?.type === 'title' && event.conversation_id === id) applyTitle(event.title)
+            } catch { }
+        }
+        return () => ws.close()
+    }, [miraiConversationId])
+
     async function openHistory() {
         const nextOpen = !isHistoryOpen
         setIsHistoryOpen(nextOpen)
         if (!nextOpen) return
+        await loadHistory(null)
+    }
+
+    async function loadHistory(cursor: string | null) {
         setHistoryLoading(true)
         setHistoryError(null)
         try {
-            const res = await fetch('/api/chat/conversations', { credentials: 'include' })
+            const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : ''
+            const res = await fetch(`/api/chat/conversations${query}`, { credentials: 'include' })
             if (!res.ok) throw new Error(`HTTP ${res.status}`)
             const json = await res.json()
-            // Expecting list of { id, title, created_at, updated_at, message_count }
-            setHistoryItems(Array.isArray(json) ? json.map((it: any) => ({ id: it.id, title: it.title ?? null, message_count: it.message_count ?? 0, updated_at: it.updated_at })) : [])
+            // Expecting a page { items: [{ id, title, created_at, updated_at, message_count }], next_cursor }
+            const items = Array.isArray(json?.items) ? json.items : (Array.isArray(json) ? json : [])
+            const mapped = items.map((it: any) => ({ id: it.id, title: it.title ?? null, message_count: it.message_count ?? 0, updated_at: it.updated_at }))
+            setHistoryItems(prev => (cursor ? [...prev, ...mapped] : mapped))
+            setHistoryCursor(typeof json?.next_cursor === 'string' ? json.next_cursor : null)
         } catch (err: any) {
             setHistoryError(err?.message || 'Failed to load conversations')
         } finally {
@@ -69,6 +108,7 @@ export default function App() {
             const mapped: ChatMessage[] = msgs.map((m: any) => ({ id: crypto.randomUUID(), role: m.role, content: m.content }))
             setMiraiConversationId(data.id)
             setMiraiMessages(mapped)
+            setMiraiOlderCursor(typeof data?.next_cursor === 'string' ? data.next_cursor : null)
             setMiraiConversationTitle(data.title || `Conversation #${data.id}`)
             setIsHistoryOpen(false)
             // Scroll Mirai view to bottom next paint
@@ -81,6 +121,26 @@ export default function App() {
         }
     }
 
+    async function loadOlderMessages() {
+        const id = miraiConversationId
+        const cursor = miraiOlderCursor
+        if (!id || !cursor || miraiLoadingOlder) return
+        setMiraiLoadingOlder(true)
+        try {
+            const res = await fetch(`/api/chat/conversations/${id}?cursor=${encodeURIComponent(cursor)}`, { credentials: 'include' })
+            if (!res.ok) throw new Error(`HTTP ${res.status}`)
+            const data = await res.json()
+            const msgs = Array.isArray(data?.messages) ? data.messages : []
+            const older: ChatMessage[] = msgs.map((m: any) => ({ id: crypto.randomUUID(), role: m.role, content: m.content }))
+            setMiraiMessages(prev => [...older, ...prev])
+            setMiraiOlderCursor(typeof data?.next_cursor === 'string' ? data.next_cursor : null)
+        } catch {
+            // Leave the cursor so scrolling up again retries
+        } finally {
+            setMiraiLoadingOlder(false)
+        }
+    }
+
     // Close history on outside click
     useEffect(() => {
         if (!isHistoryOpen) return
@@ -263,7 +323,7 @@ export default function App() {
                                         <button
                                             type="button"
                                             className="btn"
-                                            onClick={() => { setMiraiConversationId(null); setMiraiMessages([]); setMiraiConversationTitle(null) }}
+                                            onClick={() => { setMiraiConversationId(null); setMiraiMessages([]); setMiraiConversationTitle(null); setMiraiOlderCursor(null) }}
                                             title="Start a new conversation"
                                         >
                                             <span className="icon-btn__glyph" aria-hidden>➕</span>
@@ -275,17 +335,22 @@ export default function App() {
                                         </button>
                                         {isHistoryOpen && (
                                             <div className="history-menu" role="menu">
-                                                {historyLoading && <div className="history-item history-item--muted">Loading…</div>}
                                                 {historyError && <div className="history-item history-item--error">{historyError}</div>}
                                                 {!historyLoading && !historyError && historyItems.length === 0 && (
                                                     <div className="history-item history-item--muted">No conversations yet</div>
                                                 )}
-                                                {!historyLoading && !historyError && historyItems.map((it) => (
+                                                {historyItems.map((it) => (
                                                     <button key={it.id} type="button" className="history-item" role="menuitem" onClick={() => selectConversation(it.id)}>
                                                         <span className="history-item__title">{it.title || `Conversation #${it.id}`}</span>
                                                         <span className="history-item__meta">{it.message_count} msgs</span>
                                                     </button>
                                                 ))}
+                                                {historyLoading && <div className="history-item history-item--muted">Loading…</div>}
+                                                {!historyLoading && historyCursor && (
+                                                    <button type="button" className="history-item history-item--muted" role="menuitem" onClick={() => loadHistory(historyCursor)}>
+                                                        Load more…
+                                                    </button>
+                                                )}
                                             </div>
                                         )}
                                     </div>
@@ -295,7 +360,9 @@ export default function App() {
                                     setMessages={setMiraiMessages}
                                     conversationId={miraiConversationId}
                                     setConversationId={setMiraiConversationId}
-                                    setConversationTitle={setMiraiConversationTitle}
+                                    hasOlder={miraiOlderCursor !== null}
+                                    loadingOlder={miraiLoadingOlder}
+                                    onLoadOlder={loadOlderMessages}
                                 />
                             </div>
                         )}
@@ -413,19 +480,27 @@ function MiraiChat({
     setMessages,
     conversationId,
     setConversationId,
-    setConversationTitle,
+    hasOlder,
+    loadingOlder,
+    onLoadOlder,
 }: {
     messages: ChatMessage[]
     setMessages: React.Dispatch<React.SetStateAction<ChatMessage[]>>
     conversationId: number | null
     setConversationId: React.Dispatch<React.SetStateAction<number | null>>
-    setConversationTitle: React.Dispatch<React.SetStateAction<string | null>>
+    hasOlder: boolean
+    loadingOlder: boolean
+    onLoadOlder: () => void
 }) {
     const [input, setInput] = React.useState('')
     const [isSending, setIsSending] = React.useState(false)
     const controllerRef = React.useRef<AbortController | null>(null)
     const textareaRef = React.useRef<HTMLTextAreaElement | null>(null)
     const messagesEndRef = React.useRef<HTMLDivElement | null>(null)
+    const messagesRef = React.useRef<HTMLDivElement | null>(null)
+    // Scroll height before older messages were prepended, to keep the view in place
+    const prependHeightRef = React.useRef<number | null>(null)
+    const firstIdRef = React.useRef<string | undefined>(undefined)
     const maxHeightRef = React.useRef<number>(0)
     const minHeightRef = React.useRef<number>(0)
 
@@ -523,19 +598,7 @@ function MiraiChat({
         } finally {
             setIsSending(false)
             controllerRef.current = null
-            // After stream completes or fails, try to refresh the title if we have an id
-            try {
-                const id = (typeof conversationId === 'number' && conversationId > 0) ? conversationId : null
-                if (id) {
-                    const r = await fetch(`/api/chat/conversations/${id}`, { credentials: 'include' })
-                    if (r.ok) {
-                        const d = await r.json()
-                        if (d && typeof d.title === 'string' && d.title.trim()) {
-                            setConversationTitle(d.title)
-                        }
-                    }
-                }
-            } catch { }
+            // The title arrives later, pushed over the conversation socket (see App)
         }
     }
 
@@ -569,13 +632,30 @@ function MiraiChat({
         autosize()
     }, [input])
 
-    React.useEffect(() => {
+    React.useLayoutEffect(() => {
+        const el = messagesRef.current
+        const firstId = messages[0]?.id
+        const prepended = prependHeightRef.current !== null && firstId !== firstIdRef.current
+        firstIdRef.current = firstId
+        if (el && prepended) {
+            // Older page prepended: stay on the message that was at the top
+            el.scrollTop += el.scrollHeight - (prependHeightRef.current ?? 0)
+            prependHeightRef.current = null
+            return
+        }
         messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' })
     }, [messages])
 
+    function onMessagesScroll() {
+        const el = messagesRef.current
+        if (!el || !hasOlder || loadingOlder || el.scrollTop > 40) return
+        prependHeightRef.current = el.scrollHeight
+        onLoadOlder()
+    }
+
     return (
         <div className="chat">
-            <div className="chat__messages">
+            <div className="chat__messages" ref={messagesRef} onScroll={onMessagesScroll}>
                 {messages.length === 0 && (
                     <div className="chat__empty">Ask anything. Backend is now connected.</div>
                 )}